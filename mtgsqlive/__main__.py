@@ -1,9 +1,16 @@
 """
 Main Executor
 """
+import sys
+
 import mtgsqlive
 from mtgsqlive.json2sql import main
 
 if __name__ == "__main__":
     mtgsqlive.init_logger()
-    main()
+    if sys.argv[1:2] == ["serve"]:
+        from mtgsqlive.server import main as serve_main
+
+        serve_main(sys.argv[2:])
+    else:
+        main()
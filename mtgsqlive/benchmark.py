@@ -0,0 +1,501 @@
+"""
+Conversion benchmarks over a synthetic MTGJSON corpus
+
+python3 -m mtgsqlive.benchmark -o results.json [--baseline old.json]
+"""
+import argparse
+import cProfile
+import concurrent.futures
+import datetime
+import json
+import logging
+import multiprocessing
+import pathlib
+import platform
+import pstats
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import mtgsqlive
+from mtgsqlive.build import parse_and_import_cards
+from mtgsqlive.card_lists import handle_card_list_rows
+from mtgsqlive.corpus import CorpusScale, write_corpus
+from mtgsqlive.json_stream import JSON_DECODERS, load_json_file
+from mtgsqlive.metrics import format_bytes, peak_rss
+from mtgsqlive.price_summaries import DEFAULT_PRICE_WINDOWS, handle_price_summary_rows
+from mtgsqlive.schema import build_sql_schema
+from mtgsqlive.transforms import (
+    handle_card_row_insertion,
+    handle_foreign_rows,
+    handle_legal_rows,
+    handle_price_point_rows,
+    handle_price_rows,
+    handle_price_series_rows,
+    handle_ruling_rows,
+    handle_set_row_insertion,
+    handle_set_translation_row_insertion,
+    handle_token_row_insertion,
+    sql_dict_insert,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# parse_and_import_cards arguments per scenario; "input" picks
+# AllSets.json ("file") or the AllSetFiles directory ("dir")
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "file": {"input": "file"},
+    "stream-set": {"input": "file", "stream": "set"},
+    "stream-card": {"input": "file", "stream": "card"},
+    "set-files": {"input": "dir"},
+    "set-files-jobs": {"input": "dir", "jobs": 0},
+    "set-files-shard": {"input": "dir", "jobs": 0, "shard": True},
+}
+
+# Slowdown (ratio to the baseline) reported as a regression
+REGRESSION_THRESHOLD = 1.1
+
+PROFILE_ENTRIES = 30
+
+
+def main() -> None:
+    """
+    Generate a corpus, run the benchmarks and write the report
+    """
+    parser = argparse.ArgumentParser(prog="mtgsqlive.benchmark")
+    parser.add_argument(
+        "-o", help="report file (JSON)", metavar="file", required=True
+    )
+    parser.add_argument("--sets", type=int, default=CorpusScale().sets)
+    parser.add_argument(
+        "--cards", help="cards per set", type=int, default=CorpusScale().cards_per_set
+    )
+    parser.add_argument(
+        "--price-dates",
+        help="price history length, in days",
+        type=int,
+        default=CorpusScale().price_dates,
+    )
+    parser.add_argument(
+        "--languages",
+        help="foreign data languages per card",
+        type=int,
+        default=CorpusScale().languages,
+    )
+    parser.add_argument("--seed", type=int, default=CorpusScale().seed)
+    parser.add_argument(
+        "--scenarios",
+        help="comma separated conversion scenarios; default all of: {}".format(
+            ", ".join(SCENARIOS)
+        ),
+        default=",".join(SCENARIOS),
+    )
+    parser.add_argument(
+        "--repeat", help="runs per scenario, the best is kept", type=int, default=3
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        help="keep the generated corpus here instead of a temporary directory",
+        metavar="dir",
+    )
+    parser.add_argument(
+        "--profile",
+        help="profile a conversion and add the hottest functions to the report",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--baseline", help="earlier report to compare against", metavar="file"
+    )
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error("Unknown scenario(s) {}".format(", ".join(unknown)))
+
+    scale = CorpusScale(
+        sets=args.sets,
+        cards_per_set=args.cards,
+        price_dates=args.price_dates,
+        languages=args.languages,
+        seed=args.seed,
+    )
+    report_file = pathlib.Path(args.o).expanduser()
+
+    with tempfile.TemporaryDirectory(prefix="mtgsqlive_bench_") as temp_dir:
+        corpus_dir = pathlib.Path(args.corpus_dir or temp_dir).expanduser()
+        report = run_benchmarks(
+            scale,
+            corpus_dir,
+            pathlib.Path(temp_dir),
+            scenarios,
+            args.repeat,
+            report_file.with_suffix(".pstats") if args.profile else None,
+        )
+
+    with report_file.open("w", encoding="utf8") as output:
+        json.dump(report, output, indent=2)
+    LOGGER.info(f"Wrote {report_file}")
+
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text(encoding="utf8"))
+        if compare_reports(baseline, report):
+            sys.exit(1)
+
+
+def run_benchmarks(
+    scale: CorpusScale,
+    corpus_dir: pathlib.Path,
+    work_dir: pathlib.Path,
+    scenarios: List[str],
+    repeat: int,
+    profile_file: Optional[pathlib.Path] = None,
+) -> Dict[str, Any]:
+    """
+    :param scale: Corpus size
+    :param corpus_dir: Directory for the corpus files
+    :param work_dir: Directory for the output databases
+    :param scenarios: Conversion scenarios to time
+    :param repeat: Runs per scenario
+    :param profile_file: Where to save profiler stats, None to skip profiling
+    :return: Report
+    """
+    all_sets_file, set_files_dir = write_corpus(corpus_dir, scale)
+    report: Dict[str, Any] = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "scale": scale._asdict(),
+        "input_bytes": all_sets_file.stat().st_size,
+        "scenarios": {},
+    }
+
+    # Each run gets a fresh process, so its peak memory is its own
+    for name in scenarios:
+        settings = dict(SCENARIOS[name])
+        input_file = all_sets_file if settings.pop("input") == "file" else set_files_dir
+        runs = []
+        for run in range(repeat):
+            output_file = work_dir.joinpath(f"{name}_{run}.sqlite")
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                runs.append(
+                    executor.submit(
+                        time_conversion, input_file, output_file, settings
+                    ).result()
+                )
+            output_file.unlink()
+
+        best = min(runs, key=lambda result: result["seconds"])
+        report["scenarios"][name] = {
+            **best,
+            "rows_per_second": best["rows"] / best["seconds"],
+            "runs": [result["seconds"] for result in runs],
+        }
+        LOGGER.info(
+            "{}: {:.2f}s, {:.0f} rows/sec, peak RSS {}".format(
+                name,
+                best["seconds"],
+                report["scenarios"][name]["rows_per_second"],
+                format_bytes(best["peak_rss_bytes"]),
+            )
+        )
+
+    report["decoders"] = time_decoders(all_sets_file, repeat)
+    for decoder in report["decoders"]:
+        LOGGER.info(
+            "decode with {}: {:.2f}s, peak RSS {}".format(
+                decoder["name"],
+                decoder["seconds"],
+                format_bytes(decoder["peak_rss_bytes"]),
+            )
+        )
+
+    all_sets = load_json_file(all_sets_file)
+    report["transforms"] = time_transforms(all_sets)
+    for transform in report["transforms"]:
+        LOGGER.info(
+            "{name}: {calls} calls, {microseconds_per_call:.1f}us per call".format(
+                **transform
+            )
+        )
+
+    if profile_file:
+        report["profile"] = profile_conversion(
+            all_sets_file, work_dir.joinpath("profile.sqlite"), profile_file
+        )
+
+    return report
+
+
+def time_conversion(
+    input_file: pathlib.Path, output_file: pathlib.Path, settings: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Convert the input into a new database. Runs in its own process.
+    :param input_file: AllSets.json file or AllSetFiles directory
+    :param output_file: Database to create
+    :param settings: parse_and_import_cards keyword arguments
+    :return: Seconds taken, rows written and peak RSS of the process
+    """
+    sql_connection = sqlite3.connect(str(output_file))
+    build_sql_schema(sql_connection)
+
+    start_time = time.perf_counter()
+    parse_and_import_cards(input_file, sql_connection, **settings)
+    seconds = time.perf_counter() - start_time
+
+    row_count = sum(
+        sql_connection.execute(f"SELECT COUNT(*) FROM `{table}`").fetchone()[0]
+        for (table,) in sql_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+    )
+    sql_connection.close()
+
+    return {"seconds": seconds, "rows": row_count, "peak_rss_bytes": peak_rss()}
+
+
+def time_decoders(all_sets_file: pathlib.Path, repeat: int) -> List[Dict[str, Any]]:
+    """
+    Time loading the whole input with each available JSON decoder,
+    each run in a fresh process so its peak memory is its own
+    :param all_sets_file: AllSets.json file
+    :param repeat: Runs per decoder, the best is kept
+    :return: Best seconds, and peak RSS of that run, per decoder
+    """
+    results = []
+    for name in JSON_DECODERS:
+        runs = []
+        for _ in range(repeat):
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                runs.append(
+                    executor.submit(time_decode, all_sets_file, name).result()
+                )
+        results.append({"name": name, **min(runs, key=lambda run: run["seconds"])})
+    return results
+
+
+def time_decode(all_sets_file: pathlib.Path, decoder: str) -> Dict[str, Any]:
+    """
+    Load the whole input. Runs in its own process.
+    :param all_sets_file: AllSets.json file
+    :param decoder: Decoder from JSON_DECODERS
+    :return: Seconds taken and peak RSS of the process
+    """
+    start_time = time.perf_counter()
+    load_json_file(all_sets_file, decoder)
+    seconds = time.perf_counter() - start_time
+    return {"seconds": seconds, "peak_rss_bytes": peak_rss()}
+
+
+def time_transforms(all_sets: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Time the row transforms over every item of the corpus they
+    apply to, and sql_dict_insert over every row they produce
+    :param all_sets: Decoded AllSets.json
+    :return: Timing per function
+    """
+    calls: Dict[Callable, List[Tuple[Any, ...]]] = {
+        handle_set_row_insertion: [],
+        handle_set_translation_row_insertion: [],
+        handle_token_row_insertion: [],
+        handle_card_row_insertion: [],
+        handle_foreign_rows: [],
+        handle_legal_rows: [],
+        handle_ruling_rows: [],
+        handle_price_rows: [],
+        handle_price_point_rows: [],
+        handle_price_series_rows: [],
+        handle_price_summary_rows: [],
+        handle_card_list_rows: [],
+    }
+    card_key_handlers = {
+        "foreignData": handle_foreign_rows,
+        "legalities": handle_legal_rows,
+        "rulings": handle_ruling_rows,
+        "prices": handle_price_rows,
+    }
+
+    for set_code, set_data in all_sets.items():
+        calls[handle_set_row_insertion].append((set_data,))
+        for language, translation in (set_data.get("translations") or {}).items():
+            calls[handle_set_translation_row_insertion].append(
+                (language, translation, set_code)
+            )
+        for token in set_data.get("tokens") or []:
+            calls[handle_token_row_insertion].append((token, set_code))
+        for card in set_data.get("cards") or []:
+            calls[handle_card_row_insertion].append((card, set_code))
+            calls[handle_card_list_rows].append((card, card["uuid"]))
+            for key, handler in card_key_handlers.items():
+                if key in card:
+                    calls[handler].append((card, card["uuid"]))
+            if "prices" in card:
+                calls[handle_price_point_rows].append((card, card["uuid"]))
+                calls[handle_price_series_rows].append((card, card["uuid"]))
+                calls[handle_price_summary_rows].append(
+                    (card, card["uuid"], DEFAULT_PRICE_WINDOWS)
+                )
+
+    results = [
+        time_calls(function.__name__, function, arguments)
+        for function, arguments in calls.items()
+    ]
+
+    # sql_dict_insert, one statement per row into an in-memory database
+    sql_connection = sqlite3.connect(":memory:")
+    build_sql_schema(sql_connection)
+    insert_calls: List[Tuple[Any, ...]] = []
+    for card, set_code in calls[handle_card_row_insertion]:
+        for table, rows in handle_card_row_insertion(card, set_code).items():
+            for row in [rows] if table == "cards" else rows:
+                insert_calls.append((row, table, sql_connection))
+    results.append(time_calls("sql_dict_insert", sql_dict_insert, insert_calls))
+    sql_connection.close()
+
+    return results
+
+
+def time_calls(
+    name: str, function: Callable, arguments: List[Tuple[Any, ...]]
+) -> Dict[str, Any]:
+    """
+    :param name: Name to report
+    :param function: Function to time
+    :param arguments: Positional arguments of each call
+    :return: Number of calls, total seconds and microseconds per call
+    """
+    start_time = time.perf_counter()
+    for call_arguments in arguments:
+        function(*call_arguments)
+    seconds = time.perf_counter() - start_time
+
+    return {
+        "name": name,
+        "calls": len(arguments),
+        "seconds": seconds,
+        "microseconds_per_call": seconds / len(arguments) * 1e6 if arguments else 0.0,
+    }
+
+
+def profile_conversion(
+    input_file: pathlib.Path, output_file: pathlib.Path, profile_file: pathlib.Path
+) -> List[Dict[str, Any]]:
+    """
+    Profile a whole conversion of the input
+    :param input_file: AllSets.json file
+    :param output_file: Database to create
+    :param profile_file: Where to save the full profiler stats
+    :return: Functions with the most cumulative time
+    """
+    sql_connection = sqlite3.connect(str(output_file))
+    build_sql_schema(sql_connection)
+
+    profiler = cProfile.Profile()
+    profiler.runcall(parse_and_import_cards, input_file, sql_connection)
+    sql_connection.close()
+    profiler.dump_stats(str(profile_file))
+    LOGGER.info(f"Wrote profile to {profile_file}")
+
+    stats = pstats.Stats(profiler)
+    entries = sorted(
+        stats.stats.items(),  # type: ignore
+        key=lambda entry: entry[1][3],
+        reverse=True,
+    )
+    return [
+        {
+            "function": "{}:{}({})".format(*function),
+            "calls": call_count,
+            "own_seconds": own_time,
+            "cumulative_seconds": cumulative_time,
+        }
+        for function, (_, call_count, own_time, cumulative_time, _) in entries[
+            :PROFILE_ENTRIES
+        ]
+    ]
+
+
+def compare_reports(baseline: Dict[str, Any], report: Dict[str, Any]) -> bool:
+    """
+    Log how the timings moved since an earlier report
+    :param baseline: Earlier report
+    :param report: New report
+    :return: True if anything got slower than REGRESSION_THRESHOLD allows
+    """
+    if baseline.get("scale") != report["scale"]:
+        LOGGER.warning("Baseline was run on a different corpus scale, not comparing")
+        return False
+
+    pairs: List[Tuple[str, float, float]] = []
+    for name, result in report["scenarios"].items():
+        if name in baseline.get("scenarios", {}):
+            pairs.append(
+                (name, baseline["scenarios"][name]["seconds"], result["seconds"])
+            )
+
+    baseline_decoders = {
+        decoder["name"]: decoder for decoder in baseline.get("decoders", [])
+    }
+    for decoder in report["decoders"]:
+        if decoder["name"] in baseline_decoders:
+            pairs.append(
+                (
+                    "decode with " + decoder["name"],
+                    baseline_decoders[decoder["name"]]["seconds"],
+                    decoder["seconds"],
+                )
+            )
+
+    baseline_transforms = {
+        transform["name"]: transform for transform in baseline.get("transforms", [])
+    }
+    for transform in report["transforms"]:
+        old_transform = baseline_transforms.get(transform["name"])
+        if old_transform and old_transform["calls"] == transform["calls"]:
+            pairs.append(
+                (transform["name"], old_transform["seconds"], transform["seconds"])
+            )
+
+    regressed = False
+    for name, old_seconds, new_seconds in pairs:
+        ratio = new_seconds / old_seconds if old_seconds else 1.0
+        if ratio > REGRESSION_THRESHOLD:
+            regressed = True
+            LOGGER.warning(f"{name}: {ratio:.2f}x slower than baseline")
+        else:
+            LOGGER.info(f"{name}: {ratio:.2f}x of baseline")
+
+    return regressed
+
+
+def get_revision() -> Optional[str]:
+    """
+    :return: Git revision of the checkout, if it is one
+    """
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=str(mtgsqlive.TOP_LEVEL_DIR),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    mtgsqlive.init_logger()
+    main()
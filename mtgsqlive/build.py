@@ -0,0 +1,326 @@
+"""
+Build orchestration: reading the input (whole, streamed or as set
+files), worker processes and shards, and per-set checkpoints
+"""
+import collections
+import concurrent.futures
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from mtgsqlive.checkpoints import (
+    DEFAULT_CHECKPOINT_ROWS,
+    SetCheckpoints,
+    record_finished_set,
+)
+from mtgsqlive.json_stream import (
+    find_set_files,
+    get_json_decoder,
+    iter_set_file_items,
+    iter_set_items,
+    iter_sets,
+    load_json_file,
+    open_json_file,
+    set_json_decoder,
+    strip_json_suffix,
+)
+from mtgsqlive.metrics import PipelineMetrics
+from mtgsqlive.schema import BuildOptions, build_sql_schema
+from mtgsqlive.shards import merge_shard_databases, partition_by_size
+from mtgsqlive.sql_writer import (
+    DEFAULT_BATCH_SIZE,
+    RowBuffer,
+    RowGroup,
+    SqlBatchWriter,
+)
+from mtgsqlive.transforms import sql_insert_set, sql_insert_set_items
+
+LOGGER = logging.getLogger(__name__)
+
+
+def parse_and_import_cards(
+    input_file: pathlib.Path,
+    sql_connection: sqlite3.Connection,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    stream: Optional[str] = None,
+    jobs: int = 1,
+    shard: bool = False,
+    options: BuildOptions = BuildOptions(),
+    metrics: Optional[PipelineMetrics] = None,
+    checkpoint_rows: int = DEFAULT_CHECKPOINT_ROWS,
+    finished_sets: Optional[Set[str]] = None,
+    sinks: Sequence[RowBuffer] = (),
+) -> Dict[str, int]:
+    """
+    Parse the JSON cards and input them into the database
+    :param input_file: AllSets.json file
+    :param sql_connection: Database connection
+    :param batch_size: Rows buffered per table before they are written
+    :param stream: Incremental parsing granularity ("set" or "card"), or
+    None to load each input file whole
+    :param jobs: Worker processes for AllSetFiles mode (0 = one per CPU)
+    :param shard: Have workers write shard databases instead of
+    sending rows back
+    :param options: Optional layouts the schema was built with
+    :param metrics: Stage timers to book the conversion on
+    :param checkpoint_rows: Rows written between commits (made between sets)
+    :param finished_sets: Sets an interrupted build already committed,
+    to be skipped
+    :param sinks: Export sinks getting every row as well; not fed in
+    shard mode, whose rows don't go through this process's writer
+    :return: Rows written per table
+    """
+    writer = SqlBatchWriter(sql_connection, batch_size, metrics, sinks)
+    metrics = writer.metrics
+    checkpoints = SetCheckpoints(writer, checkpoint_rows)
+    finished_sets = finished_sets or set()
+    jobs = jobs or os.cpu_count() or 1
+
+    # Set files of finished sets are skipped without being read
+    set_files: List[pathlib.Path] = []
+    if input_file.is_dir():
+        set_files = [
+            set_file
+            for set_file in find_set_files(input_file)
+            if strip_json_suffix(set_file) not in finished_sets
+        ]
+
+    if input_file.is_file() and jobs > 1:
+        LOGGER.warning("--jobs only applies to AllSetFiles directory input, ignoring")
+
+    if input_file.is_file():
+        if stream == "card":
+            LOGGER.info("Streaming cards from JSON")
+            with open_json_file(input_file) as json_file:
+                set_items = metrics.timed_iter("decode", iter_set_items(json_file))
+                sql_insert_set_items(
+                    (item for item in set_items if item[0] not in finished_sets),
+                    writer,
+                    options,
+                    checkpoints,
+                )
+        elif stream == "set":
+            LOGGER.info("Streaming sets from JSON")
+            with open_json_file(input_file) as json_file:
+                for set_code, set_data in metrics.timed_iter(
+                    "decode", iter_sets(json_file)
+                ):
+                    if set_code in finished_sets:
+                        continue
+                    LOGGER.info("Inserting set row for {}".format(set_code))
+                    sql_insert_set(set_code, set_data, writer, options=options)
+                    checkpoints.set_finished(set_code)
+        else:
+            LOGGER.info("Loading JSON into memory")
+            metrics.start_stage("decode")
+            json_data = load_json_file(input_file)
+            metrics.end_stage()
+
+            LOGGER.info("Building sets")
+            for set_code, set_data in json_data.items():
+                if set_code in finished_sets:
+                    continue
+                LOGGER.info("Inserting set row for {}".format(set_code))
+                sql_insert_set(set_code, set_data, writer, options=options)
+                checkpoints.set_finished(set_code)
+    elif input_file.is_dir() and jobs > 1 and shard:
+        LOGGER.info("Building set files into {} shard databases".format(jobs))
+        for table, row_count in build_and_merge_shards(
+            set_files,
+            sql_connection,
+            jobs,
+            batch_size,
+            options,
+            metrics,
+        ).items():
+            writer.count_rows(table, row_count)
+    elif input_file.is_dir() and jobs > 1:
+        LOGGER.info("Converting set files with {} worker processes".format(jobs))
+        converted_sets = iter_converted_set_files(iter(set_files), jobs, options)
+        for set_code, row_groups, stage_seconds in metrics.timed_iter(
+            "workers", converted_sets
+        ):
+            LOGGER.info("Building set: {}".format(set_code))
+            metrics.add_worker_seconds(stage_seconds)
+            metrics.start_stage("transform")
+            writer.insert_groups(row_groups)
+            metrics.end_stage()
+            checkpoints.set_finished(set_code)
+    elif input_file.is_dir():
+        for setFile in set_files:
+            set_code = strip_json_suffix(setFile)
+            if stream == "card":
+                LOGGER.info("Streaming set: {}".format(set_code))
+                with open_json_file(setFile) as json_file:
+                    sql_insert_set_items(
+                        metrics.timed_iter(
+                            "decode", iter_set_file_items(json_file, set_code)
+                        ),
+                        writer,
+                        options,
+                        checkpoints,
+                    )
+                continue
+
+            LOGGER.info("Loading {} into memory...".format(setFile.name))
+            metrics.start_stage("decode")
+            set_data = load_json_file(setFile)
+            metrics.end_stage()
+            LOGGER.info("Building set: {}".format(set_code))
+            sql_insert_set(set_code, set_data, writer, options=options)
+            checkpoints.set_finished(set_code)
+
+    writer.close()
+    return writer.table_counts
+
+
+def build_and_merge_shards(
+    set_files: List[pathlib.Path],
+    sql_connection: sqlite3.Connection,
+    jobs: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    options: BuildOptions = BuildOptions(),
+    metrics: Optional[PipelineMetrics] = None,
+) -> Dict[str, int]:
+    """
+    Build set files into one shard database per worker, then merge
+    the shards into the target database. Shards are created next to
+    the target file and removed afterwards.
+    :param set_files: Set files to convert
+    :param sql_connection: Target database, with its schema built
+    :param jobs: Worker processes (and shards)
+    :param batch_size: Rows buffered per table before they are written
+    :param options: Optional layouts the schema was built with
+    :param metrics: Stage timers to book the build and merge on
+    :return: Rows merged per table
+    """
+    metrics = metrics or PipelineMetrics()
+    database_file = sql_connection.execute("PRAGMA database_list").fetchone()[2]
+    shard_dir = pathlib.Path(
+        tempfile.mkdtemp(
+            prefix=".shards-",
+            dir=str(pathlib.Path(database_file).parent) if database_file else None,
+        )
+    )
+
+    try:
+        shard_paths = [
+            shard_dir.joinpath(f"shard_{index}.sqlite")
+            for index in range(min(jobs, len(set_files)))
+        ]
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=set_json_decoder,
+            initargs=(get_json_decoder()[0],),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    build_shard, shard_path, shard_files, batch_size, options
+                )
+                for shard_path, shard_files in zip(
+                    shard_paths, partition_by_size(set_files, len(shard_paths))
+                )
+            ]
+            metrics.start_stage("workers")
+            for future in futures:
+                metrics.add_worker_seconds(future.result())
+            metrics.end_stage()
+
+        metrics.start_stage("merge")
+        table_counts = merge_shard_databases(sql_connection, shard_paths)
+        metrics.end_stage()
+        return table_counts
+    finally:
+        shutil.rmtree(str(shard_dir), ignore_errors=True)
+
+
+def build_shard(
+    shard_path: pathlib.Path,
+    set_files: List[pathlib.Path],
+    batch_size: int,
+    options: BuildOptions,
+) -> Dict[str, float]:
+    """
+    Convert set files into a standalone shard database.
+    Runs in a worker process.
+    :param shard_path: Shard database to create
+    :param set_files: Set files to convert into it
+    :param batch_size: Rows buffered per table before they are written
+    :param options: Optional layouts to build
+    :return: Seconds spent per stage
+    """
+    shard_connection = sqlite3.connect(str(shard_path))
+    try:
+        # Shards are throwaway files, durability doesn't matter
+        shard_connection.execute("pragma journal_mode=off;")
+        shard_connection.execute("pragma synchronous=off;")
+        # Uniqueness is enforced by the target database on merge
+        build_sql_schema(shard_connection, defer_constraints=True, options=options)
+
+        writer = SqlBatchWriter(shard_connection, batch_size)
+        for set_file in set_files:
+            set_code = strip_json_suffix(set_file)
+            LOGGER.info("Building set {} into {}".format(set_code, shard_path.name))
+            writer.metrics.start_stage("decode")
+            set_data = load_json_file(set_file)
+            writer.metrics.end_stage()
+            sql_insert_set(set_code, set_data, writer, options=options)
+            # Merged along with the set's rows
+            record_finished_set(writer, set_code)
+        writer.close()
+        return writer.metrics.stage_seconds
+    finally:
+        shard_connection.close()
+
+
+def iter_converted_set_files(
+    set_files: Iterator[pathlib.Path],
+    jobs: int,
+    options: BuildOptions = BuildOptions(),
+) -> Iterator[Tuple[str, List[RowGroup], Dict[str, float]]]:
+    """
+    Convert set files in a process pool, yielding their rows in
+    input order. Only a few sets per worker are in flight at once,
+    so a slow writer doesn't let converted rows pile up in memory.
+    :param set_files: Set files to convert
+    :param jobs: Worker processes
+    :param options: Optional layouts to convert for
+    :return: Iterator of (set code, row groups, seconds per stage)
+    """
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=set_json_decoder,
+        initargs=(get_json_decoder()[0],),
+    ) as executor:
+        pending: Deque[concurrent.futures.Future] = collections.deque()
+        for set_file in set_files:
+            pending.append(executor.submit(convert_set_file, set_file, options))
+            if len(pending) >= jobs * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def convert_set_file(
+    set_file: pathlib.Path, options: BuildOptions
+) -> Tuple[str, List[RowGroup], Dict[str, float]]:
+    """
+    Parse one set file and run the row transforms on it.
+    Runs in a worker process.
+    :param set_file: Set file from AllSetFiles
+    :param options: Optional layouts to convert for
+    :return: Set code, its rows grouped per table and column shape,
+    and the seconds spent per stage
+    """
+    set_code = strip_json_suffix(set_file)
+    row_buffer = RowBuffer()
+    row_buffer.metrics.start_stage("decode")
+    set_data = load_json_file(set_file)
+    row_buffer.metrics.end_stage()
+    sql_insert_set(set_code, set_data, row_buffer, options=options)
+    return set_code, row_buffer.drain(), row_buffer.metrics.stage_seconds
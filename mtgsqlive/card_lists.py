@@ -0,0 +1,63 @@
+"""
+Junction tables holding the list attributes of cards (colors,
+types, printings, ...) as one row per card and value
+"""
+import sqlite3
+from typing import Any, Dict, List, NamedTuple
+
+
+class CardListTable(NamedTuple):
+    """
+    Junction table of one list attribute
+    """
+
+    table: str
+    key: str
+    column: str
+
+
+# The cards table keeps these lists as comma separated text, which can
+# only be searched with LIKE. Their junction tables are indexed by value.
+CARD_LIST_TABLES: List[CardListTable] = [
+    CardListTable("card_colors", "colors", "color"),
+    CardListTable("card_color_identities", "colorIdentity", "color"),
+    CardListTable("card_types", "types", "type"),
+    CardListTable("card_subtypes", "subtypes", "subtype"),
+    CardListTable("card_supertypes", "supertypes", "supertype"),
+    CardListTable("card_printings", "printings", "setCode"),
+    CardListTable("card_names", "names", "name"),
+]
+
+
+def build_card_list_schema(sql_connection: sqlite3.Connection, card_key: str) -> None:
+    """
+    Create the junction tables
+    :param sql_connection: Connection to the database
+    :param card_key: Column definition referencing the card
+    """
+    for spec in CARD_LIST_TABLES:
+        sql_connection.execute(
+            f"CREATE TABLE `{spec.table}` ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            f"{spec.column} TEXT NOT NULL,"
+            f"{card_key}"
+            ")"
+        )
+
+
+def handle_card_list_rows(
+    card_data: Dict[str, Any], card_uuid: str
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Split the list attributes of a card into junction table rows
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :return: Rows, keyed by junction table
+    """
+    return {
+        spec.table: [
+            {spec.column: value, "uuid": card_uuid}
+            for value in card_data.get(spec.key) or []
+        ]
+        for spec in CARD_LIST_TABLES
+    }
@@ -0,0 +1,119 @@
+"""
+Per-set checkpoints, so an interrupted build can be resumed
+"""
+import logging
+import sqlite3
+from typing import Optional, Set
+
+from mtgsqlive.sql_writer import RowBuffer, SqlBatchWriter
+
+LOGGER = logging.getLogger(__name__)
+
+# Rows written between two commits; commits only happen between sets
+DEFAULT_CHECKPOINT_ROWS: int = 100000
+
+# Sets whose rows are committed, until the build finishes
+BUILD_PROGRESS_TABLE: str = "build_progress"
+
+
+def build_progress_schema(sql_connection: sqlite3.Connection) -> None:
+    """
+    Create the table recording the finished sets of a build
+    :param sql_connection: Connection to the database
+    """
+    sql_connection.execute(
+        f"CREATE TABLE IF NOT EXISTS `{BUILD_PROGRESS_TABLE}` ("
+        "setCode TEXT PRIMARY KEY"
+        ")"
+    )
+
+
+def get_finished_sets(sql_connection: sqlite3.Connection) -> Optional[Set[str]]:
+    """
+    :param sql_connection: Connection to the database
+    :return: Sets committed by an unfinished build, None if the
+    database holds no unfinished build
+    """
+    (table_count,) = sql_connection.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (BUILD_PROGRESS_TABLE,),
+    ).fetchone()
+    if not table_count:
+        return None
+
+    return {
+        set_code
+        for (set_code,) in sql_connection.execute(
+            f"SELECT setCode FROM `{BUILD_PROGRESS_TABLE}`"
+        )
+    }
+
+
+def drop_build_progress(sql_connection: sqlite3.Connection) -> None:
+    """
+    Mark the build as finished
+    :param sql_connection: Connection to the database
+    """
+    sql_connection.execute(f"DROP TABLE IF EXISTS `{BUILD_PROGRESS_TABLE}`")
+    sql_connection.commit()
+
+
+def record_finished_set(writer: RowBuffer, set_code: str) -> None:
+    """
+    Queue the progress row of a set, after all of its rows
+    :param writer: Batched DB writer
+    :param set_code: Set that was converted
+    """
+    writer.insert({"setCode": set_code}, BUILD_PROGRESS_TABLE)
+
+
+class SetCheckpoints:
+    """
+    Commit a build between sets, once enough rows were written since
+    the last commit. A set's rows and its progress row always land in
+    the same transaction, so the progress table never lists a set that
+    is only partly written. Each commit is followed by a WAL checkpoint
+    that truncates the WAL, keeping it bounded by the rows of one
+    checkpoint instead of growing with the whole build.
+    """
+
+    def __init__(
+        self, writer: SqlBatchWriter, checkpoint_rows: int = DEFAULT_CHECKPOINT_ROWS
+    ) -> None:
+        """
+        :param writer: Batched DB writer of the build
+        :param checkpoint_rows: Rows between commits, 0 to commit after every set
+        """
+        if checkpoint_rows < 0:
+            raise ValueError(f"Checkpoint rows can't be negative ({checkpoint_rows})")
+
+        self.writer = writer
+        self.checkpoint_rows = checkpoint_rows
+        self.checkpoint_count = 0
+        self._rows_at_checkpoint = writer.rows_written
+
+    def set_finished(self, set_code: str) -> None:
+        """
+        Record a set as converted, and commit if it's time to
+        :param set_code: Set whose rows were all queued
+        """
+        record_finished_set(self.writer, set_code)
+        if self.writer.rows_written - self._rows_at_checkpoint >= self.checkpoint_rows:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """
+        Write and commit every queued row, then checkpoint the WAL
+        """
+        metrics = self.writer.metrics
+        self.writer.flush()
+        metrics.start_stage("commit")
+        self.writer.sql_connection.commit()
+        self.writer.sql_connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        metrics.end_stage()
+
+        self.checkpoint_count += 1
+        self._rows_at_checkpoint = self.writer.rows_written
+        LOGGER.debug(
+            "Checkpoint %d at %d rows", self.checkpoint_count, self._rows_at_checkpoint
+        )
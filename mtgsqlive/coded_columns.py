@@ -0,0 +1,249 @@
+"""
+Integer-coded columns: values stored as ids into a lookup table
+"""
+import sqlite3
+from typing import Dict, List, NamedTuple, Tuple
+
+
+class CodedColumn(NamedTuple):
+    """
+    A column that converted rows carry as a value (i.e. a card uuid
+    or a price type name) but that is stored as the id of that value
+    in a lookup table
+    """
+
+    table: str
+    source: str
+    target: str
+    lookup_table: str
+
+
+# Lookup tables filled from the input rows themselves, with their natural
+# key. The writer assigns their ids up front so other rows can refer to them.
+ROW_LOOKUP_TABLES: Dict[str, str] = {"cards": "uuid", "cards_interned": "uuid"}
+
+# Every other lookup table is (id INTEGER PRIMARY KEY, name TEXT UNIQUE) and
+# gets a new entry the first time a value is seen
+INTERNED_LOOKUP_KEY: str = "name"
+
+# Lookup table of each string column that --interned stores as an id
+# (the column gets an "Id" suffix, i.e. artist becomes artistId).
+# Only the columns of INTERNED_STRING_COLUMNS are interned: "type" is the
+# price type of card_prices and card_price_summaries, not the type line
+# of cards.
+STRING_LOOKUP_TABLES: Dict[str, str] = {
+    "artist": "artists",
+    "borderColor": "border_colors",
+    "format": "legality_formats",
+    "frameVersion": "frame_versions",
+    "language": "languages",
+    "layout": "layouts",
+    "rarity": "rarities",
+    "setCode": "set_codes",
+    "status": "legality_statuses",
+    "type": "price_types",
+    "watermark": "watermarks",
+}
+
+# Interned string columns of each --interned table
+INTERNED_STRING_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "cards_interned": (
+        "artist",
+        "borderColor",
+        "frameVersion",
+        "layout",
+        "rarity",
+        "setCode",
+        "watermark",
+    ),
+    "tokens_interned": ("artist", "borderColor", "layout", "setCode", "watermark"),
+    "card_foreignData": ("language",),
+    "card_legalities": ("format", "status"),
+    "legalities_other": ("format", "status"),
+    "card_prices": ("type",),
+    "card_price_summaries": ("type",),
+}
+
+# Tables whose rows reference a card, by cards.id
+CARD_ID_CODED_TABLES: Tuple[str, ...] = (
+    "card_foreignData",
+    "card_legalities",
+    "card_rulings",
+    "card_prices",
+    "card_price_summaries",
+    "legalities_wide",
+    "legalities_other",
+    "price_points",
+    "price_series",
+    "card_colors",
+    "card_color_identities",
+    "card_types",
+    "card_subtypes",
+    "card_supertypes",
+    "card_printings",
+    "card_names",
+)
+
+# Only entries whose table, lookup table and id column exist are in use
+CODED_COLUMNS: List[CodedColumn] = (
+    [
+        CodedColumn(table, "uuid", "cardId", card_table)
+        for card_table in ("cards", "cards_interned")
+        for table in CARD_ID_CODED_TABLES
+    ]
+    + [
+        CodedColumn("price_points", "type", "typeId", "price_types"),
+        CodedColumn("price_series", "type", "typeId", "price_types"),
+    ]
+    + [
+        CodedColumn(table, column, f"{column}Id", STRING_LOOKUP_TABLES[column])
+        for table, columns in INTERNED_STRING_COLUMNS.items()
+        for column in columns
+    ]
+)
+
+
+def lookup_key(lookup_table: str) -> str:
+    """
+    :param lookup_table: Lookup table name
+    :return: Column holding the natural key of the lookup table
+    """
+    return ROW_LOOKUP_TABLES.get(lookup_table, INTERNED_LOOKUP_KEY)
+
+
+def get_coded_columns(
+    sql_connection: sqlite3.Connection
+) -> Dict[str, List[CodedColumn]]:
+    """
+    Find the coded columns that the database's schema uses
+    :param sql_connection: Database connection
+    :return: Coded columns per table
+    """
+    tables = {
+        name
+        for (name,) in sql_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+
+    coded_columns: Dict[str, List[CodedColumn]] = {}
+    for coded in CODED_COLUMNS:
+        if coded.table not in tables or coded.lookup_table not in tables:
+            continue
+        columns = {
+            column[1]
+            for column in sql_connection.execute(
+                f"PRAGMA table_info(`{coded.table}`)"
+            )
+        }
+        if coded.target in columns:
+            coded_columns.setdefault(coded.table, []).append(coded)
+
+    return coded_columns
+
+
+def interned_lookup_tables(coded_columns: Dict[str, List[CodedColumn]]) -> List[str]:
+    """
+    :param coded_columns: Coded columns in use
+    :return: Interned lookup tables they point into
+    """
+    lookup_tables: List[str] = []
+    for coded_list in coded_columns.values():
+        for coded in coded_list:
+            if (
+                coded.lookup_table not in ROW_LOOKUP_TABLES
+                and coded.lookup_table not in lookup_tables
+            ):
+                lookup_tables.append(coded.lookup_table)
+    return lookup_tables
+
+
+def decode_expression(coded: CodedColumn, value: str, schema: str = "main") -> str:
+    """
+    SQL expression turning a stored code back into its value
+    :param coded: Coded column
+    :param value: SQL expression holding the code
+    :param schema: Schema of the lookup table
+    :return: Scalar subquery
+    """
+    return "(SELECT `{}` FROM {}.`{}` WHERE id = {})".format(
+        lookup_key(coded.lookup_table), schema, coded.lookup_table, value
+    )
+
+
+def encode_expression(coded: CodedColumn, value: str, schema: str = "main") -> str:
+    """
+    SQL expression turning a value into its stored code
+    :param coded: Coded column
+    :param value: SQL expression holding the value
+    :param schema: Schema of the lookup table
+    :return: Scalar subquery
+    """
+    return "(SELECT id FROM {}.`{}` WHERE `{}` = {})".format(
+        schema, coded.lookup_table, lookup_key(coded.lookup_table), value
+    )
+
+
+def decoded_columns(
+    sql_connection: sqlite3.Connection,
+    table: str,
+    coded_list: List[CodedColumn],
+    alias: str = "t",
+) -> Tuple[Dict[str, str], str]:
+    """
+    Read a table with its coded columns turned back into values, by
+    joining their lookup tables. Joins (unlike scalar subqueries) let
+    the planner filter on a value through the lookup table's key index.
+    :param sql_connection: Database connection
+    :param table: Table to read
+    :param coded_list: Coded columns of the table
+    :param alias: Alias of the table in the FROM clause
+    :return: Expression per column, in table order and named as before
+    coding, and the FROM clause they select from
+    """
+    coded_by_target = {coded.target: coded for coded in coded_list}
+    expressions: Dict[str, str] = {}
+    joins = [f"`{table}` AS {alias}"]
+
+    for column in sql_connection.execute(f"PRAGMA table_info(`{table}`)"):
+        name = column[1]
+        coded = coded_by_target.get(name)
+        if coded is None:
+            expressions[name] = f"{alias}.`{name}`"
+            continue
+
+        # Card references always resolve; interned strings may be NULL
+        lookup_alias = f"{alias}_{coded.source}"
+        join = "JOIN" if coded.lookup_table in ROW_LOOKUP_TABLES else "LEFT JOIN"
+        joins.append(
+            f"{join} `{coded.lookup_table}` AS {lookup_alias} "
+            f"ON {lookup_alias}.id = {alias}.`{name}`"
+        )
+        expressions[coded.source] = (
+            f"{lookup_alias}.`{lookup_key(coded.lookup_table)}`"
+        )
+
+    return expressions, " ".join(joins)
+
+
+def create_decoded_view(
+    sql_connection: sqlite3.Connection,
+    view: str,
+    table: str,
+    coded_list: List[CodedColumn],
+) -> None:
+    """
+    Present a table with coded columns under another name, with
+    the columns it would have without coding
+    :param sql_connection: Database connection
+    :param view: View name
+    :param table: Table with coded columns
+    :param coded_list: Coded columns of the table
+    """
+    expressions, from_clause = decoded_columns(sql_connection, table, coded_list)
+    select_list = ", ".join(
+        f"{expression} AS `{name}`" for name, expression in expressions.items()
+    )
+    sql_connection.execute(
+        f"CREATE VIEW `{view}` AS SELECT {select_list} FROM {from_clause}"
+    )
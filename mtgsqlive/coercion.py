@@ -0,0 +1,130 @@
+"""
+Per-table value coercion, compiled once from the table's columns
+"""
+import json
+import logging
+import sqlite3
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+LOGGER = logging.getLogger(__name__)
+
+Coercion = Callable[[Any], Any]
+RowConverter = Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]
+
+# TEXT columns holding a list of strings, stored comma separated
+LIST_KEYS: Set[str] = {
+    "colorIdentity",
+    "colorIndicator",
+    "colors",
+    "names",
+    "printings",
+    "reverseRelated",
+    "subtypes",
+    "supertypes",
+    "types",
+    "variations",
+}
+
+# TEXT columns holding objects or nested lists, stored as JSON
+JSON_KEYS: Set[str] = {"boosterV3", "leadershipSkills", "meta", "purchaseUrls"}
+
+# What to do with input keys the table has no column for:
+# "drop" them (logged once per table and key) or raise an "error"
+UNKNOWN_KEY_POLICY: str = "drop"
+
+
+def join_list(value: Any) -> Optional[str]:
+    """
+    :param value: List of strings
+    :return: Comma separated values, None if empty
+    """
+    return ", ".join(value) if value else None
+
+
+def int_flag(value: Any) -> int:
+    """
+    :param value: Boolean (or missing) flag
+    :return: 1 or 0
+    """
+    return 1 if value else 0
+
+
+def json_value(value: Any) -> Optional[str]:
+    """
+    :param value: Object or list
+    :return: JSON text, None if empty
+    """
+    return json.dumps(value, ensure_ascii=False) if value else None
+
+
+def get_column_coercions(
+    sql_connection: sqlite3.Connection, table: str
+) -> Dict[str, Optional[Coercion]]:
+    """
+    Pick the coercion of every column of a table. Boolean columns are
+    declared INTEGER NOT NULL DEFAULT 0; list and JSON columns are
+    listed above. Everything else is stored as is (None).
+    :param sql_connection: Database with the table
+    :param table: Table name
+    :return: Coercion per column
+    """
+    coercions: Dict[str, Optional[Coercion]] = {}
+    for _, name, column_type, not_null, default, _ in sql_connection.execute(
+        f"PRAGMA table_info(`{table}`)"
+    ):
+        if column_type.upper() == "INTEGER" and not_null and default == "0":
+            coercions[name] = int_flag
+        elif name in LIST_KEYS:
+            coercions[name] = join_list
+        elif name in JSON_KEYS:
+            coercions[name] = json_value
+        else:
+            coercions[name] = None
+    return coercions
+
+
+def compile_row_converter(
+    table: str,
+    coercions: Dict[str, Optional[Coercion]],
+    skip_keys: Iterable[str] = (),
+    unknown_key_policy: str = UNKNOWN_KEY_POLICY,
+) -> RowConverter:
+    """
+    Build the function turning an input object into a row of a table.
+    Each key maps straight to its coercion, without type checks.
+    :param table: Table the rows are for
+    :param coercions: Coercion per column, from get_column_coercions
+    :param skip_keys: Input keys handled elsewhere (i.e. child rows)
+    :param unknown_key_policy: "drop" or "error"
+    :return: Converter taking the input object and the row's leading
+    values (i.e. its setCode), returning the row
+    """
+    if unknown_key_policy not in ("drop", "error"):
+        raise ValueError(
+            f"Unknown key policy must be drop or error ({unknown_key_policy})"
+        )
+
+    skipped = frozenset(skip_keys)
+    coerced = {key: coerce for key, coerce in coercions.items() if coerce is not None}
+    passed = frozenset(key for key, coerce in coercions.items() if coerce is None)
+    reported_keys: Set[str] = set()
+
+    def handle_unknown_key(key: str) -> None:
+        if unknown_key_policy == "error":
+            raise ValueError(f"{table} has no column for key {key}")
+        if key not in reported_keys:
+            reported_keys.add(key)
+            LOGGER.warning(f"Dropping key {key}, {table} has no column for it")
+
+    def convert(data: Dict[str, Any], row: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(row)
+        for key, value in data.items():
+            if key in passed:
+                row[key] = value
+            elif key in coerced:
+                row[key] = coerced[key](value)
+            elif key not in skipped:
+                handle_unknown_key(key)
+        return row
+
+    return convert
@@ -0,0 +1,297 @@
+"""
+Synthetic MTGJSONv4 corpus, for benchmarks without network access
+"""
+import datetime
+import json
+import logging
+import pathlib
+import random
+import uuid
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from mtgsqlive.schema import LEGALITY_FORMATS
+
+LOGGER = logging.getLogger(__name__)
+
+LANGUAGES: Tuple[str, ...] = (
+    "German",
+    "French",
+    "Italian",
+    "Spanish",
+    "Portuguese (Brazil)",
+    "Japanese",
+    "Korean",
+    "Russian",
+    "Chinese Simplified",
+    "Chinese Traditional",
+)
+
+PRICE_TYPES: Tuple[str, ...] = ("paper", "paperFoil", "mtgo", "mtgoFoil")
+
+COLORS: Tuple[str, ...] = ("W", "U", "B", "R", "G")
+
+WORDS: Tuple[str, ...] = (
+    "Ancient",
+    "Æther",
+    "Bog",
+    "Dûl",
+    "Elemental",
+    "Fury",
+    "Goblin",
+    "Hydra",
+    "Ïnfernal",
+    "Knight",
+    "Llanowar",
+    "Mox",
+    "Nebula",
+    "Oracle",
+    "Phyrexian",
+    "Serra",
+    "Titan",
+    "Wurm",
+)
+
+RULES_TEXT: Tuple[str, ...] = (
+    "Flying",
+    "{T}: Add {G}.",
+    "When this creature enters the battlefield, draw a card.",
+    "Destroy target creature. It can't be regenerated.",
+    "Counter target spell unless its controller pays {3}.",
+    "Trample, haste",
+    "At the beginning of your upkeep, you gain 1 life.",
+)
+
+
+class CorpusScale(NamedTuple):
+    """
+    Size of a generated corpus
+    """
+
+    sets: int = 20
+    cards_per_set: int = 250
+    price_dates: int = 90
+    languages: int = 8
+    seed: int = 0
+
+
+def generate_corpus(scale: CorpusScale) -> Dict[str, Dict[str, Any]]:
+    """
+    Build an AllSets style dict. The same scale always gives
+    the same corpus.
+    :param scale: Corpus size
+    :return: Sets keyed by set code
+    """
+    rng = random.Random(scale.seed)
+    release_date = datetime.date(1993, 8, 5)
+    price_dates = [
+        (datetime.date(2019, 1, 1) + datetime.timedelta(days=day)).isoformat()
+        for day in range(scale.price_dates)
+    ]
+
+    all_sets: Dict[str, Dict[str, Any]] = {}
+    for set_index in range(scale.sets):
+        set_code = "S{:03d}".format(set_index)
+        release_date += datetime.timedelta(days=rng.randint(30, 120))
+        all_sets[set_code] = generate_set(
+            set_code, release_date.isoformat(), price_dates, scale, rng
+        )
+
+    return all_sets
+
+
+def generate_set(
+    set_code: str,
+    release_date: str,
+    price_dates: List[str],
+    scale: CorpusScale,
+    rng: random.Random,
+) -> Dict[str, Any]:
+    """
+    :param set_code: Code of the set
+    :param release_date: ISO release date
+    :param price_dates: Dates with a price for every card
+    :param scale: Corpus size
+    :param rng: Random source
+    :return: Set dict, as found in AllSets.json
+    """
+    languages = LANGUAGES[: scale.languages]
+    cards = [
+        generate_card(set_code, number, price_dates, languages, rng)
+        for number in range(1, scale.cards_per_set + 1)
+    ]
+    tokens = [
+        generate_token(number, rng)
+        for number in range(1, max(1, scale.cards_per_set // 20) + 1)
+    ]
+
+    return {
+        "baseSetSize": len(cards),
+        "block": rng.choice(WORDS),
+        "boosterV3": ["rare", "uncommon", "uncommon", "uncommon"] + ["common"] * 10,
+        "cards": cards,
+        "code": set_code,
+        "isFoilOnly": False,
+        "isOnlineOnly": rng.random() < 0.1,
+        "keyruneCode": set_code,
+        "mcmId": rng.randint(1, 5000),
+        "mcmName": f"Set {set_code}",
+        "mtgoCode": set_code,
+        "name": f"Set {set_code}",
+        "releaseDate": release_date,
+        "tcgplayerGroupId": rng.randint(1, 5000),
+        "tokens": tokens,
+        "totalSetSize": len(cards),
+        "translations": {
+            language: f"{language} {set_code}" if rng.random() < 0.8 else None
+            for language in languages
+        },
+        "type": rng.choice(["core", "expansion", "masters", "commander"]),
+    }
+
+
+def generate_card(
+    set_code: str,
+    number: int,
+    price_dates: List[str],
+    languages: Tuple[str, ...],
+    rng: random.Random,
+) -> Dict[str, Any]:
+    """
+    :param set_code: Code of the card's set
+    :param number: Collector number
+    :param price_dates: Dates to price the card on
+    :param languages: Languages to add foreign data for
+    :param rng: Random source
+    :return: Card dict, as found in AllSets.json
+    """
+    colors = sorted(rng.sample(COLORS, rng.randint(0, 2)))
+    name = " ".join(rng.sample(WORDS, 2))
+    card_type = rng.choice(["Creature", "Instant", "Sorcery", "Artifact"])
+    text = " ".join(rng.sample(RULES_TEXT, rng.randint(1, 3)))
+
+    prices: Dict[str, Dict[str, float]] = {}
+    for price_type in PRICE_TYPES:
+        if rng.random() < 0.7:
+            base = rng.uniform(0.05, 40)
+            prices[price_type] = {
+                date: round(base * rng.uniform(0.9, 1.1), 2) for date in price_dates
+            }
+
+    card: Dict[str, Any] = {
+        "artist": " ".join(rng.sample(WORDS, 2)),
+        "borderColor": "black",
+        "colorIdentity": colors,
+        "colors": colors,
+        "convertedManaCost": float(rng.randint(0, 8)),
+        "flavorText": " ".join(rng.sample(WORDS, 6)) if rng.random() < 0.5 else None,
+        "foreignData": [
+            {
+                "flavorText": f"{language} flavor",
+                "language": language,
+                "multiverseId": rng.randint(1, 500000),
+                "name": f"{name} ({language})",
+                "text": f"{language}: {text}",
+                "type": card_type,
+            }
+            for language in languages
+        ],
+        "frameVersion": "2015",
+        "hasFoil": rng.random() < 0.5,
+        "hasNonFoil": True,
+        "isReprint": rng.random() < 0.3,
+        "layout": "normal",
+        "leadershipSkills": (
+            {"brawl": False, "commander": True, "oathbreaker": False}
+            if rng.random() < 0.05
+            else None
+        ),
+        "legalities": {
+            card_format: rng.choice(["Legal", "Legal", "Legal", "Banned", "Restricted"])
+            for card_format in rng.sample(
+                LEGALITY_FORMATS, rng.randint(0, len(LEGALITY_FORMATS))
+            )
+        },
+        "manaCost": "{{{}}}".format(rng.randint(1, 5)) + "".join(
+            f"{{{color}}}" for color in colors
+        ),
+        "multiverseId": rng.randint(1, 500000),
+        "name": name,
+        "number": str(number),
+        "power": str(rng.randint(0, 8)) if card_type == "Creature" else None,
+        "prices": prices,
+        "printings": sorted({set_code, "S{:03d}".format(rng.randint(0, 999))}),
+        "purchaseUrls": {"tcgplayer": f"https://mtgjson.com/links/{number}"},
+        "rarity": rng.choice(["common", "uncommon", "rare", "mythic"]),
+        "rulings": [
+            {"date": "2019-0{}-01".format(rng.randint(1, 9)), "text": rule}
+            for rule in rng.sample(RULES_TEXT, rng.randint(0, 3))
+        ],
+        "scryfallId": str(uuid.UUID(int=rng.getrandbits(128))),
+        "scryfallOracleId": str(uuid.UUID(int=rng.getrandbits(128))),
+        "subtypes": rng.sample(WORDS, rng.randint(0, 2)),
+        "supertypes": ["Legendary"] if rng.random() < 0.1 else [],
+        "tcgplayerProductId": rng.randint(1, 500000),
+        "text": text,
+        "toughness": str(rng.randint(0, 8)) if card_type == "Creature" else None,
+        "type": card_type,
+        "types": [card_type],
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+    }
+
+    # Like MTGJSON, leave out the keys a card has no value for
+    return {key: value for key, value in card.items() if value is not None}
+
+
+def generate_token(number: int, rng: random.Random) -> Dict[str, Any]:
+    """
+    :param number: Collector number
+    :param rng: Random source
+    :return: Token dict, as found in AllSets.json
+    """
+    return {
+        "artist": rng.choice(WORDS),
+        "borderColor": "black",
+        "colorIdentity": ["G"],
+        "colors": ["G"],
+        "layout": "token",
+        "name": f"{rng.choice(WORDS)} Token",
+        "number": f"T{number}",
+        "power": "1",
+        "reverseRelated": [rng.choice(WORDS)],
+        "scryfallId": str(uuid.UUID(int=rng.getrandbits(128))),
+        "text": rng.choice(RULES_TEXT),
+        "toughness": "1",
+        "type": "Token Creature",
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+    }
+
+
+def write_corpus(
+    output_dir: pathlib.Path, scale: CorpusScale
+) -> Tuple[pathlib.Path, pathlib.Path]:
+    """
+    Write a generated corpus both as AllSets.json and as an
+    AllSetFiles directory
+    :param output_dir: Directory to write into
+    :param scale: Corpus size
+    :return: Paths of the AllSets.json file and AllSetFiles directory
+    """
+    all_sets = generate_corpus(scale)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    all_sets_file = output_dir.joinpath("AllSets.json")
+    with all_sets_file.open("w", encoding="utf8") as json_file:
+        json.dump(all_sets, json_file, ensure_ascii=False)
+
+    set_files_dir = output_dir.joinpath("AllSetFiles")
+    set_files_dir.mkdir(exist_ok=True)
+    for set_code, set_data in all_sets.items():
+        with set_files_dir.joinpath(f"{set_code}.json").open(
+            "w", encoding="utf8"
+        ) as json_file:
+            json.dump(set_data, json_file, ensure_ascii=False)
+
+    LOGGER.info(
+        f"Wrote {scale.sets} sets of {scale.cards_per_set} cards to {output_dir}"
+    )
+    return all_sets_file, set_files_dir
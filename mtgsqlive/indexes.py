@@ -0,0 +1,289 @@
+"""
+Secondary indexes, created once the data is loaded
+"""
+import logging
+import sqlite3
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from mtgsqlive.card_lists import CARD_LIST_TABLES
+
+LOGGER = logging.getLogger(__name__)
+
+
+class IndexSpec(NamedTuple):
+    """
+    Declaration of a single index
+    """
+
+    name: str
+    table: str
+    columns: Tuple[str, ...]
+    where: Optional[str] = None
+
+    def create_statement(self) -> str:
+        """
+        :return: CREATE INDEX statement for this index
+        """
+        statement = "CREATE INDEX IF NOT EXISTS `{}` ON `{}`({})".format(
+            self.name, self.table, ", ".join(self.columns)
+        )
+        if self.where:
+            statement += f" WHERE {self.where}"
+        return statement
+
+
+# Index sets selectable with --indexes
+INDEX_CATALOG: Dict[str, List[IndexSpec]] = {
+    # Plain lookups by key, the bare minimum for API use
+    "lookup": [
+        IndexSpec("cards_name", "cards", ("name",)),
+        IndexSpec("cards_setCode", "cards", ("setCode",)),
+        IndexSpec("cards_scryfallOracleId", "cards", ("scryfallOracleId",)),
+        IndexSpec("tokens_setCode", "tokens", ("setCode",)),
+        IndexSpec("cards_interned_name", "cards_interned", ("name",)),
+        IndexSpec("cards_interned_setCodeId", "cards_interned", ("setCodeId",)),
+        IndexSpec(
+            "cards_interned_scryfallOracleId", "cards_interned", ("scryfallOracleId",)
+        ),
+        IndexSpec("tokens_interned_setCodeId", "tokens_interned", ("setCodeId",)),
+        IndexSpec("set_translations_setCode", "set_translations", ("setCode",)),
+        IndexSpec("foreignData_uuid", "foreignData", ("uuid",)),
+        IndexSpec("legalities_uuid", "legalities", ("uuid",)),
+        IndexSpec("rulings_uuid", "rulings", ("uuid",)),
+        IndexSpec("prices_uuid", "prices", ("uuid",)),
+        IndexSpec("card_foreignData_cardId", "card_foreignData", ("cardId",)),
+        IndexSpec("card_legalities_cardId", "card_legalities", ("cardId",)),
+        IndexSpec("card_rulings_cardId", "card_rulings", ("cardId",)),
+        IndexSpec("card_prices_cardId", "card_prices", ("cardId",)),
+        IndexSpec("legalities_wide_uuid", "legalities_wide", ("uuid",)),
+        IndexSpec("legalities_wide_cardId", "legalities_wide", ("cardId",)),
+        IndexSpec("legalities_other_uuid", "legalities_other", ("uuid",)),
+        IndexSpec("legalities_other_cardId", "legalities_other", ("cardId",)),
+        IndexSpec(
+            "price_points_cardId", "price_points", ("cardId", "typeId", "day")
+        ),
+        IndexSpec("price_series_cardId", "price_series", ("cardId", "typeId")),
+        IndexSpec("price_summaries_uuid_type", "price_summaries", ("uuid", "type")),
+        IndexSpec(
+            "card_price_summaries_cardId_type",
+            "card_price_summaries",
+            ("cardId", "type"),
+        ),
+        IndexSpec(
+            "card_price_summaries_cardId_typeId",
+            "card_price_summaries",
+            ("cardId", "typeId"),
+        ),
+        IndexSpec(
+            "oracle_cards_scryfallOracleId", "oracle_cards", ("scryfallOracleId", "side")
+        ),
+        IndexSpec("oracle_cards_name", "oracle_cards", ("name",)),
+    ]
+    # Junction tables (--card-lists): cards by value, and values by card
+    + [
+        IndexSpec(f"{spec.table}_{spec.column}_{key}", spec.table, (spec.column, key))
+        for spec in CARD_LIST_TABLES
+        for key in ("uuid", "cardId")
+    ]
+    + [
+        IndexSpec(f"{spec.table}_{key}", spec.table, (key,))
+        for spec in CARD_LIST_TABLES
+        for key in ("uuid", "cardId")
+    ],
+    # Answer the common queries from the index alone, at the cost of size
+    "covering": [
+        IndexSpec("cards_name_setCode_uuid", "cards", ("name", "setCode", "uuid")),
+        IndexSpec(
+            "foreignData_language_name_uuid",
+            "foreignData",
+            ("language", "name", "uuid"),
+        ),
+        IndexSpec(
+            "legalities_uuid_format_status",
+            "legalities",
+            ("uuid", "format", "status"),
+        ),
+        IndexSpec(
+            "prices_uuid_type_date_price", "prices", ("uuid", "type", "date", "price")
+        ),
+        IndexSpec(
+            "card_foreignData_language_name_cardId",
+            "card_foreignData",
+            ("language", "name", "cardId"),
+        ),
+        IndexSpec(
+            "card_legalities_cardId_format_status",
+            "card_legalities",
+            ("cardId", "format", "status"),
+        ),
+        IndexSpec(
+            "card_prices_cardId_type_date_price",
+            "card_prices",
+            ("cardId", "type", "date", "price"),
+        ),
+        IndexSpec(
+            "cards_interned_name_setCodeId_uuid",
+            "cards_interned",
+            ("name", "setCodeId", "uuid"),
+        ),
+        IndexSpec(
+            "card_foreignData_languageId_name_cardId",
+            "card_foreignData",
+            ("languageId", "name", "cardId"),
+        ),
+        IndexSpec(
+            "card_legalities_cardId_formatId_statusId",
+            "card_legalities",
+            ("cardId", "formatId", "statusId"),
+        ),
+    ],
+    # Small indexes over the rows where an optional column is set
+    "partial": [
+        IndexSpec(
+            "cards_multiverseId", "cards", ("multiverseId",), "multiverseId IS NOT NULL"
+        ),
+        IndexSpec(
+            "cards_mtgArenaId", "cards", ("mtgArenaId",), "mtgArenaId IS NOT NULL"
+        ),
+        IndexSpec("cards_mtgoId", "cards", ("mtgoId",), "mtgoId IS NOT NULL"),
+        IndexSpec(
+            "cards_tcgplayerProductId",
+            "cards",
+            ("tcgplayerProductId",),
+            "tcgplayerProductId IS NOT NULL",
+        ),
+        IndexSpec(
+            "cards_interned_multiverseId",
+            "cards_interned",
+            ("multiverseId",),
+            "multiverseId IS NOT NULL",
+        ),
+        IndexSpec(
+            "cards_interned_mtgArenaId",
+            "cards_interned",
+            ("mtgArenaId",),
+            "mtgArenaId IS NOT NULL",
+        ),
+        IndexSpec(
+            "cards_interned_mtgoId", "cards_interned", ("mtgoId",), "mtgoId IS NOT NULL"
+        ),
+        IndexSpec(
+            "cards_interned_tcgplayerProductId",
+            "cards_interned",
+            ("tcgplayerProductId",),
+            "tcgplayerProductId IS NOT NULL",
+        ),
+        IndexSpec(
+            "foreignData_multiverseId",
+            "foreignData",
+            ("multiverseId",),
+            "multiverseId IS NOT NULL AND multiverseId != ''",
+        ),
+        IndexSpec(
+            "legalities_format_uuid_restricted",
+            "legalities",
+            ("format", "uuid"),
+            "status != 'Legal'",
+        ),
+        IndexSpec(
+            "card_foreignData_multiverseId",
+            "card_foreignData",
+            ("multiverseId",),
+            "multiverseId IS NOT NULL AND multiverseId != ''",
+        ),
+        IndexSpec(
+            "card_legalities_format_cardId_restricted",
+            "card_legalities",
+            ("format", "cardId"),
+            "status != 'Legal'",
+        ),
+    ],
+}
+
+DEFAULT_INDEX_SETS: List[str] = ["lookup"]
+
+
+def parse_index_sets(value: str) -> List[str]:
+    """
+    Parse the --indexes option
+    :param value: Comma separated index set names, "all" or "none"
+    :return: Index set names
+    """
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    if names == ["none"]:
+        return []
+    if names == ["all"]:
+        return list(INDEX_CATALOG.keys())
+
+    unknown = [name for name in names if name not in INDEX_CATALOG]
+    if unknown:
+        raise ValueError(
+            "Unknown index set(s) {}, expected one of: {}, all, none".format(
+                ", ".join(unknown), ", ".join(INDEX_CATALOG.keys())
+            )
+        )
+    return names
+
+
+def select_indexes(index_sets: List[str]) -> List[IndexSpec]:
+    """
+    Collect the indexes of some index sets, dropping full indexes
+    whose columns are a leading prefix of another selected full index
+    on the same table, as the longer index serves the same lookups
+    :param index_sets: Index set names from INDEX_CATALOG
+    :return: Indexes to create
+    """
+    selected: List[IndexSpec] = []
+    for index_set in index_sets:
+        selected.extend(INDEX_CATALOG[index_set])
+
+    def is_redundant(spec: IndexSpec) -> bool:
+        return spec.where is None and any(
+            other is not spec
+            and other.where is None
+            and other.table == spec.table
+            and len(other.columns) > len(spec.columns)
+            and other.columns[: len(spec.columns)] == spec.columns
+            for other in selected
+        )
+
+    return [spec for spec in selected if not is_redundant(spec)]
+
+
+def create_indexes(sql_connection: sqlite3.Connection, index_sets: List[str]) -> None:
+    """
+    Build the selected indexes. Meant to run after the data load,
+    since filling an index in one pass is much cheaper than
+    maintaining it across millions of inserts.
+    :param sql_connection: Connection to the loaded database
+    :param index_sets: Index set names from INDEX_CATALOG
+    """
+    tables = {
+        name
+        for (name,) in sql_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+
+    table_columns: Dict[str, Set[str]] = {}
+    for spec in select_indexes(index_sets):
+        if spec.table not in tables:
+            LOGGER.debug(f"Skipping index {spec.name}, no {spec.table} table")
+            continue
+
+        if spec.table not in table_columns:
+            table_columns[spec.table] = {
+                column[1]
+                for column in sql_connection.execute(
+                    f"PRAGMA table_info(`{spec.table}`)"
+                )
+            }
+
+        if not set(spec.columns) <= table_columns[spec.table]:
+            LOGGER.debug(f"Skipping index {spec.name}, columns not in schema")
+            continue
+
+        LOGGER.info(f"Building index {spec.name}")
+        sql_connection.execute(spec.create_statement())
+
+    sql_connection.commit()
@@ -2,14 +2,62 @@
 Convert MTGJSON v4 -> SQLite
 """
 import argparse
-import json
+import functools
 import logging
 import pathlib
 import sqlite3
-from typing import Any, Dict, List, Union
+import sys
+from typing import Dict, Optional, Set, Tuple
+
+from mtgsqlive.build import parse_and_import_cards
+from mtgsqlive.checkpoints import (
+    DEFAULT_CHECKPOINT_ROWS,
+    drop_build_progress,
+    get_finished_sets,
+)
+from mtgsqlive.indexes import (
+    DEFAULT_INDEX_SETS,
+    INDEX_CATALOG,
+    create_indexes,
+    parse_index_sets,
+)
+from mtgsqlive.json_stream import JSON_DECODERS, set_json_decoder
+from mtgsqlive.metrics import DEFAULT_PROGRESS_INTERVAL, PipelineMetrics
+from mtgsqlive.oracle import build_oracle_table, refresh_oracle_table
+from mtgsqlive.price_summaries import DEFAULT_PRICE_WINDOWS, parse_price_windows
+from mtgsqlive.satellites import (
+    DEFAULT_SATELLITES,
+    manifest_path,
+    parse_satellites,
+    remove_split_output,
+    split_database,
+)
+from mtgsqlive.schema import (
+    EXPORT_TABLE_NAMES,
+    BuildOptions,
+    build_sql_schema,
+    detect_build_options,
+)
+from mtgsqlive.search import build_search_indexes, refresh_search_indexes
+from mtgsqlive.sinks import EXPORT_SINKS, parse_export_target
+from mtgsqlive.sql_writer import DEFAULT_BATCH_SIZE
+from mtgsqlive.transforms import sql_insert_set
+from mtgsqlive.update import update_database
 
 LOGGER = logging.getLogger(__name__)
 
+# Page cache for --bulk builds, in KiB (negative cache_size)
+BULK_CACHE_SIZE_KIB: int = 512 * 1024
+
+# UNIQUE constraints that --bulk builds add as indexes after the load
+DEFERRED_UNIQUE_INDEXES: Dict[str, Tuple[str, str]] = {
+    "sets_code": ("sets", "code"),
+    "cards_uuid": ("cards", "uuid"),
+    "tokens_uuid": ("tokens", "uuid"),
+    "cards_interned_uuid": ("cards_interned", "uuid"),
+    "tokens_interned_uuid": ("tokens_interned", "uuid"),
+}
+
 
 def main() -> None:
     """
@@ -18,7 +66,7 @@ def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-i",
-        help='input source ("AllSets.json" file or "AllSetFiles" directory)',
+        help='input source ("AllSets.json" file or "AllSetFiles" directory, optionally .gz/.xz/.bz2 compressed)',
         required=True,
         metavar="fileIn",
     )
@@ -28,28 +76,322 @@ def main() -> None:
         required=True,
         metavar="fileOut",
     )
+    parser.add_argument(
+        "--batch-size",
+        help=f"rows buffered per table before each executemany (default {DEFAULT_BATCH_SIZE})",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        metavar="rows",
+    )
+    parser.add_argument(
+        "--stream",
+        help="parse the input incrementally, one set or one card at a time, instead of loading it whole",
+        choices=["set", "card"],
+    )
+    parser.add_argument(
+        "--json-decoder",
+        help="decoder of whole JSON files: json (default, the leanest) or orjson (faster, if installed, but needs more memory)",
+        choices=list(JSON_DECODERS),
+        default="json",
+    )
+    parser.add_argument(
+        "--jobs",
+        help="worker processes converting AllSetFiles in parallel (0 = one per CPU, default 1)",
+        type=int,
+        default=1,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--shard",
+        help="with --jobs, have each worker write its sets to a temporary shard database that is merged into the output with ATTACH",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--bulk",
+        help="bulk-load profile: no fsync or rollback journal, large page cache, UNIQUE/REFERENCES checked after the load, then ANALYZE and VACUUM",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--in-memory",
+        help="with --bulk, build the database in memory and write it to the output file with the backup API",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--indexes",
+        help="comma separated index sets to build after the load: {}, all or none (default {})".format(
+            ", ".join(INDEX_CATALOG.keys()), ",".join(DEFAULT_INDEX_SETS)
+        ),
+        default=",".join(DEFAULT_INDEX_SETS),
+        metavar="sets",
+    )
+    parser.add_argument(
+        "--prices",
+        help="price history layout: one row per date (rows), integer-keyed points (compact) or one packed series per card and type (packed); default rows",
+        choices=["rows", "compact", "packed"],
+        default="rows",
+    )
+    parser.add_argument(
+        "--card-ids",
+        help="have foreignData, legalities, rulings and prices reference cards.id instead of the uuid (views keep the uuid columns)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--legalities",
+        help="legality layout: one row per card and format (rows) or one row per card with a status column per format (wide); default rows",
+        choices=["rows", "wide"],
+        default="rows",
+    )
+    parser.add_argument(
+        "--interned",
+        help="store artist, border color, frame version, layout, rarity, set code, watermark, language, legality format/status and price type values as ids into lookup tables, with views keeping the text columns (implies --card-ids)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--card-lists",
+        help="add junction tables (card_colors, card_color_identities, card_types, card_subtypes, card_supertypes, card_printings, card_names) with one row per card and list value, indexed by value",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--price-summaries",
+        help="build price_summaries, with the latest, minimum and maximum price of each card and price type and their moving averages over these comma separated windows, in days (default {})".format(
+            ",".join(str(days) for days in DEFAULT_PRICE_WINDOWS)
+        ),
+        nargs="?",
+        const=",".join(str(days) for days in DEFAULT_PRICE_WINDOWS),
+        metavar="days",
+    )
+    parser.add_argument(
+        "--search",
+        help="build FTS5 full-text search indexes over card and foreign data names and text",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--oracle",
+        help="build oracle_cards, one row per card (not per printing) with its rules text",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--split",
+        help="write the {} tables (or these comma separated ones) to satellite files next to the output, which keeps the other tables, and describe the files in <output>.manifest.json".format(
+            ", ".join(DEFAULT_SATELLITES)
+        ),
+        nargs="?",
+        const=",".join(DEFAULT_SATELLITES),
+        metavar="satellites",
+    )
+    parser.add_argument(
+        "--export",
+        help="also write the converted rows to a directory, in the same pass: one file per table as csv, jsonl (JSON Lines) or columnar (column files for numpy.memmap); format:directory, repeatable",
+        action="append",
+        default=[],
+        metavar="format:dir",
+    )
+    parser.add_argument(
+        "--progress",
+        help="seconds between progress lines during the build, 0 to disable "
+        "(default {})".format(DEFAULT_PROGRESS_INTERVAL),
+        type=float,
+        default=DEFAULT_PROGRESS_INTERVAL,
+        metavar="seconds",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="write per-stage timings, row counts and memory use of the build to a JSON file",
+        metavar="file",
+    )
+    parser.add_argument(
+        "--checkpoint-rows",
+        help=f"commit the build between sets once this many rows were written, 0 to commit after every set (default {DEFAULT_CHECKPOINT_ROWS})",
+        type=int,
+        default=DEFAULT_CHECKPOINT_ROWS,
+        metavar="rows",
+    )
+    parser.add_argument(
+        "--resume",
+        help="continue an interrupted build of the output file, skipping the sets it already committed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--update",
+        help="update an existing output file in place, rewriting only the rows of sets that changed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--content-hashes",
+        help="record a content hash per set, so a later --update skips the unchanged sets without diffing them (an update records them too)",
+        action="store_true",
+    )
     args = parser.parse_args()
+    if args.in_memory and not args.bulk:
+        parser.error("--in-memory requires --bulk")
+    if args.update and args.bulk:
+        parser.error("--update can't be combined with --bulk")
+    if args.resume and (args.bulk or args.update):
+        parser.error("--resume can't be combined with --bulk or --update")
+    if args.update and args.split:
+        parser.error("--update can't be combined with --split")
+    if args.export and (args.update or args.resume or args.shard):
+        parser.error("--export can't be combined with --update, --resume or --shard")
+    if args.checkpoint_rows < 0:
+        parser.error("--checkpoint-rows can't be negative")
+    try:
+        index_sets = parse_index_sets(args.indexes)
+        price_windows = (
+            parse_price_windows(args.price_summaries) if args.price_summaries else ()
+        )
+        satellites = parse_satellites(args.split) if args.split else ()
+        export_targets = [parse_export_target(value) for value in args.export]
+    except ValueError as error:
+        parser.error(str(error))
+    set_json_decoder(args.json_decoder)
 
     # Define our I/O paths
     input_file = pathlib.Path(args.i).expanduser()
     output_file = pathlib.Path(args.o).expanduser()
 
-    if not validate_io_streams(input_file, output_file):
-        exit(1)
+    if not validate_io_streams(input_file, output_file, args.update or args.resume):
+        sys.exit(1)
+
+    if args.update and output_file.is_file():
+        LOGGER.info(f"Updating {output_file}")
+        sql_connection = sqlite3.connect(str(output_file))
+        if get_finished_sets(sql_connection) is not None:
+            LOGGER.fatal(f"{output_file} is an unfinished build, use --resume")
+            sys.exit(1)
+        if manifest_path(output_file).is_file():
+            LOGGER.fatal(f"{output_file} is split into satellites, rebuild it")
+            sys.exit(1)
+        create_indexes(sql_connection, index_sets)
+        update_database(
+            input_file,
+            sql_connection,
+            # The update hashes each set itself
+            functools.partial(
+                sql_insert_set,
+                record_hash=False,
+                options=detect_build_options(sql_connection),
+            ),
+        )
+        if args.search:
+            build_search_indexes(sql_connection)
+        else:
+            refresh_search_indexes(sql_connection)
+        if args.oracle:
+            build_oracle_table(sql_connection)
+            create_indexes(sql_connection, index_sets)
+        else:
+            refresh_oracle_table(sql_connection)
+        sql_connection.close()
+        return
+
+    options = BuildOptions(
+        price_layout=args.prices,
+        card_ids=args.card_ids or args.interned,
+        legality_layout=args.legalities,
+        interned=args.interned,
+        card_lists=args.card_lists,
+        price_windows=price_windows,
+        content_hashes=args.content_hashes,
+    )
 
     # Build the SQLite database
-    sql_connection = sqlite3.connect(str(output_file))
-    sql_connection.execute("pragma journal_mode=wal;")
+    resume = args.resume and output_file.is_file()
+    if not resume:
+        remove_split_output(output_file)
+    output_connection = sqlite3.connect(str(output_file))
+    output_connection.execute("pragma journal_mode=wal;")
+
+    finished_sets: Optional[Set[str]] = None
+    if resume:
+        finished_sets = get_finished_sets(output_connection)
+        if finished_sets is None:
+            LOGGER.fatal(f"{output_file} holds no unfinished build to resume")
+            sys.exit(1)
+        # The layouts are those the build was started with
+        options = detect_build_options(output_connection)
+        LOGGER.info(
+            f"Resuming build of {output_file}, "
+            f"{len(finished_sets)} sets already finished"
+        )
+
+    sql_connection = output_connection
+    if args.in_memory:
+        LOGGER.info("Staging database in memory")
+        sql_connection = sqlite3.connect(":memory:")
+    if args.bulk:
+        apply_bulk_pragmas(sql_connection)
+
+    metrics = PipelineMetrics(args.progress)
+    if finished_sets is None:
+        LOGGER.info("Building SQLite Schema")
+        build_sql_schema(sql_connection, defer_constraints=args.bulk, options=options)
+    sinks = [
+        EXPORT_SINKS[export_format](
+            directory, sql_connection, EXPORT_TABLE_NAMES, args.batch_size, metrics
+        )
+        for export_format, directory in export_targets
+    ]
+    table_counts = parse_and_import_cards(
+        input_file,
+        sql_connection,
+        args.batch_size,
+        args.stream,
+        args.jobs,
+        args.shard,
+        options,
+        metrics,
+        args.checkpoint_rows,
+        finished_sets,
+        sinks,
+    )
+
+    if args.bulk:
+        metrics.start_stage("constraints")
+        constraints_hold = enforce_deferred_constraints(sql_connection)
+        metrics.end_stage()
+        if not constraints_hold:
+            sys.exit(1)
+
+    if args.oracle:
+        metrics.start_stage("oracle")
+        build_oracle_table(sql_connection)
+        metrics.end_stage()
+
+    metrics.start_stage("index")
+    create_indexes(sql_connection, index_sets)
+    if args.search:
+        build_search_indexes(sql_connection)
+    metrics.end_stage()
 
-    build_sql_schema(sql_connection)
-    parse_and_import_cards(input_file, sql_connection)
+    drop_build_progress(sql_connection)
 
+    if args.bulk:
+        metrics.start_stage("finish")
+        finish_bulk_build(sql_connection, output_connection)
+        metrics.end_stage()
 
-def validate_io_streams(input_file: pathlib.Path, output_file: pathlib.Path) -> bool:
+    output_connection.close()
+
+    if satellites:
+        metrics.start_stage("split")
+        split_database(output_file, satellites)
+        metrics.end_stage()
+
+    LOGGER.info(
+        f"Build finished in {metrics.elapsed:.2f}s ({metrics.format_stages()})"
+    )
+    if args.metrics:
+        metrics.write_report(pathlib.Path(args.metrics).expanduser(), table_counts)
+
+
+def validate_io_streams(
+    input_file: pathlib.Path, output_file: pathlib.Path, keep_existing: bool = False
+) -> bool:
     """
     Ensure I/O paths are valid and clean for program
     :param input_file: Input file (JSON)
     :param output_file: Output file (SQLite)
+    :param keep_existing: Leave an existing output file in place
     :return: Good to continue status
     """
     if input_file.is_file():
@@ -62,533 +404,87 @@ def validate_io_streams(input_file: pathlib.Path, output_file: pathlib.Path) ->
         return False
 
     output_file.parent.mkdir(exist_ok=True)
-    if output_file.is_file():
+    if output_file.is_file() and keep_existing:
+        LOGGER.info(f"Keeping existing output file {output_file}")
+    elif output_file.is_file():
         LOGGER.warning(f"Output file {output_file} exists already, moving it.")
         output_file.replace(output_file.parent.joinpath(output_file.name + ".old"))
 
     return True
 
 
-def build_sql_schema(sql_connection: sqlite3.Connection) -> None:
-    """
-    Create the SQLite DB schema
-    :param sql_connection: Connection to the database
-    """
-    LOGGER.info("Building SQLite Schema")
-    cursor = sql_connection.cursor()
-
-    # Build Set table
-    cursor.execute(
-        "CREATE TABLE `sets` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "baseSetSize INTEGER,"
-        "block TEXT,"
-        "boosterV3 TEXT,"
-        "code TEXT UNIQUE NOT NULL,"
-        "codeV3 TEXT,"
-        "isFoilOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isForeignOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isOnlineOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isPartialPreview INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "keyruneCode TEXT,"
-        "mcmId INTEGER,"
-        "mcmName TEXT,"
-        "meta TEXT,"
-        "mtgoCode TEXT,"
-        "name TEXT,"
-        "parentCode TEXT,"
-        "releaseDate TEXT,"
-        "tcgplayerGroupId INTEGER,"
-        "totalSetSize INTEGER,"
-        "type TEXT"
-        ")"
-    )
-
-    # Build cards table
-    cursor.execute(
-        "CREATE TABLE `cards` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "artist TEXT,"
-        "borderColor TEXT,"
-        "colorIdentity TEXT,"
-        "colorIndicator TEXT,"
-        "colors TEXT,"
-        "convertedManaCost FLOAT,"
-        "duelDeck TEXT(1),"
-        "edhrecRank TEXT,"
-        "faceConvertedManaCost FLOAT,"
-        "flavorText TEXT,"
-        "frameEffect TEXT,"
-        "frameVersion TEXT,"
-        "hand TEXT,"
-        "hasFoil INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "hasNoDeckLimit INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "hasNonFoil INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isAlternative INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isArena INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isFullArt INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isMtgo INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isOnlineOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isOversized INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isPaper INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isPromo INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isReprint INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isReserved INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isStarter INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isStorySpotlight INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isTextless INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "isTimeshifted INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "layout TEXT,"
-        "leadershipSkills TEXT,"
-        "life TEXT,"
-        "loyalty TEXT,"
-        "manaCost TEXT,"
-        "mcmId INTEGER,"
-        "mcmMetaId INTEGER,"
-        "mcmName TEXT,"
-        "mtgArenaId INTEGER,"
-        "mtgoFoilId INTEGER,"
-        "mtgoId INTEGER,"
-        "mtgstocksId INTEGER,"
-        "multiverseId INTEGER,"
-        "name TEXT,"
-        "names TEXT,"
-        "number TEXT,"
-        "originalText TEXT,"
-        "originalType TEXT,"
-        "power TEXT,"
-        "printings TEXT,"
-        "purchaseUrls TEXT,"
-        "rarity TEXT,"
-        "scryfallId TEXT(36),"
-        "scryfallIllustrationId TEXT(36),"
-        "scryfallOracleId TEXT(36),"
-        "setCode TEXT REFERENCES sets(code) ON UPDATE CASCADE ON DELETE CASCADE,"
-        "side TEXT,"
-        "subtypes TEXT,"
-        "supertypes TEXT,"
-        "tcgplayerProductId INTEGER,"
-        "tcgplayerPurchaseUrl TEXT,"
-        "text TEXT,"
-        "toughness TEXT,"
-        "type TEXT,"
-        "types TEXT,"
-        "uuid TEXT(36) UNIQUE NOT NULL,"
-        "variations TEXT,"
-        "watermark TEXT"
-        ")"
-        #"CREATE UNIQUE INDEX 'cards_uuid' ON cards(uuid);"
-    )
-
-    # Build tokens table
-    cursor.execute(
-        "CREATE TABLE `tokens` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "artist TEXT,"
-        "borderColor TEXT,"
-        "colorIdentity TEXT,"
-        "colorIndicator TEXT,"
-        "colors TEXT,"
-        "duelDeck TEXT(1),"
-        "isOnlineOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
-        "layout TEXT,"
-        "loyalty TEXT,"
-        "name TEXT,"
-        "names TEXT,"
-        "number TEXT,"
-        "power TEXT,"
-        "reverseRelated TEXT,"
-        "scryfallId TEXT(36),"
-        "scryfallIllustrationId TEXT(36),"
-        "scryfallOracleId TEXT(36),"
-        "setCode TEXT REFERENCES sets(code) ON UPDATE CASCADE ON DELETE CASCADE,"
-        "side TEXT,"
-        "text TEXT,"
-        "toughness TEXT,"
-        "type TEXT,"
-        "uuid TEXT(36) UNIQUE,"
-        "watermark TEXT"
-        ")"
-    )
-
-    # Translations for set names
-    cursor.execute(
-        "CREATE TABLE `set_translations` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "language TEXT,"
-        "setCode TEXT REFERENCES sets(code) ON UPDATE CASCADE ON DELETE CASCADE,"
-        "translation TEXT"
-        ")"
-    )
-
-    # Build foreignData table
-    cursor.execute(
-        "CREATE TABLE `foreignData` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "flavorText TEXT,"
-        "language TEXT,"
-        "multiverseId INTEGER,"
-        "name TEXT,"
-        "text TEXT,"
-        "type TEXT,"
-        "uuid TEXT(36) REFERENCES cards(uuid) ON UPDATE CASCADE ON DELETE CASCADE"
-        ")"
-    )
-
-    # Build legalities table
-    cursor.execute(
-        "CREATE TABLE `legalities` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "format TEXT,"
-        "status TEXT,"
-        "uuid TEXT(36) REFERENCES cards(uuid) ON UPDATE CASCADE ON DELETE CASCADE"
-        ")"
-    )
-
-    # Build ruling table
-    cursor.execute(
-        "CREATE TABLE `rulings` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "date TEXT,"
-        "text TEXT,"
-        "uuid TEXT(36) REFERENCES cards(uuid) ON UPDATE CASCADE ON DELETE CASCADE"
-        ")"
-    )
-
-    # Build prices table
-    cursor.execute(
-        "CREATE TABLE `prices` ("
-        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-        "date TEXT,"
-        "price REAL,"
-        "type TEXT,"
-        "uuid TEXT(36) REFERENCES cards(uuid) ON UPDATE CASCADE ON DELETE CASCADE"
-        ")"
-    )
-
-    # Execute the commands
-    sql_connection.commit()
-
-
-def parse_and_import_cards(
-    input_file: pathlib.Path, sql_connection: sqlite3.Connection
-) -> None:
-    """
-    Parse the JSON cards and input them into the database
-    :param input_file: AllSets.json file
-    :param sql_connection: Database connection
-    """
-    if input_file.is_file():
-        LOGGER.info("Loading JSON into memory")
-        json_data = json.load(input_file.open("r", encoding="utf8"))
-
-        LOGGER.info("Building sets")
-        for set_code, set_data in json_data.items():
-            # Handle set insertion
-            LOGGER.info("Inserting set row for {}".format(set_code))
-            set_insert_values = handle_set_row_insertion(set_data)
-            sql_dict_insert(set_insert_values, "sets", sql_connection)
-
-            for card in set_data.get("cards"):
-                LOGGER.debug("Inserting card row for {}".format(card.get("name")))
-                card_attr: Dict[str, Any] = handle_card_row_insertion(card, set_code)
-                sql_insert_all_card_fields(card_attr, sql_connection)
-
-            for token in set_data.get("tokens"):
-                LOGGER.debug("Inserting token row for {}".format(token.get("name")))
-                token_attr = handle_token_row_insertion(token, set_code)
-                sql_dict_insert(token_attr, "tokens", sql_connection)
-
-            for language, translation in set_data.get("translations", {}).items():
-                LOGGER.debug("Inserting set_translation row for {}".format(language))
-                set_translation_attr = handle_set_translation_row_insertion(
-                    language, translation, set_code
-                )
-                sql_dict_insert(
-                    set_translation_attr, "set_translations", sql_connection
-                )
-    elif input_file.is_dir():
-        for setFile in input_file.glob("*.json"):
-            LOGGER.info("Loading {} into memory...".format(setFile.name))
-            set_data = json.load(setFile.open("r", encoding="utf8"))
-            set_code = setFile.stem
-            LOGGER.info("Building set: {}".format(set_code))
-            set_insert_values = handle_set_row_insertion(set_data)
-            sql_dict_insert(set_insert_values, "sets", sql_connection)
-
-            for card in set_data.get("cards"):
-                LOGGER.debug("Inserting card row for {}".format(card.get("name")))
-                card_attr: Dict[str, Any] = handle_card_row_insertion(card, set_code)
-                sql_insert_all_card_fields(card_attr, sql_connection)
-
-            for token in set_data.get("tokens"):
-                LOGGER.debug("Inserting token row for {}".format(token.get("name")))
-                token_attr = handle_token_row_insertion(token, set_code)
-                sql_dict_insert(token_attr, "tokens", sql_connection)
-
-            for language, translation in set_data.get("translations", {}).items():
-                LOGGER.debug("Inserting set_translation row for {}".format(language))
-                set_translation_attr = handle_set_translation_row_insertion(
-                    language, translation, set_code
-                )
-                sql_dict_insert(
-                    set_translation_attr, "set_translations", sql_connection
-                )
-    sql_connection.commit()
-
-def sql_insert_all_card_fields(
-    card_attributes: Dict[str, Any], sql_connection: sqlite3.Connection
-) -> None:
-    """
-    Given all of the card's data, insert the data into the
-    appropriate SQLite tables.
-    :param card_attributes: Tuple of data
-    :param sql_connection: DB Connection
-    """
-    sql_dict_insert(card_attributes["cards"], "cards", sql_connection)
-
-    for foreign_val in card_attributes["foreignData"]:
-        sql_dict_insert(foreign_val, "foreignData", sql_connection)
-
-    for legal_val in card_attributes["legalities"]:
-        sql_dict_insert(legal_val, "legalities", sql_connection)
-
-    for rule_val in card_attributes["rulings"]:
-        sql_dict_insert(rule_val, "rulings", sql_connection)
-
-    for price_val in card_attributes["prices"]:
-        sql_dict_insert(price_val, "prices", sql_connection)
-
-
-def handle_set_row_insertion(set_data: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    This method will take the set data and convert it, preparing
-    for SQLite insertion
-    :param set_data: Data to process
-    :return: Dictionary ready for insertion
-    """
-    set_skip_keys = ["cards", "tokens", "translations"]
-    set_insert_values = {}
-
-    for key, value in set_data.items():
-        if key in set_skip_keys:
-            continue
-
-        if key == "boosterV3":
-            set_insert_values[key] = modify_for_sql_insert(str(value))
-            continue
-
-        set_insert_values[key] = modify_for_sql_insert(value)
-
-    return set_insert_values
-
-
-def handle_foreign_rows(
-    card_data: Dict[str, Any], card_uuid: str
-) -> List[Dict[str, Any]]:
+def apply_bulk_pragmas(sql_connection: sqlite3.Connection) -> None:
     """
-    This method will take the card data and convert it, preparing
-    for SQLite insertion
-    :param card_data: Data to process
-    :param card_uuid: UUID to be used as a key
-    :return: List of dicts ready for insertion
+    Trade durability for load speed. A crashed bulk build is
+    simply rebuilt from scratch.
+    :param sql_connection: Connection to the database being built
     """
+    LOGGER.info("Using bulk-load pragmas")
+    sql_connection.execute("pragma journal_mode=off;")
+    sql_connection.execute("pragma synchronous=off;")
+    sql_connection.execute(f"pragma cache_size=-{BULK_CACHE_SIZE_KIB};")
+    sql_connection.execute("pragma temp_store=memory;")
+    sql_connection.execute("pragma foreign_keys=off;")
 
-    foreign_entries = []
-    for entry in card_data["foreignData"]:
-        foreign_entries.append(
-            {
-                "uuid": card_uuid,
-                "flavorText": entry.get("flavorText", ""),
-                "language": entry.get("language", ""),
-                "multiverseId": entry.get("multiverseId", ""),
-                "name": entry.get("name", ""),
-                "text": entry.get("text", ""),
-                "type": entry.get("type", ""),
-            }
-        )
-
-    return foreign_entries
 
-
-def handle_legal_rows(
-    card_data: Dict[str, Any], card_uuid: str
-) -> List[Dict[str, Any]]:
-    """
-    This method will take the card data and convert it, preparing
-    for SQLite insertion
-    :param card_data: Data to process
-    :param card_uuid: UUID to be used as a key
-    :return: List of dicts, ready for insertion
+def enforce_deferred_constraints(sql_connection: sqlite3.Connection) -> bool:
     """
-    legalities = []
-    for card_format, format_status in card_data["legalities"].items():
-        legalities.append(
-            {"uuid": card_uuid, "format": card_format, "status": format_status}
-        )
-
-    return legalities
-
-
-def handle_ruling_rows(
-    card_data: Dict[str, Any], card_uuid: str
-) -> List[Dict[str, Any]]:
-    """
-    This method will take the card data and convert it, preparing
-    for SQLite insertion
-    :param card_data: Data to process
-    :param card_uuid: UUID to be used as a key
-    :return: List of dicts, ready for insertion
+    Add the UNIQUE constraints left out of a bulk build's schema as
+    unique indexes, then check every REFERENCES clause
+    :param sql_connection: Connection to the loaded database
+    :return: Good to continue status
     """
-    rulings = []
-    for rule in card_data["rulings"]:
-        rulings.append(
-            {
-                "uuid": card_uuid,
-                "date": rule.get("date", ""),
-                "text": rule.get("text", ""),
-            }
+    LOGGER.info("Validating UNIQUE and REFERENCES constraints")
+    tables = {
+        name
+        for (name,) in sql_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
         )
-    return rulings
-
-
-def handle_price_rows(
-    card_data: Dict[str, Any], card_uuid: str
-) -> List[Dict[str, Any]]:
-    """
-    This method will take the card data and convert it, preparing
-    for SQLite insertion
-    :param card_data: Data to process
-    :param card_uuid: UUID to be used as a key
-    :return: List of dicts, ready for insertion
-    """
-    prices = []
-    for type in card_data["prices"]:
-        for date, price in card_data["prices"][type].items():
-            prices.append(
-                {"uuid": card_uuid, "type": type, "price": price, "date": date}
-            )
-
-    return prices
-
-
-def handle_set_translation_row_insertion(
-    language: str, translation: str, set_name: str
-) -> Dict[str, Any]:
-    """
-    This method will take the set translation data and convert it, preparing
-    for SQLite insertion
-    :param language: The language of the set translation
-    :param translation: The set name translated in to the given language
-    :param set_name: Set name, as it's a card element
-    :return: Dictionary ready for insertion
-    """
-    set_translation_insert_values: Dict[str, Any] = {
-        "language": language,
-        "translation": translation,
-        "setCode": set_name,
     }
-
-    return set_translation_insert_values
-
-
-def handle_token_row_insertion(
-    token_data: Dict[str, Any], set_name: str
-) -> Dict[str, Any]:
-    """
-    This method will take the token data and convert it, preparing
-    for SQLite insertion
-    :param token_data: Data to process
-    :param set_name: Set name, as it's a card element
-    :return: Dictionary ready for insertion
-    """
-    token_insert_values: Dict[str, Any] = {"setCode": set_name}
-    for key, value in token_data.items():
-        token_insert_values[key] = modify_for_sql_insert(value)
-
-    return token_insert_values
-
-
-def handle_card_row_insertion(
-    card_data: Dict[str, Any], set_name: str
-) -> Dict[str, Any]:
-    """
-    This method will take the card data and convert it, preparing
-    for SQLite insertion
-    :param card_data: Data to process
-    :param set_name: Set name, as it's a card element
-    :return: Dictionary ready for insertion
-    """
-    # ORDERING MATTERS HERE
-    card_skip_keys = ["foreignData", "legalities", "rulings", "prices"]
-
-    card_insert_values: Dict[str, Any] = {"setCode": set_name}
-    for key, value in card_data.items():
-        if key in card_skip_keys:
+    for index_name, (table, column) in DEFERRED_UNIQUE_INDEXES.items():
+        if table not in tables:
             continue
-        card_insert_values[key] = modify_for_sql_insert(value)
-
-    foreign_insert_values: List[Dict[str, Any]] = []
-    if card_skip_keys[0] in card_data.keys():
-        foreign_insert_values = handle_foreign_rows(card_data, card_data["uuid"])
-
-    legal_insert_values: List[Dict[str, Any]] = []
-    if card_skip_keys[1] in card_data.keys():
-        legal_insert_values = handle_legal_rows(card_data, card_data["uuid"])
-
-    ruling_insert_values: List[Dict[str, Any]] = []
-    if card_skip_keys[2] in card_data.keys():
-        ruling_insert_values = handle_ruling_rows(card_data, card_data["uuid"])
-
-    price_insert_values: List[Dict[str, Any]] = []
-    if card_skip_keys[3] in card_data.keys():
-        price_insert_values = handle_price_rows(card_data, card_data["uuid"])
-
-    return {
-        "cards": card_insert_values,
-        "foreignData": foreign_insert_values,
-        "legalities": legal_insert_values,
-        "rulings": ruling_insert_values,
-        "prices": price_insert_values,
-    }
-
-
-def modify_for_sql_insert(data: Any) -> Union[str, int, float]:
-    """
-    Arrays and booleans can't be inserted, so we need to stringify
-    :param data: Data to modify
-    :return: string value
-    """
-    if isinstance(data, (str, int, float)):
-        return data
-
-    # If the value is empty/null, mark it in SQL as such
-    if not data:
-        return None
-
-    if isinstance(data, list) and data and isinstance(data[0], str):
-        return ", ".join(data)
-
-    if isinstance(data, bool):
-        return int(data)
-
-    if isinstance(data, dict):
-        return str(data)
+        try:
+            sql_connection.execute(
+                f"CREATE UNIQUE INDEX `{index_name}` ON `{table}`({column})"
+            )
+        except sqlite3.IntegrityError:
+            duplicates = sql_connection.execute(
+                f"SELECT {column} FROM `{table}` WHERE {column} IS NOT NULL "
+                f"GROUP BY {column} HAVING COUNT(*) > 1 LIMIT 10"
+            ).fetchall()
+            duplicate_values = ", ".join(str(value) for (value,) in duplicates)
+            LOGGER.fatal(f"Duplicate {table}.{column} values: {duplicate_values}")
+            return False
+
+    violations: Dict[str, int] = {}
+    for table, _, _, _ in sql_connection.execute("pragma foreign_key_check;"):
+        violations[table] = violations.get(table, 0) + 1
+    for table, violation_count in violations.items():
+        LOGGER.warning(f"{violation_count} rows in {table} reference missing keys")
 
-    return ""
+    sql_connection.commit()
+    return True
 
 
-def sql_dict_insert(
-    data: Dict[str, Any], table: str, sql_connection: sqlite3.Connection
+def finish_bulk_build(
+    sql_connection: sqlite3.Connection, output_connection: sqlite3.Connection
 ) -> None:
     """
-    Insert a dictionary into a sqlite table
-    :param data: Dict to insert
-    :param table: Table to insert to
-    :param sql_connection: SQL connection
+    Gather planner statistics, copy an in-memory build to the output
+    file, and compact the output
+    :param sql_connection: Connection the database was built in
+    :param output_connection: Connection to the output file
     """
-    cursor = sql_connection.cursor()
-    columns = ", ".join(data.keys())
-    placeholders = ":" + ", :".join(data.keys())
-    query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-    cursor.execute(query, data)
+    LOGGER.info("Running ANALYZE")
+    sql_connection.execute("ANALYZE")
+    sql_connection.commit()
+
+    if sql_connection is not output_connection:
+        LOGGER.info("Writing in-memory database to output file")
+        sql_connection.backup(output_connection)
+        sql_connection.close()
+
+    LOGGER.info("Running VACUUM")
+    output_connection.execute("pragma journal_mode=wal;")
+    output_connection.execute("VACUUM")
@@ -0,0 +1,395 @@
+"""
+Incremental MTGJSON reader, so large inputs never have to fit in memory
+"""
+import bz2
+import gzip
+import json
+import logging
+import lzma
+import mmap
+import os
+import pathlib
+import re
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, Optional, TextIO, Tuple
+
+orjson: Optional[ModuleType]
+try:
+    import orjson
+except ImportError:  # Optional, for --json-decoder orjson
+    orjson = None
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE: int = 1 << 20
+
+# Suffixes accepted for set files in AllSetFiles directory mode
+JSON_SUFFIXES = (".json", ".json.gz", ".json.xz", ".json.bz2")
+
+# Set members that are streamed one element at a time in card mode
+STREAMED_SET_KEYS = ("cards", "tokens")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Compressed formats, by the magic bytes their files start with
+COMPRESSION_OPENERS = (
+    (b"\x1f\x8b", gzip.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+    (b"BZh", bz2.open),
+)
+
+JsonLoader = Callable[[pathlib.Path], Any]
+
+
+def load_stdlib(path: pathlib.Path) -> Any:
+    """
+    Decode a file with the stdlib decoder, which memoizes object keys
+    within a document: the many repeated keys (price dates, field
+    names) share one string each
+    :param path: File to load
+    :return: Decoded document
+    """
+    with open_json_file(path) as json_file:
+        return json.load(json_file)
+
+
+def load_orjson(path: pathlib.Path) -> Any:
+    """
+    Decode a file with orjson, handing it the file's bytes directly;
+    uncompressed files are memory mapped rather than read. Faster than
+    the stdlib decoder, but orjson only caches short keys, so every
+    price date key becomes a string of its own: peak memory is higher.
+    :param path: File to load
+    :return: Decoded document
+    """
+    if orjson is None:
+        raise ImportError("--json-decoder orjson needs orjson (pip3 install orjson)")
+
+    opener = get_compression_opener(path)
+    if opener is not None:
+        with opener(str(path), "rb") as json_file:
+            return orjson.loads(json_file.read())
+
+    with path.open("rb") as json_file:
+        if os.fstat(json_file.fileno()).st_size == 0:
+            return orjson.loads(b"")
+
+        with mmap.mmap(json_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return orjson.loads(view)
+            finally:
+                # The map can't be closed while a view of it exists
+                view.release()
+
+
+# Whole file decoders, the default (leanest) first. orjson reads
+# integers beyond 64 bits as floats; MTGJSON has none.
+JSON_DECODERS: Dict[str, JsonLoader] = {"json": load_stdlib}
+if orjson is not None:
+    JSON_DECODERS["orjson"] = load_orjson
+
+# Decoder of load_json_file calls that don't name one, see set_json_decoder
+_selected_decoder: Dict[str, str] = {"name": next(iter(JSON_DECODERS))}
+
+
+def set_json_decoder(name: str) -> None:
+    """
+    Pick the decoder load_json_file uses by default, in this process.
+    Worker processes get it as their pool initializer.
+    :param name: Decoder from JSON_DECODERS
+    """
+    _selected_decoder["name"], _ = get_json_decoder(name)
+
+
+def get_json_decoder(name: Optional[str] = None) -> Tuple[str, JsonLoader]:
+    """
+    :param name: Decoder from JSON_DECODERS, None for the selected one
+    :return: Decoder name and function
+    """
+    if name is None:
+        name = _selected_decoder["name"]
+    if name not in JSON_DECODERS:
+        raise ValueError(
+            "Unknown JSON decoder {} (available: {})".format(
+                name, ", ".join(JSON_DECODERS)
+            )
+        )
+    return name, JSON_DECODERS[name]
+
+
+def get_compression_opener(path: pathlib.Path) -> Optional[Callable[..., Any]]:
+    """
+    :param path: File to check
+    :return: open() of the file's compression format, None if uncompressed
+    """
+    with path.open("rb") as raw_file:
+        magic = raw_file.read(6)
+
+    for prefix, opener in COMPRESSION_OPENERS:
+        if magic.startswith(prefix):
+            return opener
+    return None
+
+
+def open_json_file(path: pathlib.Path) -> TextIO:
+    """
+    Open a JSON file for reading, decompressing gzip, xz
+    and bzip2 inputs on the fly
+    :param path: File to open
+    :return: Text stream of the JSON document
+    """
+    opener = get_compression_opener(path)
+    if opener is not None:
+        return opener(str(path), "rt", encoding="utf8")  # type: ignore
+    return path.open("r", encoding="utf8")
+
+
+def strip_json_suffix(path: pathlib.Path) -> str:
+    """
+    Get a set code from a set file name, compressed or not
+    :param path: Set file (i.e. "10E.json.gz")
+    :return: Name without JSON/compression suffix (i.e. "10E")
+    """
+    for suffix in sorted(JSON_SUFFIXES, key=len, reverse=True):
+        if path.name.endswith(suffix):
+            return path.name[: -len(suffix)]
+    return path.stem
+
+
+class JsonStreamReader:
+    """
+    Pull-style JSON reader that walks objects and arrays key by key,
+    element by element, and only fully decodes the values asked for.
+    Values are decoded by the stdlib C decoder, so only the structure
+    between them is scanned in Python.
+    """
+
+    def __init__(self, stream: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """
+        :param stream: Text stream to read from
+        :param chunk_size: Characters read from the stream at a time
+        """
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def read_value(self) -> Any:
+        """
+        Decode the next complete JSON value
+        :return: Decoded value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Value may just be cut off; grow geometrically so
+                # a large value is not re-scanned once per chunk
+                if not self._read_more(max(self._chunk_size, len(self._buffer))):
+                    raise
+                continue
+
+            # A number or literal ending at the buffer edge may continue
+            if end == len(self._buffer) and self._read_more(self._chunk_size):
+                continue
+
+            self._pos = end
+            return value
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Walk the members of the next JSON object. Each key is yielded
+        with the reader positioned at its value, which the caller
+        must consume (read_value, iter_object or iter_array) before
+        advancing.
+        :return: Iterator of member keys
+        """
+        self._expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise self._error("Expecting property name")
+            self._expect(":")
+            yield key
+            if self._next_separator("}"):
+                return
+
+    def iter_array(self) -> Iterator[None]:
+        """
+        Walk the elements of the next JSON array. The reader is
+        positioned at each element when the iterator yields, and
+        the caller must consume it before advancing.
+        :return: Iterator, one step per element
+        """
+        self._expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            yield None
+            if self._next_separator("]"):
+                return
+
+    def _next_separator(self, closing: str) -> bool:
+        """
+        Consume a "," or the closing character of a container
+        :param closing: "}" or "]"
+        :return: True if the container is finished
+        """
+        char = self.peek()
+        if char == closing:
+            self._pos += 1
+            return True
+        if char != ",":
+            raise self._error(f"Expecting ',' or '{closing}' delimiter")
+        self._pos += 1
+        return False
+
+    def _expect(self, char: str) -> None:
+        """
+        Consume one structural character
+        :param char: Character that must come next
+        """
+        if self.peek() != char:
+            raise self._error(f"Expecting '{char}'")
+        self._pos += 1
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and look at the next character
+        :return: Next character, or "" at the end of the stream
+        """
+        while True:
+            match = _WHITESPACE.match(self._buffer, self._pos)
+            self._pos = match.end() if match else self._pos
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more(self._chunk_size):
+                return ""
+
+    def _read_more(self, size: int) -> bool:
+        """
+        Append the next chunk of the stream to the buffer, dropping
+        whatever has already been consumed
+        :param size: Characters to read
+        :return: False if the stream is exhausted
+        """
+        if self._eof:
+            return False
+
+        chunk = self._stream.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        """
+        :param message: What went wrong
+        :return: Decode error pointing at the current position
+        """
+        return json.JSONDecodeError(message, self._buffer, self._pos)
+
+
+def iter_sets(stream: TextIO) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield the sets of an AllSets.json document one at a time
+    :param stream: AllSets.json stream
+    :return: Iterator of (set code, set data)
+    """
+    reader = JsonStreamReader(stream)
+    for set_code in reader.iter_object():
+        yield set_code, reader.read_value()
+
+
+def iter_set_items(stream: TextIO) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Yield the cards and tokens of an AllSets.json document one at a
+    time. Once a set's object is finished, its remaining fields are
+    yielded as a "set" item (without cards or tokens).
+    :param stream: AllSets.json stream
+    :return: Iterator of (set code, "cards"/"tokens"/"set", data)
+    """
+    reader = JsonStreamReader(stream)
+    for set_code in reader.iter_object():
+        yield from _iter_set_object(reader, set_code)
+
+
+def iter_set_file_items(
+    stream: TextIO, set_code: str
+) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Same as iter_set_items, for a single set file from AllSetFiles
+    :param stream: Set file stream
+    :param set_code: Set code of the file
+    :return: Iterator of (set code, "cards"/"tokens"/"set", data)
+    """
+    return _iter_set_object(JsonStreamReader(stream), set_code)
+
+
+def _iter_set_object(
+    reader: JsonStreamReader, set_code: str
+) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Walk a single set object
+    :param reader: Reader positioned at the set object
+    :param set_code: Set code
+    :return: Iterator of (set code, "cards"/"tokens"/"set", data)
+    """
+    set_header: Dict[str, Any] = {}
+    for key in reader.iter_object():
+        if key not in STREAMED_SET_KEYS:
+            set_header[key] = reader.read_value()
+            continue
+
+        if reader.peek() == "n":
+            # "cards": null
+            reader.read_value()
+            continue
+
+        for _ in reader.iter_array():
+            yield set_code, key, reader.read_value()
+
+    yield set_code, "set", set_header
+
+
+def load_json_file(path: pathlib.Path, decoder: Optional[str] = None) -> Any:
+    """
+    Load a whole (possibly compressed) JSON file into memory, retrying
+    with the stdlib decoder if another one rejects it (i.e. orjson and
+    NaN)
+    :param path: File to load
+    :param decoder: Decoder from JSON_DECODERS, None for the selected one
+    :return: Decoded document
+    """
+    name, load = get_json_decoder(decoder)
+    try:
+        return load(path)
+    except ValueError as error:
+        if load is load_stdlib:
+            raise
+        LOGGER.warning(f"{name} could not decode {path} ({error}), retrying")
+        return load_stdlib(path)
+
+
+def find_set_files(input_dir: pathlib.Path) -> Iterator[pathlib.Path]:
+    """
+    Find the set files of an AllSetFiles directory
+    :param input_dir: AllSetFiles directory
+    :return: Iterator of set files, compressed or not
+    """
+    for path in sorted(input_dir.iterdir()):
+        if path.is_file() and path.name.endswith(JSON_SUFFIXES):
+            yield path
@@ -0,0 +1,211 @@
+"""
+Stage timers, row counters and memory sampling for the conversion
+"""
+import json
+import logging
+import pathlib
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None  # type: ignore
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PROGRESS_INTERVAL: float = 10.0
+
+# Tables counted as cards in progress lines (cards_interned with --interned)
+CARD_TABLES = ("cards", "cards_interned")
+
+T = TypeVar("T")
+
+
+class PipelineMetrics:
+    """
+    Time spent per pipeline stage (decode, transform, insert,
+    commit, ...). Stages nest, and time is only booked on the
+    innermost one, so the stage times add up to the time measured.
+    """
+
+    def __init__(self, progress_interval: float = 0.0) -> None:
+        """
+        :param progress_interval: Seconds between progress lines, 0 for none
+        """
+        self.progress_interval = progress_interval
+        self.stage_seconds: Dict[str, float] = {}
+        self.worker_seconds: Dict[str, float] = {}
+        self.rss_samples: List[Tuple[float, int]] = []
+
+        self._stages: List[str] = []
+        self._stage_start = 0.0
+        self._start_time = time.perf_counter()
+        self._last_progress = self._start_time
+
+    def start_stage(self, name: str) -> None:
+        """
+        Book time on a stage until the matching end_stage,
+        pausing the stage it is nested in
+        :param name: Stage name
+        """
+        now = time.perf_counter()
+        if self._stages:
+            outer = self._stages[-1]
+            self.stage_seconds[outer] = (
+                self.stage_seconds.get(outer, 0.0) + now - self._stage_start
+            )
+        self._stages.append(name)
+        self._stage_start = now
+
+    def end_stage(self) -> None:
+        """
+        Stop booking time on the current stage
+        """
+        now = time.perf_counter()
+        name = self._stages.pop()
+        self.stage_seconds[name] = (
+            self.stage_seconds.get(name, 0.0) + now - self._stage_start
+        )
+        self._stage_start = now
+
+    def timed_iter(self, name: str, iterator: Iterator[T]) -> Iterator[T]:
+        """
+        Book the time spent producing each item (i.e. parsing
+        a JSON stream) on a stage
+        :param name: Stage name
+        :param iterator: Items to produce
+        :return: The same items
+        """
+        while True:
+            self.start_stage(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.end_stage()
+            yield item
+
+    def add_worker_seconds(self, stage_seconds: Dict[str, float]) -> None:
+        """
+        Add stage times measured in a worker process. They are kept
+        apart, as workers run alongside each other and the main process.
+        :param stage_seconds: Seconds per stage
+        """
+        for name, seconds in stage_seconds.items():
+            self.worker_seconds[name] = self.worker_seconds.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self) -> float:
+        """
+        :return: Seconds since the metrics were created
+        """
+        return time.perf_counter() - self._start_time
+
+    def sample_rss(self) -> Optional[int]:
+        """
+        Record the current resident memory
+        :return: Resident memory in bytes, if known
+        """
+        rss = current_rss()
+        if rss is not None:
+            self.rss_samples.append((round(self.elapsed, 3), rss))
+        return rss
+
+    def check_progress(self, table_counts: Dict[str, int]) -> None:
+        """
+        Log a progress line if the interval has passed since the last one
+        :param table_counts: Rows written per table so far
+        """
+        now = time.perf_counter()
+        if (
+            not self.progress_interval
+            or now - self._last_progress < self.progress_interval
+        ):
+            return
+
+        self._last_progress = now
+        rows = sum(table_counts.values())
+        LOGGER.info(
+            "Progress: {} cards, {} rows ({:.0f} rows/sec), RSS {}; {}".format(
+                sum(table_counts.get(table, 0) for table in CARD_TABLES),
+                rows,
+                rows / self.elapsed,
+                format_bytes(self.sample_rss()),
+                self.format_stages(),
+            )
+        )
+
+    def format_stages(self) -> str:
+        """
+        :return: Seconds per stage, as a log friendly string
+        """
+        return ", ".join(
+            f"{name} {seconds:.2f}s" for name, seconds in self.stage_seconds.items()
+        )
+
+    def report(self, table_counts: Dict[str, int]) -> Dict[str, Any]:
+        """
+        :param table_counts: Rows written per table
+        :return: Final metrics, JSON serializable
+        """
+        self.sample_rss()
+        elapsed = self.elapsed
+        rows = sum(table_counts.values())
+        return {
+            "elapsed_seconds": elapsed,
+            "rows": rows,
+            "rows_per_second": rows / elapsed if elapsed > 0 else 0.0,
+            "stages": self.stage_seconds,
+            "worker_stages": self.worker_seconds,
+            "tables": table_counts,
+            "peak_rss_bytes": peak_rss(),
+            "rss_samples": self.rss_samples,
+        }
+
+    def write_report(
+        self, report_file: pathlib.Path, table_counts: Dict[str, int]
+    ) -> None:
+        """
+        Save the final metrics as JSON
+        :param report_file: File to write
+        :param table_counts: Rows written per table
+        """
+        with report_file.open("w", encoding="utf8") as output:
+            json.dump(self.report(table_counts), output, indent=2)
+        LOGGER.info(f"Wrote metrics to {report_file}")
+
+
+def current_rss() -> Optional[int]:
+    """
+    :return: Resident memory of this process in bytes, if known
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        return peak_rss()
+
+
+def peak_rss() -> Optional[int]:
+    """
+    :return: Peak resident memory of this process in bytes, if known
+    """
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def format_bytes(byte_count: Optional[int]) -> str:
+    """
+    :param byte_count: Number of bytes
+    :return: Human readable size
+    """
+    if byte_count is None:
+        return "unknown"
+    return f"{byte_count / (1 << 20):.1f} MiB"
@@ -0,0 +1,103 @@
+"""
+Oracle-level card table, one row per card instead of per printing
+"""
+import logging
+import sqlite3
+from typing import List, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+ORACLE_TABLE: str = "oracle_cards"
+
+# Rules-relevant columns, the same for every printing of a card
+ORACLE_COLUMNS: List[Tuple[str, str]] = [
+    ("name", "TEXT"),
+    ("names", "TEXT"),
+    ("layout", "TEXT"),
+    ("manaCost", "TEXT"),
+    ("convertedManaCost", "FLOAT"),
+    ("colors", "TEXT"),
+    ("colorIdentity", "TEXT"),
+    ("colorIndicator", "TEXT"),
+    ("type", "TEXT"),
+    ("supertypes", "TEXT"),
+    ("types", "TEXT"),
+    ("subtypes", "TEXT"),
+    ("text", "TEXT"),
+    ("power", "TEXT"),
+    ("toughness", "TEXT"),
+    ("loyalty", "TEXT"),
+    ("hand", "TEXT"),
+    ("life", "TEXT"),
+    ("leadershipSkills", "TEXT"),
+    ("isReserved", "INTEGER NOT NULL DEFAULT 0"),  # boolean
+    ("edhrecRank", "TEXT"),
+]
+
+
+def has_oracle_table(sql_connection: sqlite3.Connection) -> bool:
+    """
+    :param sql_connection: Connection to the database
+    :return: Whether the database has an oracle table
+    """
+    (table_count,) = sql_connection.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (ORACLE_TABLE,),
+    ).fetchone()
+    return bool(table_count)
+
+
+def build_oracle_table(sql_connection: sqlite3.Connection) -> None:
+    """
+    Fill the oracle table from the loaded cards, in one pass. There is
+    a row per scryfallOracleId and side (the faces of a card share their
+    oracle id), with the rules text of its most recent printing, whose
+    uuid it keeps to reach legalities and rulings. Printings find their
+    oracle row through their own scryfallOracleId and side.
+    :param sql_connection: Connection to the loaded database
+    """
+    LOGGER.info(f"Building {ORACLE_TABLE}")
+    column_names = [name for name, _ in ORACLE_COLUMNS]
+    sql_connection.execute(
+        f"CREATE TABLE IF NOT EXISTS `{ORACLE_TABLE}` ("
+        "id INTEGER PRIMARY KEY,"
+        "scryfallOracleId TEXT(36) NOT NULL,"
+        "side TEXT,"
+        "uuid TEXT(36) NOT NULL,"
+        "printingCount INTEGER NOT NULL,"
+        + ",".join(f"{name} {definition}" for name, definition in ORACLE_COLUMNS)
+        + ")"
+    )
+    sql_connection.execute(f"DELETE FROM `{ORACLE_TABLE}`")
+
+    # With a single max(), SQLite takes the other (bare) columns from
+    # the row holding the maximum: the latest printing, by release date
+    selected = ", ".join(
+        ["scryfallOracleId", "side", "uuid", "printingCount"] + column_names
+    )
+    sql_connection.execute(
+        f"INSERT INTO `{ORACLE_TABLE}` ({selected}) "
+        f"SELECT {selected} FROM ("
+        "SELECT c.*, COUNT(*) AS printingCount, "
+        "MAX(IFNULL(s.releaseDate, '') || c.uuid) AS latestPrinting "
+        "FROM cards AS c LEFT JOIN sets AS s ON s.code = c.setCode "
+        "WHERE c.scryfallOracleId IS NOT NULL "
+        "GROUP BY c.scryfallOracleId, c.side"
+        ") ORDER BY scryfallOracleId, side"
+    )
+    sql_connection.commit()
+
+    (row_count,) = sql_connection.execute(
+        f"SELECT COUNT(*) FROM `{ORACLE_TABLE}`"
+    ).fetchone()
+    LOGGER.info(f"{ORACLE_TABLE} holds {row_count} cards")
+
+
+def refresh_oracle_table(sql_connection: sqlite3.Connection) -> None:
+    """
+    Rebuild the oracle table, if the database has one, after the
+    cards were changed in place
+    :param sql_connection: Connection to the database
+    """
+    if has_oracle_table(sql_connection):
+        build_oracle_table(sql_connection)
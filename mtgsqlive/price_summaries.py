@@ -0,0 +1,141 @@
+"""
+Per-card price summaries: the latest price of each price type, its
+range and moving averages, computed while the price history is loaded
+"""
+import bisect
+import datetime
+import functools
+import re
+import sqlite3
+from typing import Any, Dict, List, Tuple
+
+# Moving average windows, in days, of --price-summaries
+DEFAULT_PRICE_WINDOWS: Tuple[int, ...] = (7, 30)
+
+# Column holding the moving average over a window, i.e. average7d
+AVERAGE_COLUMN_PATTERN = re.compile(r"^average(\d+)d$")
+
+
+def average_column(days: int) -> str:
+    """
+    :param days: Window length
+    :return: Column holding the average price over the window
+    """
+    return f"average{days}d"
+
+
+def parse_price_windows(windows: str) -> Tuple[int, ...]:
+    """
+    :param windows: Comma separated window lengths, in days
+    :return: Window lengths, shortest first
+    """
+    try:
+        days = {int(window) for window in windows.split(",") if window.strip()}
+    except ValueError as error:
+        raise ValueError(
+            f"Price windows must be numbers of days ({windows})"
+        ) from error
+    if not days or min(days) < 1:
+        raise ValueError(f"Price windows must be at least one day ({windows})")
+    return tuple(sorted(days))
+
+
+def get_price_windows(sql_connection: sqlite3.Connection, table: str) -> Tuple[int, ...]:
+    """
+    :param sql_connection: Connection to the database
+    :param table: Price summary table
+    :return: Window lengths of its moving average columns, none if
+    there's no such table
+    """
+    days = []
+    for column in sql_connection.execute(f"PRAGMA table_info(`{table}`)"):
+        match = AVERAGE_COLUMN_PATTERN.match(column[1])
+        if match:
+            days.append(int(match.group(1)))
+    return tuple(sorted(days))
+
+
+def build_price_summary_schema(
+    sql_connection: sqlite3.Connection,
+    table: str,
+    card_key: str,
+    type_column: str,
+    windows: Tuple[int, ...],
+) -> None:
+    """
+    Create the price summary table, one row per card and price type
+    :param sql_connection: Connection to the database
+    :param table: Name of the table
+    :param card_key: Column definition referencing the card
+    :param type_column: Column definition of the price type
+    :param windows: Moving average windows, in days
+    """
+    sql_connection.execute(
+        f"CREATE TABLE `{table}` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        f"{type_column},"
+        "latestDate TEXT,"
+        "latestPrice REAL,"
+        "minPrice REAL,"
+        "maxPrice REAL,"
+        "pointCount INTEGER NOT NULL,"
+        + "".join(f"{average_column(days)} REAL," for days in windows)
+        + f"{card_key}"
+        ")"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def window_start(latest_date: str, days: int) -> str:
+    """
+    Most cards share their latest date, so this is cached
+    :param latest_date: ISO date (YYYY-MM-DD) the window ends on
+    :param days: Window length, the latest date included
+    :return: ISO date of the first day of the window
+    """
+    year, month, day = latest_date.split("-")
+    start = datetime.date(int(year), int(month), int(day)) - datetime.timedelta(
+        days=days - 1
+    )
+    return start.isoformat()
+
+
+def handle_price_summary_rows(
+    card_data: Dict[str, Any], card_uuid: str, windows: Tuple[int, ...]
+) -> List[Dict[str, Any]]:
+    """
+    Summarize each price series of a card. Moving averages cover the
+    days of the window ending on the latest date of the series.
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :param windows: Moving average windows, in days
+    :return: List of dicts, ready for insertion
+    """
+    summaries = []
+    for price_type, series in card_data["prices"].items():
+        # ISO dates sort chronologically as text
+        points = sorted(
+            (date, price) for date, price in series.items() if price is not None
+        )
+        if not points:
+            continue
+
+        dates = [date for date, _ in points]
+        prices = [price for _, price in points]
+        summary = {
+            "uuid": card_uuid,
+            "type": price_type,
+            "latestDate": dates[-1],
+            "latestPrice": prices[-1],
+            "minPrice": min(prices),
+            "maxPrice": max(prices),
+            "pointCount": len(points),
+        }
+        for days in windows:
+            window_prices = prices[
+                bisect.bisect_left(dates, window_start(dates[-1], days)) :
+            ]
+            summary[average_column(days)] = sum(window_prices) / len(window_prices)
+        summaries.append(summary)
+
+    return summaries
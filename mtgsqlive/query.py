@@ -0,0 +1,714 @@
+"""
+Read-side lookups over a generated database
+
+    with CardDatabase("AllPrintings.sqlite") as database:
+        card = database.card("5f8287b1-5bb6-5f4c-ad17-316a40d5bb0c")
+        legalities = database.legalities([card["uuid"]])
+        deck = database.card_bundles_named(["Llanowar Elves", "Forest"])
+"""
+import collections
+import contextlib
+import logging
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from mtgsqlive.satellites import attach_satellites, manifest_path
+from mtgsqlive.search import search_cards
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE: int = 4
+DEFAULT_CACHE_SIZE: int = 4096
+DEFAULT_MMAP_SIZE: int = 1 << 30
+
+# Seconds between checks of the database file for a new build
+DEFAULT_CHECK_INTERVAL: float = 1.0
+
+# Prepared statements kept per connection; every query below uses
+# fixed SQL text, so each is prepared once per connection
+STATEMENT_CACHE_SIZE: int = 64
+
+# Keys per batched statement. Shorter batches are padded with NULLs,
+# keeping the SQL text (and the prepared statement) the same.
+BATCH_SIZE: int = 100
+
+T = TypeVar("T")
+
+Row = Dict[str, Any]
+
+
+class Ruling(NamedTuple):
+    """
+    Ruling on a card
+    """
+
+    date: str
+    text: str
+
+
+class PricePoint(NamedTuple):
+    """
+    Price of a card on a day
+    """
+
+    type: str
+    date: str
+    price: float
+
+
+class CardBundle(NamedTuple):
+    """
+    A card and its child rows
+    """
+
+    card: Row
+    legalities: Dict[str, str]
+    rulings: List[Ruling]
+    prices: List[PricePoint]
+    foreign_data: List[Row]
+
+
+# Every query reads the views carrying the public table names,
+# so it works whatever layout the database was built with
+SET_BY_CODE_QUERY = "SELECT * FROM sets WHERE code = ?"
+CARD_BY_UUID_QUERY = "SELECT * FROM cards WHERE uuid = ?"
+CARDS_BY_NAME_QUERY = "SELECT * FROM cards WHERE name = ? ORDER BY setCode, number"
+CARDS_BY_NAME_AND_SET_QUERY = (
+    "SELECT * FROM cards WHERE name = ? AND setCode = ? ORDER BY number"
+)
+CARDS_BY_SET_QUERY = "SELECT * FROM cards WHERE setCode = ? ORDER BY number, uuid"
+RULINGS_QUERY = "SELECT date, text FROM rulings WHERE uuid = ? ORDER BY date, id"
+PRICE_HISTORY_QUERY = (
+    "SELECT type, date, price FROM prices WHERE uuid = ? ORDER BY type, date"
+)
+PRICE_HISTORY_BY_TYPE_QUERY = (
+    "SELECT type, date, price FROM prices WHERE uuid = ? AND type = ? ORDER BY date"
+)
+
+
+def rows_as_dicts(columns: List[str], rows: List[Tuple[Any, ...]]) -> List[Row]:
+    """
+    :param columns: Column names
+    :param rows: Rows
+    :return: One dict per row
+    """
+    return [dict(zip(columns, row)) for row in rows]
+
+
+class BatchQuery(NamedTuple):
+    """
+    Lookup of many keys in one statement. The query's first column is
+    the key, the others are grouped per key and converted together.
+    """
+
+    query: str
+    convert: Callable[[List[str], List[Tuple[Any, ...]]], Any]
+
+
+def batch_query(select: str, key: str, order: str) -> str:
+    """
+    The keys are a list of parameters, not a json_each() subquery:
+    SQLite pushes a constant IN list down into the UNION ALL legalities
+    view of --legalities wide builds, but scans the view for a subquery.
+    :param select: SELECT ... FROM ..., selecting the key first
+    :param key: Key column
+    :param order: Order of the rows of each key
+    :return: Query taking BATCH_SIZE keys
+    """
+    placeholders = ", ".join("?" * BATCH_SIZE)
+    return f"{select} WHERE {key} IN ({placeholders}) ORDER BY {order}"
+
+
+# Batched lookups by kind; each result is cached under (kind, key),
+# the same entries the lookups of a single key use
+BATCH_QUERIES: Dict[str, BatchQuery] = {
+    "card": BatchQuery(
+        batch_query("SELECT uuid AS batchKey, * FROM cards", "uuid", "uuid"),
+        rows_as_dicts,
+    ),
+    "named": BatchQuery(
+        batch_query(
+            "SELECT name AS batchKey, * FROM cards", "name", "name, setCode, number"
+        ),
+        rows_as_dicts,
+    ),
+    "legalities": BatchQuery(
+        batch_query(
+            "SELECT uuid, format, status FROM legalities", "uuid", "uuid, format"
+        ),
+        lambda columns, rows: dict(rows),
+    ),
+    "rulings": BatchQuery(
+        batch_query("SELECT uuid, date, text FROM rulings", "uuid", "uuid, date, id"),
+        lambda columns, rows: [Ruling(*row) for row in rows],
+    ),
+    "prices": BatchQuery(
+        batch_query(
+            "SELECT uuid, type, date, price FROM prices", "uuid", "uuid, type, date"
+        ),
+        lambda columns, rows: [PricePoint(*row) for row in rows],
+    ),
+    "foreignData": BatchQuery(
+        batch_query(
+            "SELECT uuid AS batchKey, * FROM foreignData", "uuid", "uuid, language, id"
+        ),
+        rows_as_dicts,
+    ),
+    "priceSummaries": BatchQuery(
+        batch_query(
+            "SELECT uuid AS batchKey, * FROM price_summaries", "uuid", "uuid, type"
+        ),
+        lambda columns, rows: {
+            summary["type"]: summary for summary in rows_as_dicts(columns, rows)
+        },
+    ),
+}
+
+# Child rows of a CardBundle, by batch kind
+BUNDLE_PARTS = ("legalities", "rulings", "prices", "foreignData")
+
+
+def connect_read_only(
+    db_file: pathlib.Path, mmap_size: int = DEFAULT_MMAP_SIZE
+) -> sqlite3.Connection:
+    """
+    Open a database that nothing writes to. immutable=1 skips all file
+    locking and change detection, so a new build has to replace the
+    file (i.e. be renamed over it) instead of writing into it. The
+    satellites of a --split build are attached along with it.
+    :param db_file: Database file
+    :param mmap_size: Bytes of the file to memory map, 0 for none
+    :return: Connection usable from any thread, one thread at a time
+    """
+    sql_connection = sqlite3.connect(
+        db_file.resolve().as_uri() + "?mode=ro&immutable=1",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    sql_connection.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    manifest_file = manifest_path(db_file)
+    if manifest_file.is_file():
+        for name in attach_satellites(sql_connection, manifest_file, read_only=True):
+            sql_connection.execute(f"PRAGMA `{name}`.mmap_size = {int(mmap_size)}")
+    return sql_connection
+
+
+class ConnectionPool:
+    """
+    Bounded pool of read-only connections to one database file.
+    Callers block while all connections are in use.
+    """
+
+    def __init__(
+        self,
+        db_file: pathlib.Path,
+        size: int = DEFAULT_POOL_SIZE,
+        mmap_size: int = DEFAULT_MMAP_SIZE,
+    ) -> None:
+        """
+        :param db_file: Database file
+        :param size: Maximum number of open connections
+        :param mmap_size: Bytes of the file to memory map, 0 for none
+        """
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1 ({size})")
+
+        self.db_file = db_file
+        self.mmap_size = mmap_size
+        self.generation = 0
+        self._idle: "queue.LifoQueue[Tuple[int, sqlite3.Connection]]" = (
+            queue.LifoQueue()
+        )
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection, opening it if no idle one is left
+        :return: Connection, returned to the pool on exit
+        """
+        self._slots.acquire()
+        try:
+            generation, sql_connection = self._get_idle()
+            try:
+                yield sql_connection
+            finally:
+                with self._lock:
+                    current = generation == self.generation
+                if current:
+                    self._idle.put((generation, sql_connection))
+                else:
+                    sql_connection.close()
+        finally:
+            self._slots.release()
+
+    def _get_idle(self) -> Tuple[int, sqlite3.Connection]:
+        """
+        :return: Idle connection of the current generation, or a new one
+        """
+        while True:
+            try:
+                generation, sql_connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                return generation, sql_connection
+            sql_connection.close()
+
+        with self._lock:
+            generation = self.generation
+        return generation, connect_read_only(self.db_file, self.mmap_size)
+
+    def reset(self) -> None:
+        """
+        Close every connection, i.e. once the file was replaced.
+        Connections in use are closed when they are returned.
+        """
+        with self._lock:
+            self.generation += 1
+        self._close_idle()
+
+    def close(self) -> None:
+        """
+        Close the idle connections, and the ones in use once returned
+        """
+        self.reset()
+
+    def _close_idle(self) -> None:
+        """
+        Close the connections waiting in the pool
+        """
+        while True:
+            try:
+                _, sql_connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            sql_connection.close()
+
+
+class ResultCache:
+    """
+    Bounded least recently used cache of query results. Results
+    loaded before a clear() are dropped instead of being stored.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE) -> None:
+        """
+        :param max_entries: Results kept, 0 to cache nothing
+        """
+        self.max_entries = max_entries
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "collections.OrderedDict[Hashable, Any]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        :param key: Result key
+        :return: Whether the key was found, and its result
+        """
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key: Hashable, value: Any, generation: int) -> None:
+        """
+        :param key: Result key
+        :param value: Result
+        :param generation: Cache generation the result was loaded in
+        """
+        if not self.max_entries:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drop every result
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CardDatabase:
+    """
+    Typed lookups over a generated database, through a connection pool
+    and a result cache. Safe to share between threads. Results are
+    shared with the cache, so treat them as read-only.
+    """
+
+    def __init__(
+        self,
+        db_file: Union[str, pathlib.Path],
+        pool_size: int = DEFAULT_POOL_SIZE,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        mmap_size: int = DEFAULT_MMAP_SIZE,
+        check_interval: float = DEFAULT_CHECK_INTERVAL,
+    ) -> None:
+        """
+        :param db_file: Database file
+        :param pool_size: Maximum number of open connections
+        :param cache_size: Results kept in the cache, 0 for none
+        :param mmap_size: Bytes of the file to memory map, 0 for none
+        :param check_interval: Seconds between checks of the file for a
+        new build, which empties the cache and reopens the connections
+        """
+        self.db_file = pathlib.Path(db_file).expanduser()
+        if not self.db_file.is_file():
+            raise FileNotFoundError(f"No database at {self.db_file}")
+
+        self.pool = ConnectionPool(self.db_file, pool_size, mmap_size)
+        self.cache = ResultCache(cache_size)
+        self.check_interval = check_interval
+        self._signature = self._file_signature()
+        self._last_check = time.monotonic()
+        self._check_lock = threading.Lock()
+
+    def __enter__(self) -> "CardDatabase":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the connections and drop the cached results. Lookups
+        already running finish on their connection.
+        """
+        self.pool.close()
+        self.cache.clear()
+
+    def has_table(self, name: str) -> bool:
+        """
+        :param name: Table or view name
+        :return: Whether the database or one of its satellites has it,
+        i.e. an optional table of the build
+        """
+
+        def load(sql_connection: sqlite3.Connection) -> bool:
+            schemas = [
+                schema
+                for _, schema, _ in sql_connection.execute("PRAGMA database_list")
+            ]
+            return any(
+                sql_connection.execute(
+                    f"SELECT 1 FROM `{schema}`.sqlite_master WHERE name = ?", (name,)
+                ).fetchone()
+                for schema in schemas
+            )
+
+        return self._cached(("table", name), load)
+
+    def card_set(self, code: str) -> Optional[Row]:
+        """
+        :param code: Set code
+        :return: Set, None if unknown
+        """
+        rows = self._cached_rows(("set_row", code), SET_BY_CODE_QUERY, (code,))
+        return rows[0] if rows else None
+
+    def card(self, uuid: str) -> Optional[Row]:
+        """
+        :param uuid: Card UUID
+        :return: Card, None if unknown
+        """
+        rows = self._cached_rows(("card", uuid), CARD_BY_UUID_QUERY, (uuid,))
+        return rows[0] if rows else None
+
+    def cards_named(self, name: str, set_code: Optional[str] = None) -> List[Row]:
+        """
+        :param name: Exact card name
+        :param set_code: Only the printings of this set
+        :return: Printings of the card
+        """
+        if set_code is None:
+            return self._cached_rows(("named", name), CARDS_BY_NAME_QUERY, (name,))
+        return self._cached_rows(
+            ("named", name, set_code), CARDS_BY_NAME_AND_SET_QUERY, (name, set_code)
+        )
+
+    def cards_in_set(self, set_code: str) -> List[Row]:
+        """
+        :param set_code: Set code
+        :return: Cards of the set, by collector number
+        """
+        return self._cached_rows(("set", set_code), CARDS_BY_SET_QUERY, (set_code,))
+
+    def cards(self, uuids: Iterable[str]) -> Dict[str, Row]:
+        """
+        :param uuids: Card UUIDs
+        :return: Cards, by UUID (unknown ones are left out)
+        """
+        return {
+            uuid: rows[0] for uuid, rows in self._cached_batch("card", uuids).items()
+        }
+
+    def cards_named_batch(self, names: Iterable[str]) -> Dict[str, List[Row]]:
+        """
+        :param names: Exact card names
+        :return: Printings, by name (unknown names are left out)
+        """
+        return self._cached_batch("named", names)
+
+    def legalities(self, uuids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """
+        :param uuids: Card UUIDs
+        :return: Status per format, per card (cards without any are left out)
+        """
+        return self._cached_batch("legalities", uuids)
+
+    def current_prices(self, uuids: Iterable[str]) -> Dict[str, Dict[str, Row]]:
+        """
+        Latest price, range and moving averages of cards, one row per
+        card and price type (needs a --price-summaries build)
+        :param uuids: Card UUIDs
+        :return: Price summary per price type, per card (cards without
+        prices are left out)
+        """
+        return self._cached_batch("priceSummaries", uuids)
+
+    def card_bundles(
+        self, uuids: Iterable[str], parts: Iterable[str] = BUNDLE_PARTS
+    ) -> Dict[str, CardBundle]:
+        """
+        Cards with their child rows, i.e. for a whole deck. Up to
+        BATCH_SIZE cards take one query for the cards and one per part.
+        :param uuids: Card UUIDs
+        :param parts: Child rows to fetch, from BUNDLE_PARTS; the others
+        are left empty
+        :return: Bundles, by UUID (unknown ones are left out)
+        """
+        parts = set(parts)
+        unknown_parts = parts.difference(BUNDLE_PARTS)
+        if unknown_parts:
+            raise ValueError(
+                "Unknown card bundle part(s) {}".format(", ".join(sorted(unknown_parts)))
+            )
+
+        cards = self.cards(uuids)
+        children = {
+            part: self._cached_batch(part, cards) if part in parts else {}
+            for part in BUNDLE_PARTS
+        }
+        return {
+            uuid: CardBundle(
+                card,
+                children["legalities"].get(uuid, {}),
+                children["rulings"].get(uuid, []),
+                children["prices"].get(uuid, []),
+                children["foreignData"].get(uuid, []),
+            )
+            for uuid, card in cards.items()
+        }
+
+    def card_bundles_named(
+        self, names: Iterable[str], parts: Iterable[str] = BUNDLE_PARTS
+    ) -> Dict[str, List[CardBundle]]:
+        """
+        Every printing of several cards, with their child rows
+        :param names: Exact card names
+        :param parts: Child rows to fetch, from BUNDLE_PARTS
+        :return: Bundles of the printings, by name (unknown names are left out)
+        """
+        printings = self.cards_named_batch(names)
+        bundles = self.card_bundles(
+            (card["uuid"] for cards in printings.values() for card in cards), parts
+        )
+        return {
+            name: [bundles[card["uuid"]] for card in cards]
+            for name, cards in printings.items()
+        }
+
+    def rulings(self, uuid: str) -> List[Ruling]:
+        """
+        :param uuid: Card UUID
+        :return: Rulings on the card, oldest first
+        """
+        return self._cached(
+            ("rulings", uuid),
+            lambda sql_connection: [
+                Ruling(*row) for row in sql_connection.execute(RULINGS_QUERY, (uuid,))
+            ],
+        )
+
+    def price_history(
+        self, uuid: str, price_type: Optional[str] = None
+    ) -> List[PricePoint]:
+        """
+        :param uuid: Card UUID
+        :param price_type: Only this price type (i.e. paper, mtgo)
+        :return: Prices of the card, by type and date
+        """
+        parameters: Tuple[str, ...]
+        if price_type is None:
+            query, parameters = PRICE_HISTORY_QUERY, (uuid,)
+        else:
+            query, parameters = PRICE_HISTORY_BY_TYPE_QUERY, (uuid, price_type)
+
+        return self._cached(
+            ("prices", uuid) if price_type is None else ("prices", uuid, price_type),
+            lambda sql_connection: [
+                PricePoint(*row) for row in sql_connection.execute(query, parameters)
+            ],
+        )
+
+    def _cached_rows(
+        self, key: Hashable, query: str, parameters: Tuple[Any, ...]
+    ) -> List[Row]:
+        """
+        :param key: Result key
+        :param query: Query returning whole rows
+        :param parameters: Query parameters
+        :return: Rows as dicts, from the cache if there
+        """
+
+        def load(sql_connection: sqlite3.Connection) -> List[Row]:
+            cursor = sql_connection.execute(query, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+        return self._cached(key, load)
+
+    def search(self, text: str, limit: int = 20) -> List[Row]:
+        """
+        Full-text search of card names and text (needs a --search build)
+        :param text: Text as typed by the user
+        :param limit: Maximum number of results
+        :return: uuid, name, setCode and score of the matches, best first
+        """
+        return self._cached(
+            ("search", text, limit),
+            lambda sql_connection: [
+                dict(zip(("uuid", "name", "setCode", "score"), row))
+                for row in search_cards(sql_connection, text, limit)
+            ],
+        )
+
+    def _cached_batch(self, kind: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Look up many keys; the ones not cached are read with one query
+        per BATCH_SIZE keys
+        :param kind: Lookup, from BATCH_QUERIES
+        :param keys: Keys to look up
+        :return: Result per key, leaving out the keys without rows
+        """
+        self._check_file()
+        results: Dict[str, Any] = {}
+        missing: List[str] = []
+        for key in dict.fromkeys(keys):
+            found, value = self.cache.get((kind, key))
+            if not found:
+                missing.append(key)
+            elif value:
+                results[key] = value
+        if not missing:
+            return results
+
+        batch = BATCH_QUERIES[kind]
+        generation = self.cache.generation
+        grouped: Dict[str, List[Tuple[Any, ...]]] = {key: [] for key in missing}
+        with self.pool.connection() as sql_connection:
+            for start in range(0, len(missing), BATCH_SIZE):
+                keys = missing[start : start + BATCH_SIZE]
+                cursor = sql_connection.execute(
+                    batch.query, keys + [None] * (BATCH_SIZE - len(keys))
+                )
+                columns = [column[0] for column in cursor.description[1:]]
+                for row in cursor:
+                    grouped[row[0]].append(row[1:])
+
+        for key, rows in grouped.items():
+            value = batch.convert(columns, rows)
+            self.cache.put((kind, key), value, generation)
+            if value:
+                results[key] = value
+        return results
+
+    def _cached(self, key: Hashable, load: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        :param key: Result key
+        :param load: Query function, run on a pooled connection on a miss
+        :return: Result, from the cache if there
+        """
+        self._check_file()
+        found, value = self.cache.get(key)
+        if found:
+            return value  # type: ignore
+
+        generation = self.cache.generation
+        with self.pool.connection() as sql_connection:
+            value = load(sql_connection)
+        self.cache.put(key, value, generation)
+        return value
+
+    def _file_signature(self) -> Tuple[int, int, int]:
+        """
+        :return: What tells two versions of the database file apart
+        """
+        stat = os.stat(str(self.db_file))
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _check_file(self) -> None:
+        """
+        Once per check interval, look for a new build of the database
+        file and drop everything read from the old one
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+
+        with self._check_lock:
+            if now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            try:
+                signature = self._file_signature()
+            except OSError:  # Being replaced, look again next time
+                return
+            if signature == self._signature:
+                return
+            self._signature = signature
+
+        # Connections first: results loaded after the clear must come
+        # from connections opened on the new file
+        LOGGER.info(f"{self.db_file} changed, dropping cached results")
+        self.pool.reset()
+        self.cache.clear()
@@ -0,0 +1,286 @@
+"""
+Hot/cold split output: the core tables stay in the output file, the
+bulky card child tables move to satellite files attached on demand
+"""
+import hashlib
+import json
+import logging
+import pathlib
+import re
+import sqlite3
+from typing import Any, Dict, List, Set, Tuple
+
+from mtgsqlive.search import SEARCH_INDEXES, build_search_indexes
+
+LOGGER = logging.getLogger(__name__)
+
+# Tables each satellite takes out of the output file, whichever of them
+# the build's layouts created. Satellites keep the uuid (or, with
+# --card-ids, cardId) column, so their rows join the core cards as is.
+SATELLITE_TABLES: Dict[str, Tuple[str, ...]] = {
+    "prices": ("prices", "card_prices", "price_points", "price_series"),
+    "foreignData": ("foreignData", "card_foreignData"),
+    "rulings": ("rulings", "card_rulings"),
+}
+
+# Satellites of --split
+DEFAULT_SATELLITES: Tuple[str, ...] = tuple(SATELLITE_TABLES)
+
+# Bytes read at a time when hashing a file
+HASH_CHUNK_SIZE: int = 1 << 20
+
+
+def parse_satellites(value: str) -> Tuple[str, ...]:
+    """
+    :param value: Comma separated satellite names
+    :return: Satellite names, in SATELLITE_TABLES order
+    """
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = names.difference(SATELLITE_TABLES)
+    if unknown:
+        raise ValueError(
+            "Unknown satellite(s) {}, choose from {}".format(
+                ", ".join(sorted(unknown)), ", ".join(SATELLITE_TABLES)
+            )
+        )
+    return tuple(name for name in SATELLITE_TABLES if name in names)
+
+
+def manifest_path(db_file: pathlib.Path) -> pathlib.Path:
+    """
+    :param db_file: Core database file
+    :return: Manifest describing its satellites
+    """
+    return db_file.with_name(f"{db_file.stem}.manifest.json")
+
+
+def satellite_path(db_file: pathlib.Path, name: str) -> pathlib.Path:
+    """
+    :param db_file: Core database file
+    :param name: Satellite name
+    :return: Satellite database file, i.e. output.prices.sqlite
+    """
+    return db_file.with_name(f"{db_file.stem}.{name}{db_file.suffix}")
+
+
+def hash_file(db_file: pathlib.Path) -> str:
+    """
+    :param db_file: File to hash
+    :return: SHA-256 hex digest of its content
+    """
+    digest = hashlib.sha256()
+    with db_file.open("rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_build(db_file: pathlib.Path) -> str:
+    """
+    :param db_file: Database file
+    :return: SHA-256 hex digest of the file, and of its manifest (which
+    holds the digests of the satellites) if the build was split
+    """
+    content_hash = hash_file(db_file)
+    manifest_file = manifest_path(db_file)
+    if not manifest_file.is_file():
+        return content_hash
+    return hashlib.sha256(
+        content_hash.encode() + manifest_file.read_bytes()
+    ).hexdigest()
+
+
+def dependent_views(
+    views: List[Tuple[str, str]], tables: Set[str]
+) -> List[Tuple[str, str]]:
+    """
+    :param views: Name and SQL of the views, in creation order
+    :param tables: Tables being moved
+    :return: Views reading the tables, directly or through other views,
+    in creation order
+    """
+    referenced = set(tables)
+    dependent = []
+    for name, sql in views:
+        if any(re.search(rf"\b{re.escape(table)}\b", sql) for table in referenced):
+            referenced.add(name)
+            dependent.append((name, sql))
+    return dependent
+
+
+def split_database(
+    db_file: pathlib.Path, satellites: Tuple[str, ...] = DEFAULT_SATELLITES
+) -> Dict[str, Any]:
+    """
+    Move the tables of each satellite out of a finished build, into a
+    database file of its own, and write the manifest of the build. The
+    tables move with their indexes, and with the search index over
+    them. Views reading them can't live in either file (a view only sees
+    its own database), so the manifest keeps them for attach_satellites.
+    :param db_file: Finished database file, becoming the core file
+    :param satellites: Satellites to split off
+    :return: Manifest
+    """
+    core_connection = sqlite3.connect(str(db_file))
+    objects = core_connection.execute(
+        "SELECT type, name, tbl_name, sql FROM sqlite_master "
+        "WHERE sql IS NOT NULL ORDER BY rowid"
+    ).fetchall()
+    tables = {name for kind, name, _, _ in objects if kind == "table"}
+    views = [(name, sql) for kind, name, _, sql in objects if kind == "view"]
+
+    manifest: Dict[str, Any] = {"core": {}, "satellites": []}
+    for name in satellites:
+        moved_tables = [table for table in SATELLITE_TABLES[name] if table in tables]
+        if not moved_tables:
+            LOGGER.debug(f"Skipping satellite {name}, no tables")
+            continue
+
+        moved_views = dependent_views(views, set(moved_tables))
+        search_indexes = [
+            spec.name
+            for spec in SEARCH_INDEXES
+            if spec.name in tables and set(spec.content_tables) & set(moved_tables)
+        ]
+        satellite_file = satellite_path(db_file, name)
+        LOGGER.info(f"Moving {', '.join(moved_tables)} to {satellite_file}")
+        write_satellite(
+            satellite_file,
+            db_file,
+            objects,
+            moved_tables,
+            search_indexes,
+            "sqlite_stat1" in tables,
+        )
+
+        for search_index in search_indexes:
+            core_connection.execute(f"DROP TABLE `{search_index}`")
+        for view, _ in reversed(moved_views):
+            core_connection.execute(f"DROP VIEW `{view}`")
+        for table in moved_tables:
+            core_connection.execute(f"DROP TABLE `{table}`")
+        core_connection.commit()
+
+        manifest["satellites"].append(
+            {
+                "name": name,
+                "file": satellite_file.name,
+                "tables": moved_tables + search_indexes,
+                "views": [sql for _, sql in moved_views],
+                "bytes": satellite_file.stat().st_size,
+                "sha256": hash_file(satellite_file),
+            }
+        )
+
+    LOGGER.info(f"Compacting {db_file}")
+    core_connection.execute("VACUUM")
+    core_connection.close()
+
+    manifest["core"] = {
+        "file": db_file.name,
+        "bytes": db_file.stat().st_size,
+        "sha256": hash_file(db_file),
+    }
+    with manifest_path(db_file).open("w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def write_satellite(
+    satellite_file: pathlib.Path,
+    db_file: pathlib.Path,
+    objects: List[Tuple[str, str, str, str]],
+    tables: List[str],
+    search_indexes: List[str],
+    analyze: bool = False,
+) -> None:
+    """
+    Copy tables of the core file to a new satellite file, creating
+    them and their indexes with the same statements
+    :param satellite_file: Satellite database file, replaced if there
+    :param db_file: Core database file
+    :param objects: Type, name, table and SQL of the core schema objects
+    :param tables: Tables to copy
+    :param search_indexes: Search indexes over them to build
+    :param analyze: Gather planner statistics, as the core file has them
+    """
+    if satellite_file.is_file():
+        satellite_file.unlink()
+
+    satellite_connection = sqlite3.connect(str(satellite_file))
+    satellite_connection.execute("ATTACH DATABASE ? AS core", (str(db_file),))
+    for kind, name, _, sql in objects:
+        if kind == "table" and name in tables:
+            satellite_connection.execute(sql)
+            satellite_connection.execute(
+                f"INSERT INTO `{name}` SELECT * FROM core.`{name}`"
+            )
+    for kind, _, table, sql in objects:
+        if kind == "index" and table in tables:
+            satellite_connection.execute(sql)
+    satellite_connection.commit()
+    satellite_connection.execute("DETACH DATABASE core")
+
+    if search_indexes:
+        build_search_indexes(satellite_connection)
+    if analyze:
+        satellite_connection.execute("ANALYZE")
+        satellite_connection.commit()
+    satellite_connection.close()
+
+
+def attach_satellites(
+    sql_connection: sqlite3.Connection,
+    manifest_file: pathlib.Path,
+    read_only: bool = False,
+) -> List[str]:
+    """
+    Attach the satellites of a split build to a connection to its core
+    file, each under its name, and recreate the views reading them as
+    temporary views. The connection then answers the same queries as
+    an unsplit build.
+    :param sql_connection: Connection to the core file, opened with
+    uri=True if read_only
+    :param manifest_file: Manifest of the build
+    :param read_only: Attach the satellites read-only and immutable,
+    like query.connect_read_only opens the core file
+    :return: Names of the attached satellites
+    """
+    with manifest_file.open(encoding="utf-8") as file:
+        manifest = json.load(file)
+
+    names = []
+    for satellite in manifest["satellites"]:
+        satellite_file = manifest_file.parent.joinpath(satellite["file"])
+        location = str(satellite_file)
+        if read_only:
+            location = satellite_file.resolve().as_uri() + "?mode=ro&immutable=1"
+        sql_connection.execute(
+            f"ATTACH DATABASE ? AS `{satellite['name']}`", (location,)
+        )
+        for view in satellite["views"]:
+            sql_connection.execute(
+                re.sub(r"^CREATE VIEW", "CREATE TEMP VIEW", view)
+            )
+        names.append(satellite["name"])
+    return names
+
+
+def remove_split_output(db_file: pathlib.Path) -> None:
+    """
+    Delete the satellites and manifest of an earlier split build, so a
+    new build of the file isn't read with them
+    :param db_file: Core database file
+    """
+    manifest_file = manifest_path(db_file)
+    if not manifest_file.is_file():
+        return
+
+    with manifest_file.open(encoding="utf-8") as file:
+        manifest = json.load(file)
+    for satellite in manifest["satellites"]:
+        satellite_file = manifest_file.parent.joinpath(satellite["file"])
+        if satellite_file.is_file():
+            LOGGER.warning(f"Removing satellite {satellite_file} of the old build")
+            satellite_file.unlink()
+    manifest_file.unlink()
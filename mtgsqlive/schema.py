@@ -0,0 +1,548 @@
+"""
+SQLite schema of the build, and the optional layouts it can be built with
+"""
+import sqlite3
+from typing import Dict, NamedTuple, Tuple
+
+from mtgsqlive.card_lists import build_card_list_schema
+from mtgsqlive.checkpoints import build_progress_schema
+from mtgsqlive.coded_columns import (
+    STRING_LOOKUP_TABLES,
+    create_decoded_view,
+    decoded_columns,
+    get_coded_columns,
+)
+from mtgsqlive.price_summaries import build_price_summary_schema, get_price_windows
+from mtgsqlive.update import build_metadata_schema
+
+# Physical card and token tables when string columns are interned (--interned)
+INTERNED_TABLES: Dict[str, str] = {
+    "cards": "cards_interned",
+    "tokens": "tokens_interned",
+}
+
+# Physical child tables when they reference cards.id (--card-ids)
+CARD_ID_TABLES: Dict[str, str] = {
+    "foreignData": "card_foreignData",
+    "legalities": "card_legalities",
+    "rulings": "card_rulings",
+    "prices": "card_prices",
+    "price_summaries": "card_price_summaries",
+}
+
+# Names the rows of physical tables are exported under (--export)
+EXPORT_TABLE_NAMES: Dict[str, str] = {
+    physical_table: table
+    for table, physical_table in {**CARD_ID_TABLES, **INTERNED_TABLES}.items()
+}
+
+# Status columns of legalities_wide (--legalities wide). Statuses for
+# formats outside this list are kept as rows in legalities_other.
+LEGALITY_FORMATS: Tuple[str, ...] = (
+    "brawl",
+    "commander",
+    "duel",
+    "frontier",
+    "future",
+    "historic",
+    "legacy",
+    "modern",
+    "oldschool",
+    "pauper",
+    "penny",
+    "pioneer",
+    "standard",
+    "vintage",
+)
+
+
+class BuildOptions(NamedTuple):
+    """
+    Optional schema layouts, shared by the schema builder
+    and the row transforms
+    """
+
+    # "rows": one prices row per date (uuid, type, date)
+    # "compact": price_points rows keyed by card id, type id and day number
+    # "packed": one price_series row per card and type, holding the series
+    price_layout: str = "rows"
+
+    # Child tables reference cards.id instead of repeating the uuid
+    card_ids: bool = False
+
+    # "rows": one legalities row per card and format
+    # "wide": one legalities_wide row per card, a status column per format
+    legality_layout: str = "rows"
+
+    # Repetitive strings (artist, rarity, language, ...) are stored as ids
+    # into small lookup tables. Implies card_ids.
+    interned: bool = False
+
+    # List attributes (colors, types, printings, ...) are also stored
+    # in junction tables, one row per card and value
+    card_lists: bool = False
+
+    # Moving average windows, in days, of the price_summaries table
+    # (latest, min and max price per card and type); empty for none
+    price_windows: Tuple[int, ...] = ()
+
+    # Each set's content hash is recorded (set_content_hashes), so --update
+    # skips unchanged sets without converting and diffing them
+    content_hashes: bool = False
+
+
+def detect_build_options(sql_connection: sqlite3.Connection) -> BuildOptions:
+    """
+    Work out the options an existing database was built with
+    :param sql_connection: Connection to the database
+    :return: Options matching its schema
+    """
+    tables = {
+        name
+        for (name,) in sql_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+
+    price_layout = "rows"
+    if "price_series" in tables:
+        price_layout = "packed"
+    elif "price_points" in tables:
+        price_layout = "compact"
+
+    options = BuildOptions(
+        price_layout=price_layout,
+        card_ids="card_rulings" in tables,
+        legality_layout="wide" if "legalities_wide" in tables else "rows",
+        interned="cards_interned" in tables,
+        card_lists="card_colors" in tables,
+        content_hashes="set_content_hashes" in tables,
+    )
+    return options._replace(
+        price_windows=get_price_windows(
+            sql_connection, child_table("price_summaries", options)
+        )
+    )
+
+
+def build_sql_schema(
+    sql_connection: sqlite3.Connection,
+    defer_constraints: bool = False,
+    options: BuildOptions = BuildOptions(),
+) -> None:
+    """
+    Create the SQLite DB schema
+    :param sql_connection: Connection to the database
+    :param defer_constraints: Leave out UNIQUE constraints, to be added
+    by enforce_deferred_constraints once the data is loaded
+    :param options: Optional layouts to build
+    """
+    cursor = sql_connection.cursor()
+    unique = "" if defer_constraints else " UNIQUE"
+    card_table = child_table("cards", options)
+
+    # Lookup tables come first, so shard merges can map their ids
+    # before copying the rows referring to them
+    if options.interned:
+        build_string_lookup_schema(sql_connection)
+
+    set_reference = "TEXT REFERENCES sets(code) ON UPDATE CASCADE ON DELETE CASCADE"
+
+    # Build Set table
+    cursor.execute(
+        "CREATE TABLE `sets` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "baseSetSize INTEGER,"
+        "block TEXT,"
+        "boosterV3 TEXT,"
+        f"code TEXT{unique} NOT NULL,"
+        "codeV3 TEXT,"
+        "isFoilOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isForeignOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isOnlineOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isPartialPreview INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "keyruneCode TEXT,"
+        "mcmId INTEGER,"
+        "mcmName TEXT,"
+        "meta TEXT,"
+        "mtgoCode TEXT,"
+        "name TEXT,"
+        "parentCode TEXT,"
+        "releaseDate TEXT,"
+        "tcgplayerGroupId INTEGER,"
+        "totalSetSize INTEGER,"
+        "type TEXT"
+        ")"
+    )
+
+    # Build cards table
+    cursor.execute(
+        f"CREATE TABLE `{card_table}` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        f"{string_column('artist', options)},"
+        f"{string_column('borderColor', options)},"
+        "colorIdentity TEXT,"
+        "colorIndicator TEXT,"
+        "colors TEXT,"
+        "convertedManaCost FLOAT,"
+        "duelDeck TEXT(1),"
+        "edhrecRank TEXT,"
+        "faceConvertedManaCost FLOAT,"
+        "flavorText TEXT,"
+        "frameEffect TEXT,"
+        f"{string_column('frameVersion', options)},"
+        "hand TEXT,"
+        "hasFoil INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "hasNoDeckLimit INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "hasNonFoil INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isAlternative INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isArena INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isFullArt INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isMtgo INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isOnlineOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isOversized INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isPaper INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isPromo INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isReprint INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isReserved INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isStarter INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isStorySpotlight INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isTextless INTEGER NOT NULL DEFAULT 0,"  # boolean
+        "isTimeshifted INTEGER NOT NULL DEFAULT 0,"  # boolean
+        f"{string_column('layout', options)},"
+        "leadershipSkills TEXT,"
+        "life TEXT,"
+        "loyalty TEXT,"
+        "manaCost TEXT,"
+        "mcmId INTEGER,"
+        "mcmMetaId INTEGER,"
+        "mcmName TEXT,"
+        "mtgArenaId INTEGER,"
+        "mtgoFoilId INTEGER,"
+        "mtgoId INTEGER,"
+        "mtgstocksId INTEGER,"
+        "multiverseId INTEGER,"
+        "name TEXT,"
+        "names TEXT,"
+        "number TEXT,"
+        "originalText TEXT,"
+        "originalType TEXT,"
+        "power TEXT,"
+        "printings TEXT,"
+        "purchaseUrls TEXT,"
+        f"{string_column('rarity', options)},"
+        "scryfallId TEXT(36),"
+        "scryfallIllustrationId TEXT(36),"
+        "scryfallOracleId TEXT(36),"
+        f"{string_column('setCode', options, set_reference)},"
+        "side TEXT,"
+        "subtypes TEXT,"
+        "supertypes TEXT,"
+        "tcgplayerProductId INTEGER,"
+        "tcgplayerPurchaseUrl TEXT,"
+        "text TEXT,"
+        "toughness TEXT,"
+        "type TEXT,"
+        "types TEXT,"
+        f"uuid TEXT(36){unique} NOT NULL,"
+        "variations TEXT,"
+        f"{string_column('watermark', options)}"
+        ")"
+    )
+
+    # Build tokens table
+    cursor.execute(
+        f"CREATE TABLE `{child_table('tokens', options)}` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        f"{string_column('artist', options)},"
+        f"{string_column('borderColor', options)},"
+        "colorIdentity TEXT,"
+        "colorIndicator TEXT,"
+        "colors TEXT,"
+        "duelDeck TEXT(1),"
+        "isOnlineOnly INTEGER NOT NULL DEFAULT 0,"  # boolean
+        f"{string_column('layout', options)},"
+        "loyalty TEXT,"
+        "name TEXT,"
+        "names TEXT,"
+        "number TEXT,"
+        "power TEXT,"
+        "reverseRelated TEXT,"
+        "scryfallId TEXT(36),"
+        "scryfallIllustrationId TEXT(36),"
+        "scryfallOracleId TEXT(36),"
+        f"{string_column('setCode', options, set_reference)},"
+        "side TEXT,"
+        "text TEXT,"
+        "toughness TEXT,"
+        "type TEXT,"
+        f"uuid TEXT(36){unique},"
+        f"{string_column('watermark', options)}"
+        ")"
+    )
+
+    # Translations for set names
+    cursor.execute(
+        "CREATE TABLE `set_translations` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "language TEXT,"
+        "setCode TEXT REFERENCES sets(code) ON UPDATE CASCADE ON DELETE CASCADE,"
+        "translation TEXT"
+        ")"
+    )
+
+    # Child tables point at their card by uuid, or by cards.id
+    # (physical table renamed, with a view keeping the uuid shape)
+    card_key = "uuid TEXT(36) REFERENCES cards(uuid) ON UPDATE CASCADE ON DELETE CASCADE"
+    if options.card_ids:
+        card_key = f"cardId INTEGER REFERENCES {card_table}(id) ON UPDATE CASCADE ON DELETE CASCADE"
+
+    # Build foreignData table
+    cursor.execute(
+        f"CREATE TABLE `{child_table('foreignData', options)}` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "flavorText TEXT,"
+        f"{string_column('language', options)},"
+        "multiverseId INTEGER,"
+        "name TEXT,"
+        "text TEXT,"
+        "type TEXT,"
+        f"{card_key}"
+        ")"
+    )
+
+    # Build legalities table
+    cursor.execute(
+        f"CREATE TABLE `{child_table('legalities', options)}` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        f"{string_column('format', options)},"
+        f"{string_column('status', options)},"
+        f"{card_key}"
+        ")"
+    )
+    if options.legality_layout == "wide":
+        build_wide_legality_schema(sql_connection, card_key)
+
+    # Build ruling table
+    cursor.execute(
+        f"CREATE TABLE `{child_table('rulings', options)}` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "date TEXT,"
+        "text TEXT,"
+        f"{card_key}"
+        ")"
+    )
+
+    # Build prices table
+    if options.price_layout == "rows":
+        cursor.execute(
+            f"CREATE TABLE `{child_table('prices', options)}` ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "date TEXT,"
+            "price REAL,"
+            f"{string_column('type', options)},"
+            f"{card_key}"
+            ")"
+        )
+    else:
+        build_compact_price_schema(
+            sql_connection, options.price_layout == "packed", card_table
+        )
+
+    if options.price_windows:
+        build_price_summary_schema(
+            sql_connection,
+            child_table("price_summaries", options),
+            card_key,
+            string_column("type", options),
+            options.price_windows,
+        )
+
+    if options.card_lists:
+        build_card_list_schema(sql_connection, card_key)
+
+    build_decoded_views(sql_connection, options)
+
+    if options.content_hashes:
+        build_metadata_schema(sql_connection)
+
+    # Sets committed so far, for --resume
+    build_progress_schema(sql_connection)
+
+    # Execute the commands
+    sql_connection.commit()
+
+
+def build_decoded_views(
+    sql_connection: sqlite3.Connection, options: BuildOptions
+) -> None:
+    """
+    Present tables stored with coded columns (--card-ids, --interned)
+    under their usual names and columns, with the card uuid and
+    interned strings joined back in
+    :param sql_connection: Connection to the database
+    :param options: Optional layouts being built
+    """
+    tables = ["cards", "tokens", "foreignData", "rulings"]
+    if options.legality_layout == "rows":
+        tables.append("legalities")
+    if options.price_layout == "rows":
+        tables.append("prices")
+    if options.price_windows:
+        tables.append("price_summaries")
+
+    coded_columns = get_coded_columns(sql_connection)
+    for table in tables:
+        physical_table = child_table(table, options)
+        if physical_table != table:
+            create_decoded_view(
+                sql_connection,
+                table,
+                physical_table,
+                coded_columns.get(physical_table, []),
+            )
+
+
+def child_table(table: str, options: BuildOptions) -> str:
+    """
+    :param table: Card, token or card child table (foreignData, ...)
+    :param options: Optional layouts being built
+    :return: Name of the table actually holding its rows
+    """
+    if table == "legalities" and options.legality_layout == "wide":
+        return "legalities_other"
+    if options.interned and table in INTERNED_TABLES:
+        return INTERNED_TABLES[table]
+    if options.card_ids:
+        return CARD_ID_TABLES.get(table, table)
+    return table
+
+
+def string_column(
+    column: str, options: BuildOptions, definition: str = "TEXT"
+) -> str:
+    """
+    :param column: String column (artist, rarity, ...)
+    :param options: Optional layouts being built
+    :param definition: Type and constraints of the column when not interned
+    :return: Column definition, of the id column if it's interned
+    """
+    if options.interned:
+        return "{}Id INTEGER REFERENCES {}(id)".format(
+            column, STRING_LOOKUP_TABLES[column]
+        )
+    return f"{column} {definition}"
+
+
+def build_string_lookup_schema(sql_connection: sqlite3.Connection) -> None:
+    """
+    Create the lookup tables of the interned string columns
+    :param sql_connection: Connection to the database
+    """
+    for lookup_table in sorted(set(STRING_LOOKUP_TABLES.values())):
+        sql_connection.execute(
+            f"CREATE TABLE `{lookup_table}` ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "name TEXT UNIQUE NOT NULL"
+            ")"
+        )
+
+
+def build_wide_legality_schema(
+    sql_connection: sqlite3.Connection, card_key: str
+) -> None:
+    """
+    Create the one row per card legalities table, with a view
+    presenting it in the layout of the regular legalities table
+    :param sql_connection: Connection to the database
+    :param card_key: Column definition referencing the card
+    """
+    status_columns = "".join(
+        f"`{card_format}` TEXT," for card_format in LEGALITY_FORMATS
+    )
+    sql_connection.execute(
+        f"CREATE TABLE `legalities_wide` ({status_columns}{card_key})"
+    )
+
+    # Card uuids (and interned formats and statuses) joined back in
+    coded_columns = get_coded_columns(sql_connection)
+    wide, wide_from = decoded_columns(
+        sql_connection, "legalities_wide", coded_columns.get("legalities_wide", [])
+    )
+    other, other_from = decoded_columns(
+        sql_connection, "legalities_other", coded_columns.get("legalities_other", [])
+    )
+
+    # Unpivot the status columns; ids are NULL, as in the packed price layout
+    selects = [
+        f"SELECT NULL AS id, '{card_format}' AS format, {wide[card_format]} AS status, "
+        f"{wide['uuid']} AS uuid FROM {wide_from} "
+        f"WHERE {wide[card_format]} IS NOT NULL"
+        for card_format in LEGALITY_FORMATS
+    ]
+    selects.append(
+        f"SELECT NULL AS id, {other['format']} AS format, "
+        f"{other['status']} AS status, {other['uuid']} AS uuid FROM {other_from}"
+    )
+    sql_connection.execute(
+        "CREATE VIEW `legalities` AS {}".format(" UNION ALL ".join(selects))
+    )
+
+
+def build_compact_price_schema(
+    sql_connection: sqlite3.Connection, packed: bool, card_table: str = "cards"
+) -> None:
+    """
+    Create the integer-keyed price tables, with views presenting
+    them in the layout of the regular prices table
+    :param sql_connection: Connection to the database
+    :param packed: Store one series per card and type instead of one row per day
+    :param card_table: Table holding the cards the prices refer to
+    """
+    cursor = sql_connection.cursor()
+
+    # Price type names (paper, mtgo, ...), already there with --interned
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `price_types` ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "name TEXT UNIQUE NOT NULL"
+        ")"
+    )
+
+    if packed:
+        # Series is a JSON object of {day number: price}
+        cursor.execute(
+            "CREATE TABLE `price_series` ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            f"cardId INTEGER NOT NULL REFERENCES {card_table}(id) ON UPDATE CASCADE ON DELETE CASCADE,"
+            "typeId INTEGER NOT NULL REFERENCES price_types(id),"
+            "series TEXT NOT NULL"
+            ")"
+        )
+        cursor.execute(
+            "CREATE VIEW `price_points` AS "
+            "SELECT s.cardId AS cardId, s.typeId AS typeId, "
+            "CAST(e.key AS INTEGER) AS day, e.value AS price "
+            "FROM price_series AS s, json_each(s.series) AS e"
+        )
+    else:
+        cursor.execute(
+            "CREATE TABLE `price_points` ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            f"cardId INTEGER NOT NULL REFERENCES {card_table}(id) ON UPDATE CASCADE ON DELETE CASCADE,"
+            "typeId INTEGER NOT NULL REFERENCES price_types(id),"
+            "day INTEGER NOT NULL,"  # days since 1970-01-01
+            "price REAL"
+            ")"
+        )
+
+    # Same columns as the prices table of the regular layout
+    cursor.execute(
+        "CREATE VIEW `prices` AS "
+        f"SELECT {'NULL' if packed else 'p.id'} AS id, "
+        "date(p.day * 86400, 'unixepoch') AS date, "
+        "p.price AS price, t.name AS type, c.uuid AS uuid "
+        "FROM price_points AS p "
+        f"JOIN `{card_table}` AS c ON c.id = p.cardId "
+        "JOIN price_types AS t ON t.id = p.typeId"
+    )
@@ -0,0 +1,195 @@
+"""
+FTS5 full-text search over card and foreign data text
+"""
+import logging
+import re
+import sqlite3
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Folds case and accents ("Lim-Dûl" matches "lim dul")
+SEARCH_TOKENIZER = "unicode61 remove_diacritics 2"
+
+# Prefix lengths indexed for typeahead ("lig*" and the like)
+SEARCH_PREFIXES = "2 3 4"
+
+
+class SearchIndexSpec(NamedTuple):
+    """
+    Declaration of an external content FTS5 index. The text stays
+    in the content table only; the index points at its rows by id.
+    """
+
+    name: str
+    content_tables: Tuple[str, ...]
+    columns: Tuple[str, ...]
+    weights: Tuple[float, ...]
+
+    def create_statement(self, content_table: str) -> str:
+        """
+        :param content_table: Table holding the indexed text
+        :return: CREATE VIRTUAL TABLE statement for this index
+        """
+        return (
+            f"CREATE VIRTUAL TABLE `{self.name}` USING fts5("
+            f"{', '.join(self.columns)}, "
+            f"content='{content_table}', content_rowid='id', "
+            f"tokenize='{SEARCH_TOKENIZER}', prefix='{SEARCH_PREFIXES}')"
+        )
+
+    def rank_function(self) -> str:
+        """
+        :return: bm25() call weighting the columns of this index
+        """
+        return "bm25({})".format(", ".join(str(weight) for weight in self.weights))
+
+
+# Name matches rank well above rules text, which ranks above flavor text.
+# Content tables are tried in order, the first physical table is indexed.
+SEARCH_INDEXES: List[SearchIndexSpec] = [
+    SearchIndexSpec(
+        "cards_search",
+        ("cards_interned", "cards"),
+        ("name", "text", "flavorText"),
+        (10.0, 1.0, 0.2),
+    ),
+    SearchIndexSpec(
+        "foreignData_search",
+        ("card_foreignData", "foreignData"),
+        ("name", "text"),
+        (10.0, 1.0),
+    ),
+]
+
+
+def build_search_indexes(sql_connection: sqlite3.Connection) -> None:
+    """
+    Create the search indexes and fill them from the loaded rows,
+    which is much cheaper than keeping them in sync row by row
+    :param sql_connection: Connection to the loaded database
+    """
+    tables = {
+        name
+        for (name,) in sql_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+
+    for spec in SEARCH_INDEXES:
+        content_table = next(
+            (table for table in spec.content_tables if table in tables), None
+        )
+        if content_table is None:
+            LOGGER.debug(f"Skipping search index {spec.name}, no content table")
+            continue
+
+        LOGGER.info(f"Building search index {spec.name}")
+        sql_connection.execute(f"DROP TABLE IF EXISTS `{spec.name}`")
+        sql_connection.execute(spec.create_statement(content_table))
+        sql_connection.execute(
+            f"INSERT INTO `{spec.name}` (`{spec.name}`, rank) VALUES ('rank', ?)",
+            (spec.rank_function(),),
+        )
+        sql_connection.execute(
+            f"INSERT INTO `{spec.name}` (`{spec.name}`) VALUES ('rebuild')"
+        )
+        sql_connection.execute(
+            f"INSERT INTO `{spec.name}` (`{spec.name}`) VALUES ('optimize')"
+        )
+
+    sql_connection.commit()
+
+
+def refresh_search_indexes(sql_connection: sqlite3.Connection) -> None:
+    """
+    Rebuild the search indexes a database already has, after
+    its content tables were changed in place
+    :param sql_connection: Connection to the database
+    """
+    tables = {
+        name
+        for (name,) in sql_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+
+    for spec in SEARCH_INDEXES:
+        if spec.name not in tables:
+            continue
+
+        LOGGER.info(f"Rebuilding search index {spec.name}")
+        sql_connection.execute(
+            f"INSERT INTO `{spec.name}` (`{spec.name}`) VALUES ('rebuild')"
+        )
+
+    sql_connection.commit()
+
+
+def build_match_query(text: str, prefix: bool = True) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query matching every word. Words are
+    quoted, so user input can't inject FTS5 syntax.
+    :param text: Text as typed by the user
+    :param prefix: Let the last word match as a prefix (typeahead)
+    :return: MATCH expression, or None if there is nothing to search for
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+
+    terms = [f'"{word}"' for word in words]
+    if prefix and not text[-1].isspace():
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_cards(
+    sql_connection: sqlite3.Connection, text: str, limit: int = 20
+) -> List[Tuple[Any, ...]]:
+    """
+    Find cards whose name, text or flavor text match, best first
+    :param sql_connection: Database with the cards_search index
+    :param text: Text as typed by the user
+    :param limit: Maximum number of results
+    :return: (uuid, name, setCode, score) rows; lower scores rank higher
+    """
+    match_query = build_match_query(text)
+    if match_query is None:
+        return []
+
+    return sql_connection.execute(
+        "SELECT c.uuid, c.name, c.setCode, s.rank FROM cards_search AS s "
+        "JOIN cards AS c ON c.id = s.rowid "
+        "WHERE cards_search MATCH ? ORDER BY s.rank LIMIT ?",
+        (match_query, limit),
+    ).fetchall()
+
+
+def search_foreign_data(
+    sql_connection: sqlite3.Connection,
+    text: str,
+    language: Optional[str] = None,
+    limit: int = 20,
+) -> List[Tuple[Any, ...]]:
+    """
+    Find cards by their printed name or text in other languages, best first
+    :param sql_connection: Database with the foreignData_search index
+    :param text: Text as typed by the user
+    :param language: Only match this language (i.e. "German")
+    :param limit: Maximum number of results
+    :return: (uuid, language, name, score) rows; lower scores rank higher
+    """
+    match_query = build_match_query(text)
+    if match_query is None:
+        return []
+
+    language_filter = "AND f.language = ? " if language else ""
+    parameters: List[Any] = [match_query] + ([language] if language else [])
+    return sql_connection.execute(
+        "SELECT f.uuid, f.language, f.name, s.rank FROM foreignData_search AS s "
+        "JOIN foreignData AS f ON f.id = s.rowid "
+        f"WHERE foreignData_search MATCH ? {language_filter}"
+        "ORDER BY s.rank LIMIT ?",
+        parameters + [limit],
+    ).fetchall()
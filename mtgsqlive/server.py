@@ -0,0 +1,561 @@
+"""
+Local HTTP query server over a generated database
+
+python3 -m mtgsqlive serve /path/to/output.sqlite [--port 8080]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import http
+import json
+import logging
+import math
+import os
+import pathlib
+import sqlite3
+import urllib.parse
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from mtgsqlive.query import CardDatabase, ResultCache
+from mtgsqlive.satellites import hash_build
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST: str = "127.0.0.1"
+DEFAULT_PORT: int = 8080
+DEFAULT_THREADS: int = 4
+DEFAULT_RESPONSE_CACHE_SIZE: int = 8192
+
+# Seconds between checks of the database file for a new build
+DEFAULT_WATCH_INTERVAL: float = 2.0
+
+# Most keys taken by one batched request (i.e. /legalities?uuids=...)
+MAX_BATCH_KEYS: int = 500
+
+# Request line and headers of one request
+MAX_HEADER_LINES: int = 100
+
+# (status, JSON body)
+Response = Tuple[int, bytes]
+
+
+class RouteRequest(NamedTuple):
+    """
+    What a route is given of a request
+    """
+
+    key: str  # Segment after the route's own, i.e. the uuid of /cards/{uuid}
+    parameters: Dict[str, str]
+
+
+Route = Callable[[CardDatabase, RouteRequest], Response]
+
+
+class DatabaseSnapshot(NamedTuple):
+    """
+    One build of the database file, with what identifies its content
+    """
+
+    database: CardDatabase
+    content_hash: str
+    signature: Tuple[int, int, int]
+
+
+class HttpError(Exception):
+    """
+    Request that can't be answered; turned into an error response
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def json_response(value: Any, status: int = 200) -> Response:
+    """
+    :param value: JSON serializable value
+    :param status: HTTP status
+    :return: Response
+    """
+    return (
+        status,
+        json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf8"),
+    )
+
+
+def not_found(what: str) -> Response:
+    """
+    :param what: What was not found
+    :return: 404 response
+    """
+    return json_response({"error": f"{what} not found"}, 404)
+
+
+def get_keys(parameters: Dict[str, str], name: str) -> List[str]:
+    """
+    :param parameters: Query parameters
+    :param name: Parameter holding a comma separated list
+    :return: Keys of the list
+    """
+    keys = [key for key in parameters.get(name, "").split(",") if key]
+    if not keys:
+        raise HttpError(400, f"Missing {name} parameter")
+    if len(keys) > MAX_BATCH_KEYS:
+        raise HttpError(400, f"More than {MAX_BATCH_KEYS} {name}")
+    return keys
+
+
+def get_limit(parameters: Dict[str, str], default: int = 20) -> int:
+    """
+    :param parameters: Query parameters
+    :param default: Limit if none is given
+    :return: Result limit, 1 to 100
+    """
+    try:
+        limit = int(parameters.get("limit", default))
+    except ValueError as error:
+        raise HttpError(400, "limit must be a number") from error
+    return min(max(limit, 1), 100)
+
+
+def route_card(database: CardDatabase, request: RouteRequest) -> Response:
+    """
+    /cards/{uuid}
+    """
+    card = database.card(request.key)
+    return json_response(card) if card else not_found("Card")
+
+
+def route_cards(database: CardDatabase, request: RouteRequest) -> Response:
+    """
+    /cards?name=...[&set=...] or /cards?uuids=...,...
+    """
+    parameters = request.parameters
+    if "uuids" in parameters:
+        return json_response(database.cards(get_keys(parameters, "uuids")))
+    if "name" not in parameters:
+        raise HttpError(400, "Missing name or uuids parameter")
+    return json_response(database.cards_named(parameters["name"], parameters.get("set")))
+
+
+def route_set(database: CardDatabase, request: RouteRequest) -> Response:
+    """
+    /sets/{code}
+    """
+    card_set = database.card_set(request.key)
+    if card_set is None:
+        return not_found("Set")
+    return json_response({**card_set, "cards": database.cards_in_set(request.key)})
+
+
+def route_search(database: CardDatabase, request: RouteRequest) -> Response:
+    """
+    /search?q=...[&limit=...]
+    """
+    parameters = request.parameters
+    if "q" not in parameters:
+        raise HttpError(400, "Missing q parameter")
+    if not database.has_table("cards_search"):
+        return not_found("Search index (build with --search)")
+    return json_response(database.search(parameters["q"], get_limit(parameters)))
+
+
+def route_legalities(database: CardDatabase, request: RouteRequest) -> Response:
+    """
+    /legalities?uuids=...,...
+    """
+    return json_response(database.legalities(get_keys(request.parameters, "uuids")))
+
+
+def route_prices(database: CardDatabase, request: RouteRequest) -> Response:
+    """
+    /prices/{uuid}[?type=...]
+    """
+    price_type = request.parameters.get("type")
+    return json_response(
+        [point._asdict() for point in database.price_history(request.key, price_type)]
+    )
+
+
+def route_current_prices(database: CardDatabase, request: RouteRequest) -> Response:
+    """
+    /prices?uuids=...,...
+    """
+    uuids = get_keys(request.parameters, "uuids")
+    if not database.has_table("price_summaries"):
+        return not_found("Price summaries (build with --price-summaries)")
+    return json_response(database.current_prices(uuids))
+
+
+# Routes by first path segment, and whether they take a key segment
+ROUTES: Dict[Tuple[str, bool], Route] = {
+    ("cards", True): route_card,
+    ("cards", False): route_cards,
+    ("sets", True): route_set,
+    ("search", False): route_search,
+    ("legalities", False): route_legalities,
+    ("prices", True): route_prices,
+    ("prices", False): route_current_prices,
+}
+
+
+def file_signature(db_file: pathlib.Path) -> Tuple[int, int, int]:
+    """
+    :param db_file: Database file
+    :return: What tells two versions of the file apart
+    """
+    stat = os.stat(str(db_file))
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class QueryServer:
+    """
+    Serves lookups as JSON over HTTP/1.1. SQLite reads run on a thread
+    pool. Identical requests arriving together share one read, and
+    responses are cached per build of the database file. ETags come
+    from the file's content hash, so clients can revalidate without
+    any read.
+
+    Every few seconds the file is checked for a new build. The new
+    build is hashed and opened before it replaces the old one, and
+    requests already running finish on the old one.
+    """
+
+    def __init__(
+        self,
+        db_file: pathlib.Path,
+        threads: int = DEFAULT_THREADS,
+        cache_size: int = DEFAULT_RESPONSE_CACHE_SIZE,
+        watch_interval: float = DEFAULT_WATCH_INTERVAL,
+    ) -> None:
+        """
+        :param db_file: Database file
+        :param threads: Threads (and connections) reading the database
+        :param cache_size: Responses kept in the cache, 0 for none
+        :param watch_interval: Seconds between checks for a new build, 0 for none
+        """
+        self.db_file = db_file
+        self.threads = threads
+        self.watch_interval = watch_interval
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="mtgsqlive-query"
+        )
+        self.responses = ResultCache(cache_size)
+        self.snapshot: Optional[DatabaseSnapshot] = None
+        self.port: Optional[int] = None  # Once serving, i.e. the one port 0 picked
+        self.swap_count = 0
+        self._inflight: Dict[Tuple[Any, ...], "asyncio.Future[Response]"] = {}
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        """
+        Open the database and serve until cancelled
+        :param host: Address to listen on
+        :param port: Port to listen on
+        """
+        self.snapshot = await self.open_snapshot()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        LOGGER.info(f"Serving {self.db_file} on http://{host}:{self.port}/")
+
+        watcher = asyncio.ensure_future(self.watch()) if self.watch_interval else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher:
+                watcher.cancel()
+            # The last build swapped in, not necessarily the first one
+            self.current_snapshot().database.close()
+            self.executor.shutdown(wait=False)
+
+    def current_snapshot(self) -> DatabaseSnapshot:
+        """
+        :return: Build of the database being served
+        """
+        if self.snapshot is None:
+            raise RuntimeError(f"{self.db_file} isn't being served yet")
+        return self.snapshot
+
+    async def open_snapshot(self) -> DatabaseSnapshot:
+        """
+        Hash and open the current database file. A file replaced while
+        it was hashed is hashed again.
+        :return: Snapshot of the file
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            signature = file_signature(self.db_file)
+            # Off the query threads, which keep serving the old build
+            content_hash = await loop.run_in_executor(None, hash_build, self.db_file)
+            if file_signature(self.db_file) == signature:
+                break
+
+        # The server watches the file itself, and swaps whole snapshots
+        database = CardDatabase(
+            self.db_file, pool_size=self.threads, check_interval=math.inf
+        )
+        return DatabaseSnapshot(database, content_hash, signature)
+
+    async def watch(self) -> None:
+        """
+        Swap in new builds of the database file as they appear
+        """
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                if file_signature(self.db_file) == self.current_snapshot().signature:
+                    continue
+                snapshot = await self.open_snapshot()
+            except (OSError, sqlite3.Error) as error:  # Mid replace, try again
+                LOGGER.warning(f"Can't open new build of {self.db_file}: {error}")
+                continue
+
+            old_snapshot, self.snapshot = self.current_snapshot(), snapshot
+            self.responses.clear()
+            old_snapshot.database.close()
+            self.swap_count += 1
+            LOGGER.info(
+                f"Switched to new build of {self.db_file} ({snapshot.content_hash[:12]})"
+            )
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Answer the requests of one keep-alive connection
+        :param reader: Request stream
+        :param writer: Response stream
+        """
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, body, etag = await self.respond(method, target, headers)
+
+                head = [
+                    f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+                    "Content-Type: application/json; charset=utf-8",
+                    f"Content-Length: {len(body)}",
+                    "Cache-Control: no-cache",
+                ]
+                if etag:
+                    head.append(f"ETag: {etag}")
+                if not keep_alive:
+                    head.append("Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD" and status != 304:
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HttpError as error:
+            writer.write(
+                f"HTTP/1.1 {error.status} {http.HTTPStatus(error.status).phrase}\r\n"
+                "Content-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1")
+            )
+        finally:
+            writer.close()
+
+    async def respond(
+        self, method: str, target: str, headers: Dict[str, str]
+    ) -> Tuple[int, bytes, Optional[str]]:
+        """
+        :param method: HTTP method
+        :param target: Request target (path and query)
+        :param headers: Request headers, lower case names
+        :return: Status, body and ETag of the response
+        """
+        if method not in ("GET", "HEAD"):
+            status, body = json_response({"error": "Only GET and HEAD are supported"}, 405)
+            return status, body, None
+
+        url = urllib.parse.urlsplit(target)
+        query = tuple(sorted(urllib.parse.parse_qsl(url.query)))
+        snapshot = self.current_snapshot()
+        key = (snapshot.content_hash, url.path, query)
+        etag = '"{}-{:08x}"'.format(
+            snapshot.content_hash[:16],
+            zlib.crc32(repr((url.path, query)).encode("utf8")),
+        )
+        if etag in parse_etags(headers.get("if-none-match", "")):
+            return 304, b"", etag
+
+        found, response = self.responses.get(key)
+        if not found:
+            response = await self.coalesce(key, snapshot, url.path, dict(query))
+        status, body = response
+        return status, body, etag if status == 200 else None
+
+    async def coalesce(
+        self,
+        key: Tuple[Any, ...],
+        snapshot: DatabaseSnapshot,
+        path: str,
+        parameters: Dict[str, str],
+    ) -> Response:
+        """
+        Run a lookup on the thread pool, or join the same lookup if it
+        is already running
+        :param key: Cache key of the request
+        :param snapshot: Database build to read
+        :param path: URL path
+        :param parameters: Query parameters
+        :return: Response
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        generation = self.responses.generation
+        future: "asyncio.Future[Response]" = asyncio.ensure_future(
+            self.run_route(snapshot.database, path, parameters)
+        )
+        self._inflight[key] = future
+        try:
+            response = await asyncio.shield(future)
+        finally:
+            del self._inflight[key]
+        if response[0] < 500:
+            self.responses.put(key, response, generation)
+        return response
+
+    def run_route(
+        self, database: CardDatabase, path: str, parameters: Dict[str, str]
+    ) -> Awaitable[Response]:
+        """
+        :param database: Database to read
+        :param path: URL path
+        :param parameters: Query parameters
+        :return: Response, computed on the thread pool
+        """
+        return asyncio.get_event_loop().run_in_executor(
+            self.executor, answer, database, path, parameters
+        )
+
+
+def answer(database: CardDatabase, path: str, parameters: Dict[str, str]) -> Response:
+    """
+    Route a request and run its lookup. Runs on the thread pool.
+    :param database: Database to read
+    :param path: URL path
+    :param parameters: Query parameters
+    :return: Response
+    """
+    segments = [urllib.parse.unquote(segment) for segment in path.split("/") if segment]
+    route = (
+        ROUTES.get((segments[0], len(segments) == 2))
+        if 1 <= len(segments) <= 2
+        else None
+    )
+    if route is None:
+        return not_found(f"Path {path}")
+
+    key = segments[1] if len(segments) == 2 else ""
+    try:
+        return route(database, RouteRequest(key, parameters))
+    except HttpError as error:
+        return json_response({"error": str(error)}, error.status)
+    except sqlite3.Error as error:
+        LOGGER.exception(f"Lookup of {path} failed")
+        return json_response({"error": str(error)}, 500)
+    except Exception:  # pylint: disable=broad-except
+        # Still an answer, for this request and those coalesced onto it
+        LOGGER.exception(f"Lookup of {path} failed")
+        return json_response({"error": "Internal error"}, 500)
+
+
+def parse_etags(header: str) -> List[str]:
+    """
+    :param header: If-None-Match header
+    :return: ETags it lists, weak ones as strong
+    """
+    return [
+        etag.strip()[2:] if etag.strip().startswith("W/") else etag.strip()
+        for etag in header.split(",")
+    ]
+
+
+async def read_request(
+    reader: asyncio.StreamReader,
+) -> Optional[Tuple[str, str, Dict[str, str]]]:
+    """
+    Read the head of a request, and skip its body
+    :param reader: Request stream
+    :return: Method, target and headers (lower case names), None once
+    the client closed the connection
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError as error:
+        raise HttpError(400, "Malformed request line") from error
+
+    headers: Dict[str, str] = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(431, "Too many headers")
+
+    try:
+        body_length = int(headers.get("content-length", 0))
+    except ValueError as error:
+        raise HttpError(400, "Malformed Content-Length") from error
+    if body_length:
+        await reader.readexactly(body_length)
+    return method, target, headers
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    """
+    Serve a database until interrupted
+    :param arguments: Command line arguments, after "serve"
+    """
+    parser = argparse.ArgumentParser(prog="mtgsqlive serve")
+    parser.add_argument("database", help="database file to serve")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--threads",
+        help=f"threads reading the database (default {DEFAULT_THREADS})",
+        type=int,
+        default=DEFAULT_THREADS,
+    )
+    parser.add_argument(
+        "--cache-size",
+        help=f"responses kept in memory, 0 for none (default {DEFAULT_RESPONSE_CACHE_SIZE})",
+        type=int,
+        default=DEFAULT_RESPONSE_CACHE_SIZE,
+        metavar="responses",
+    )
+    parser.add_argument(
+        "--watch",
+        help=f"seconds between checks for a new build of the file, 0 to never switch (default {DEFAULT_WATCH_INTERVAL:g})",
+        type=float,
+        default=DEFAULT_WATCH_INTERVAL,
+        metavar="seconds",
+    )
+    args = parser.parse_args(arguments)
+
+    db_file = pathlib.Path(args.database).expanduser()
+    if not db_file.is_file():
+        parser.error(f"No database at {db_file}")
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+
+    server = QueryServer(db_file, args.threads, args.cache_size, args.watch)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        LOGGER.info("Stopped")
@@ -0,0 +1,153 @@
+"""
+Shard database helpers for parallel builds
+"""
+import logging
+import pathlib
+import sqlite3
+from typing import Dict, List, Set
+
+from mtgsqlive.coded_columns import (
+    get_coded_columns,
+    interned_lookup_tables,
+    lookup_key,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def partition_by_size(
+    paths: List[pathlib.Path], shard_count: int
+) -> List[List[pathlib.Path]]:
+    """
+    Spread files over shards so each shard gets about the same
+    number of bytes to convert (largest files placed first)
+    :param paths: Files to spread
+    :param shard_count: Number of shards
+    :return: Files per shard, in name order; empty shards are dropped
+    """
+    shards: List[List[pathlib.Path]] = [[] for _ in range(shard_count)]
+    shard_sizes = [0] * shard_count
+
+    for path in sorted(paths, key=lambda p: p.stat().st_size, reverse=True):
+        smallest = shard_sizes.index(min(shard_sizes))
+        shards[smallest].append(path)
+        shard_sizes[smallest] += path.stat().st_size
+
+    return [sorted(shard) for shard in shards if shard]
+
+
+def get_table_columns(sql_connection: sqlite3.Connection) -> Dict[str, List[str]]:
+    """
+    List the tables of a database with the columns that get copied
+    on a merge. INTEGER PRIMARY KEY (AUTOINCREMENT) columns are left
+    out so the target assigns fresh ids. Virtual tables (search
+    indexes) and their shadow tables are derived data and left out.
+    :param sql_connection: Database connection
+    :return: Columns per table, in creation order
+    """
+    master_rows = sql_connection.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' "
+        "AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+    ).fetchall()
+    virtual_tables = [
+        name
+        for name, sql in master_rows
+        if sql.upper().startswith("CREATE VIRTUAL TABLE")
+    ]
+    tables = [
+        name
+        for name, _ in master_rows
+        if not any(
+            name == virtual or name.startswith(f"{virtual}_")
+            for virtual in virtual_tables
+        )
+    ]
+
+    table_columns: Dict[str, List[str]] = {}
+    for table in tables:
+        table_info = sql_connection.execute(f"PRAGMA table_info(`{table}`)")
+        table_columns[table] = [
+            column[1]
+            for column in table_info
+            if not (column[5] and column[2].upper() == "INTEGER")
+        ]
+
+    return table_columns
+
+
+def merge_shard_databases(
+    sql_connection: sqlite3.Connection, shard_paths: List[pathlib.Path]
+) -> Dict[str, int]:
+    """
+    Copy the rows of every shard into the database, one shard at a
+    time, using ATTACH and INSERT ... SELECT. Shards must have been
+    built with the same schema. Rows keep their per-shard order and
+    natural keys (sets.code, cards.uuid) are carried over as they are,
+    so references between tables stay valid. Integer-coded columns
+    are remapped to the ids their values got in the target.
+    :param sql_connection: Target database connection
+    :param shard_paths: Shard databases to merge, in order
+    :return: Rows merged per table
+    """
+    table_columns = get_table_columns(sql_connection)
+    table_counts: Dict[str, int] = {table: 0 for table in table_columns}
+    coded_columns = get_coded_columns(sql_connection)
+    interned_tables = interned_lookup_tables(coded_columns)
+
+    for shard_path in shard_paths:
+        LOGGER.info(f"Merging shard {shard_path.name}")
+
+        # ATTACH is not allowed inside a transaction
+        sql_connection.commit()
+        sql_connection.execute("ATTACH DATABASE ? AS shard", (str(shard_path),))
+        key_maps: Set[str] = set()
+        try:
+            for table, columns in table_columns.items():
+                column_list = ", ".join(f"`{column}`" for column in columns)
+                select_list = [f"t.`{column}`" for column in columns]
+                for coded in coded_columns.get(table, []):
+                    if coded.lookup_table not in key_maps:
+                        build_key_map(sql_connection, coded.lookup_table)
+                        key_maps.add(coded.lookup_table)
+                    select_list[columns.index(coded.target)] = (
+                        f"(SELECT main_id FROM temp.`key_map_{coded.lookup_table}` "
+                        f"WHERE shard_id = t.`{coded.target}`)"
+                    )
+
+                verb = "INSERT OR IGNORE" if table in interned_tables else "INSERT"
+                cursor = sql_connection.execute(
+                    f"{verb} INTO main.`{table}` ({column_list}) "
+                    f"SELECT {', '.join(select_list)} FROM shard.`{table}` AS t "
+                    "ORDER BY t.rowid"
+                )
+                table_counts[table] += cursor.rowcount
+            sql_connection.commit()
+        except sqlite3.Error:
+            sql_connection.rollback()
+            raise
+        finally:
+            for lookup_table in key_maps:
+                sql_connection.execute(f"DROP TABLE temp.`key_map_{lookup_table}`")
+            sql_connection.execute("DETACH DATABASE shard")
+
+    return table_counts
+
+
+def build_key_map(sql_connection: sqlite3.Connection, lookup_table: str) -> None:
+    """
+    Map the ids of a lookup table in the attached shard to the ids
+    the same keys have in the target. The lookup table must have been
+    merged already.
+    :param sql_connection: Target database connection, shard attached
+    :param lookup_table: Lookup table to map
+    """
+    key = lookup_key(lookup_table)
+    sql_connection.execute(
+        f"CREATE TEMP TABLE `key_map_{lookup_table}` "
+        "(shard_id INTEGER PRIMARY KEY, main_id INTEGER)"
+    )
+    sql_connection.execute(
+        f"INSERT INTO temp.`key_map_{lookup_table}` "
+        f"SELECT s.id, m.id FROM shard.`{lookup_table}` AS s "
+        f"JOIN main.`{lookup_table}` AS m ON m.`{key}` = s.`{key}`"
+    )
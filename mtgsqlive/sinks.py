@@ -0,0 +1,523 @@
+"""
+Export sinks: the converted rows also written to files (CSV, JSON
+Lines, columnar), in the same pass over the input as the SQLite build
+"""
+import abc
+import array
+import csv
+import json
+import logging
+import math
+import pathlib
+import shutil
+import sqlite3
+import sys
+from types import ModuleType
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Set, Tuple, Type
+
+from mtgsqlive.coded_columns import get_coded_columns
+from mtgsqlive.metrics import PipelineMetrics
+from mtgsqlive.sql_writer import DEFAULT_BATCH_SIZE, RowBuffer, RowShape
+
+numpy: Optional[ModuleType]
+try:
+    import numpy
+except ImportError:  # Optional, to read columnar exports
+    numpy = None
+
+orjson: Optional[ModuleType]
+try:
+    import orjson
+except ImportError:  # Optional, to encode JSON Lines faster
+    orjson = None
+
+LOGGER = logging.getLogger(__name__)
+
+# Bookkeeping tables of the build (--update hashes, --resume progress)
+UNEXPORTED_TABLES: Tuple[str, ...] = ("set_content_hashes", "build_progress")
+
+# Column files of the columnar format, holding one value per row
+COLUMNAR_TYPECODES: Dict[str, str] = {"int64": "q", "float64": "d"}
+
+
+class ExportColumn(NamedTuple):
+    """
+    Column of an exported table
+    """
+
+    name: str
+    declared_type: str
+    # Value of rows without the column, as SQLite would insert it
+    default: Any = None
+
+
+def get_export_columns(
+    schema_connection: sqlite3.Connection, table: str
+) -> List[ExportColumn]:
+    """
+    :param schema_connection: Connection to the database being built
+    :param table: Table the rows are written to
+    :return: Columns the table's rows carry, in table order: coded
+    columns under the name of their value (uuid instead of cardId,
+    artist instead of artistId), without the row ids SQLite assigns
+    """
+    coded_sources = {
+        coded.target: coded.source
+        for coded in get_coded_columns(schema_connection).get(table, [])
+    }
+    columns = []
+    for _, name, declared_type, _, default, _ in schema_connection.execute(
+        f"PRAGMA table_info(`{table}`)"
+    ):
+        if name == "id":
+            continue
+        if name in coded_sources:
+            columns.append(ExportColumn(coded_sources[name], "TEXT"))
+            continue
+        if default is not None:
+            (default,) = schema_connection.execute(f"SELECT {default}").fetchone()
+        columns.append(ExportColumn(name, declared_type, default))
+    return columns
+
+
+def columnar_type(declared_type: str) -> str:
+    """
+    :param declared_type: Declared SQLite column type
+    :return: int64, float64 or string, following SQLite's type affinity
+    """
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "int64"
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return "float64"
+    return "string"
+
+
+class ExportSink(RowBuffer, abc.ABC):
+    """
+    Collect rows per (table, column shape) like the SQLite writer, and
+    write each group to the table's file once it reaches the batch
+    size. Every row of a table is written with all of the table's
+    columns, in schema order, the missing ones as NULL.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        schema_connection: sqlite3.Connection,
+        table_names: Optional[Dict[str, str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        metrics: Optional[PipelineMetrics] = None,
+    ) -> None:
+        """
+        :param directory: Directory to write the files to
+        :param schema_connection: Connection to the database being
+        built, for the columns of each table
+        :param table_names: Name of the files of a table, if not the
+        table's (i.e. foreignData for card_foreignData)
+        :param batch_size: Rows buffered per shape before writing
+        :param metrics: Stage timers to book the writes on
+        """
+        super().__init__(metrics, batch_size)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.schema_connection = schema_connection
+        self.table_names = table_names or {}
+        self.table_counts: Dict[str, int] = {}
+
+        self._columns: Dict[str, List[ExportColumn]] = {}
+        self._positions: Dict[RowShape, Tuple[Optional[int], ...]] = {}
+        self._defaults: Dict[str, Tuple[Any, ...]] = {}
+
+    def insert(self, data: Dict[str, Any], table: str) -> None:
+        """
+        Queue a dictionary for export
+        :param data: Dict to write
+        :param table: Table it belongs to
+        """
+        if table not in UNEXPORTED_TABLES:
+            super().insert(data, table)
+
+    def insert_rows(
+        self, table: str, columns: Tuple[str, ...], rows: List[Tuple[Any, ...]]
+    ) -> None:
+        """
+        Queue value tuples that share one column shape
+        :param table: Table they belong to
+        :param columns: Column names, in value order
+        :param rows: Value tuples
+        """
+        if table not in UNEXPORTED_TABLES:
+            super().insert_rows(table, columns, rows)
+
+    def close(self) -> None:
+        """
+        Write the remaining rows and finish the files
+        """
+        self.flush()
+        for table, columns in self._columns.items():
+            self.close_table(self.output_name(table), columns)
+        LOGGER.info(
+            f"Exported {sum(self.table_counts.values())} rows "
+            f"to {self.directory}"
+        )
+
+    def output_name(self, table: str) -> str:
+        """
+        :param table: Table the rows belong to
+        :return: Name of its files
+        """
+        return self.table_names.get(table, table)
+
+    @abc.abstractmethod
+    def open_table(self, name: str, columns: List[ExportColumn]) -> None:
+        """
+        Start the files of a table
+        :param name: Name of its files
+        :param columns: Its columns
+        """
+
+    @abc.abstractmethod
+    def write_rows(
+        self, name: str, columns: List[ExportColumn], rows: List[Tuple[Any, ...]]
+    ) -> None:
+        """
+        Append rows to the files of a table
+        :param name: Name of its files
+        :param columns: Its columns
+        :param rows: Values of every column, in column order
+        """
+
+    def close_table(self, name: str, columns: List[ExportColumn]) -> None:
+        """
+        Finish the files of a table, once all rows are written
+        :param name: Name of its files
+        :param columns: Its columns
+        """
+
+    def _new_buffer(self, shape: RowShape) -> List[Tuple[Any, ...]]:
+        """
+        Register a column shape, starting the table's files if it's
+        the table's first
+        :param shape: (table, columns) key
+        :return: Empty buffer for the shape
+        """
+        table, row_columns = shape
+        columns = self._columns.get(table)
+        if columns is None:
+            columns = self._columns[table] = get_export_columns(
+                self.schema_connection, table
+            )
+            self._defaults[table] = tuple(column.default for column in columns)
+            self.open_table(self.output_name(table), columns)
+
+        names = [column.name for column in columns]
+        unknown = set(row_columns).difference(names)
+        if unknown:
+            raise ValueError(
+                "{} has no column for {}".format(table, ", ".join(sorted(unknown)))
+            )
+        positions = {column: position for position, column in enumerate(row_columns)}
+        self._positions[shape] = tuple(positions.get(name) for name in names)
+        return super()._new_buffer(shape)
+
+    def _write_rows(self, shape: RowShape, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Write the queued rows of one shape, with every column of the
+        table (the default value of the ones the rows don't have)
+        :param shape: (table, columns) key
+        :param rows: Rows queued for the shape
+        """
+        table = shape[0]
+        positions = self._positions[shape]
+        count = len(rows)
+        if positions != tuple(range(len(shape[1]))):
+            defaults = self._defaults[table]
+            rows = [
+                tuple(
+                    default if position is None else row[position]
+                    for position, default in zip(positions, defaults)
+                )
+                for row in rows
+            ]
+        self.metrics.start_stage("export")
+        self.write_rows(self.output_name(table), self._columns[table], rows)
+        self.metrics.end_stage()
+        self.table_counts[table] = self.table_counts.get(table, 0) + count
+
+
+class CsvSink(ExportSink):
+    """
+    One CSV file per table, with a header row. NULLs are empty fields.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        """
+        :param args: ExportSink arguments
+        :param kwargs: ExportSink arguments
+        """
+        super().__init__(*args, **kwargs)
+        self._files: Dict[str, IO[str]] = {}
+        self._writers: Dict[str, Any] = {}
+
+    def open_table(self, name: str, columns: List[ExportColumn]) -> None:
+        csv_file = self.directory.joinpath(f"{name}.csv").open(
+            "w", newline="", encoding="utf-8"
+        )
+        self._files[name] = csv_file
+        self._writers[name] = csv.writer(csv_file)
+        self._writers[name].writerow([column.name for column in columns])
+
+    def write_rows(
+        self, name: str, columns: List[ExportColumn], rows: List[Tuple[Any, ...]]
+    ) -> None:
+        self._writers[name].writerows(rows)
+
+    def close_table(self, name: str, columns: List[ExportColumn]) -> None:
+        self._files.pop(name).close()
+
+
+class JsonLinesSink(ExportSink):
+    """
+    One JSON Lines file per table: an object per row, NULLs included
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        """
+        :param args: ExportSink arguments
+        :param kwargs: ExportSink arguments
+        """
+        super().__init__(*args, **kwargs)
+        self._files: Dict[str, IO[bytes]] = {}
+
+    def open_table(self, name: str, columns: List[ExportColumn]) -> None:
+        self._files[name] = self.directory.joinpath(f"{name}.jsonl").open("wb")
+
+    def write_rows(
+        self, name: str, columns: List[ExportColumn], rows: List[Tuple[Any, ...]]
+    ) -> None:
+        names = [column.name for column in columns]
+        if orjson:
+            lines = b"".join(
+                orjson.dumps(dict(zip(names, row))) + b"\n" for row in rows
+            )
+        else:
+            lines = "".join(
+                json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n"
+                for row in rows
+            ).encode("utf-8")
+        self._files[name].write(lines)
+
+    def close_table(self, name: str, columns: List[ExportColumn]) -> None:
+        self._files.pop(name).close()
+
+
+class ColumnarSink(ExportSink):
+    """
+    One directory per table, holding little-endian column files that
+    numpy.memmap maps as is:
+      {column}.valid  uint8, 1 per row that isn't NULL
+      {column}.int64 or {column}.float64  one value per row (0 or NaN when NULL)
+      {column}.offsets and {column}.data  strings: int64 offsets (one more
+        than there are rows) into the UTF-8 bytes of the values
+    and a schema.json listing the columns, their type and the row count.
+    Column types follow the declared SQLite types (see columnar_type).
+    Files are opened per batch, not held open, as there are hundreds.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        """
+        :param args: ExportSink arguments
+        :param kwargs: ExportSink arguments
+        """
+        super().__init__(*args, **kwargs)
+        self._row_counts: Dict[str, int] = {}
+        self._string_ends: Dict[Tuple[str, str], int] = {}
+        self._reported: Set[Tuple[str, str]] = set()
+
+    def open_table(self, name: str, columns: List[ExportColumn]) -> None:
+        table_dir = self.directory.joinpath(name)
+        if table_dir.is_dir():
+            shutil.rmtree(str(table_dir))
+        table_dir.mkdir()
+        self._row_counts[name] = 0
+        for column in columns:
+            if columnar_type(column.declared_type) == "string":
+                self._string_ends[(name, column.name)] = 0
+                self._append(name, f"{column.name}.offsets", array.array("q", [0]))
+
+    def write_rows(
+        self, name: str, columns: List[ExportColumn], rows: List[Tuple[Any, ...]]
+    ) -> None:
+        for column, values in zip(columns, zip(*rows)):
+            kind = columnar_type(column.declared_type)
+            if kind == "string":
+                self._write_strings(name, column.name, values)
+            else:
+                self._write_numbers(name, column.name, kind, values)
+        self._row_counts[name] += len(rows)
+
+    def close_table(self, name: str, columns: List[ExportColumn]) -> None:
+        schema = {
+            "rows": self._row_counts[name],
+            "columns": [
+                {"name": column.name, "type": columnar_type(column.declared_type)}
+                for column in columns
+            ],
+        }
+        with self.directory.joinpath(name, "schema.json").open(
+            "w", encoding="utf-8"
+        ) as schema_file:
+            json.dump(schema, schema_file, indent=2)
+
+    def _write_numbers(
+        self, name: str, column: str, kind: str, values: Tuple[Any, ...]
+    ) -> None:
+        """
+        Append numeric values
+        :param name: Name of the table's files
+        :param column: Column name
+        :param kind: int64 or float64
+        :param values: Values, converted one by one only if some aren't
+        numbers of the column's type
+        """
+        null = 0 if kind == "int64" else math.nan
+        try:
+            numbers = array.array(
+                COLUMNAR_TYPECODES[kind],
+                (null if value is None else value for value in values),
+            )
+        except (TypeError, OverflowError):
+            values = tuple(self._number(name, column, kind, value) for value in values)
+            numbers = array.array(
+                COLUMNAR_TYPECODES[kind],
+                (null if value is None else value for value in values),
+            )
+
+        self._append(
+            name, f"{column}.valid", bytes(value is not None for value in values)
+        )
+        self._append(name, f"{column}.{kind}", numbers)
+
+    def _write_strings(self, name: str, column: str, values: Tuple[Any, ...]) -> None:
+        """
+        Append string values, with their end offsets
+        :param name: Name of the table's files
+        :param column: Column name
+        :param values: Values, converted with str()
+        """
+        encoded = [b"" if value is None else str(value).encode() for value in values]
+        offsets = array.array("q")
+        end = self._string_ends[(name, column)]
+        for value in encoded:
+            end += len(value)
+            offsets.append(end)
+        self._string_ends[(name, column)] = end
+
+        self._append(
+            name, f"{column}.valid", bytes(value is not None for value in values)
+        )
+        self._append(name, f"{column}.offsets", offsets)
+        self._append(name, f"{column}.data", b"".join(encoded))
+
+    def _number(self, name: str, column: str, kind: str, value: Any) -> Any:
+        """
+        :param name: Name of the table's files
+        :param column: Column name
+        :param kind: int64 or float64
+        :param value: Value of the column
+        :return: Value as a number, None if it's NULL or isn't a number
+        (reported once per column)
+        """
+        if value is None:
+            return None
+        try:
+            if kind == "float64":
+                return float(value)
+            if isinstance(value, float) and not value.is_integer():
+                raise ValueError(value)
+            return int(value)
+        except (TypeError, ValueError):
+            if (name, column) not in self._reported:
+                self._reported.add((name, column))
+                LOGGER.warning(
+                    f"Exporting non-numeric {name}.{column} as NULL: {value!r}"
+                )
+            return None
+
+    def _append(self, name: str, file_name: str, data: Any) -> None:
+        """
+        :param name: Name of the table's files
+        :param file_name: Column file
+        :param data: Bytes, or an array written little-endian
+        """
+        if isinstance(data, array.array) and sys.byteorder != "little":
+            data.byteswap()
+        with self.directory.joinpath(name, file_name).open("ab") as column_file:
+            column_file.write(data)
+
+
+# Export formats of --export
+EXPORT_SINKS: Dict[str, Type[ExportSink]] = {
+    "csv": CsvSink,
+    "jsonl": JsonLinesSink,
+    "columnar": ColumnarSink,
+}
+
+
+def parse_export_target(value: str) -> Tuple[str, pathlib.Path]:
+    """
+    :param value: format:directory, i.e. csv:exports/csv
+    :return: Export format and directory
+    """
+    export_format, _, directory = value.partition(":")
+    if export_format not in EXPORT_SINKS or not directory:
+        raise ValueError(
+            "Exports are format:directory, with format one of {} ({})".format(
+                ", ".join(EXPORT_SINKS), value
+            )
+        )
+    return export_format, pathlib.Path(directory).expanduser()
+
+
+def load_columnar_table(table_dir: pathlib.Path) -> Dict[str, Any]:
+    """
+    Map a table of the columnar format with NumPy
+    :param table_dir: Directory of the table
+    :return: Per column, a masked array over the memory mapped values
+    for numbers, or an object array of the decoded strings (None for NULL)
+    """
+    if numpy is None:
+        raise ImportError("Reading columnar exports needs numpy (pip3 install numpy)")
+
+    with table_dir.joinpath("schema.json").open(encoding="utf-8") as schema_file:
+        schema = json.load(schema_file)
+
+    def memmap(file_name: str, dtype: str, length: int) -> Any:
+        # numpy can't map empty files
+        if not length:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(
+            str(table_dir.joinpath(file_name)), dtype=dtype, mode="r", shape=(length,)
+        )
+
+    row_count = schema["rows"]
+    columns: Dict[str, Any] = {}
+    for column in schema["columns"]:
+        name, kind = column["name"], column["type"]
+        valid = memmap(f"{name}.valid", "u1", row_count).astype(bool)
+        if kind != "string":
+            values = memmap(f"{name}.{kind}", f"<{kind[0]}8", row_count)
+            columns[name] = numpy.ma.masked_array(values, mask=~valid)
+            continue
+
+        offsets = memmap(f"{name}.offsets", "<i8", row_count + 1)
+        data = bytes(memmap(f"{name}.data", "u1", int(offsets[-1])))
+        columns[name] = numpy.array(
+            [
+                data[offsets[row] : offsets[row + 1]].decode() if valid[row] else None
+                for row in range(row_count)
+            ],
+            dtype=object,
+        )
+    return columns
@@ -0,0 +1,387 @@
+"""
+Buffered SQLite writer for bulk row insertion
+"""
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from mtgsqlive.coded_columns import (
+    ROW_LOOKUP_TABLES,
+    CodedColumn,
+    get_coded_columns,
+    lookup_key,
+)
+from mtgsqlive.metrics import PipelineMetrics
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE: int = 5000
+
+RowShape = Tuple[str, Tuple[str, ...]]
+
+# (table, columns, value tuples) as handed from worker processes
+RowGroup = Tuple[str, Tuple[str, ...], List[Tuple[Any, ...]]]
+
+
+class RowBuffer:
+    """
+    Collect row dicts as compact value tuples, grouped per
+    (table, column shape). Writers give it a batch size and a write
+    step (_write_rows), and each group is written once it reaches the
+    batch size; a plain buffer keeps its rows until they are drained.
+    """
+
+    def __init__(
+        self,
+        metrics: Optional[PipelineMetrics] = None,
+        batch_size: Optional[int] = None,
+    ) -> None:
+        """
+        :param metrics: Stage timers to book conversion time on
+        :param batch_size: Rows buffered per shape before they are
+        written, None to keep them until drained
+        """
+        if batch_size is not None and batch_size < 1:
+            raise ValueError(f"Batch size must be positive ({batch_size})")
+
+        self._buffers: Dict[RowShape, List[Tuple[Any, ...]]] = {}
+        self.metrics = metrics or PipelineMetrics()
+        self.batch_size = batch_size
+
+    def insert(self, data: Dict[str, Any], table: str) -> None:
+        """
+        Queue a dictionary for insertion into a table
+        :param data: Dict to insert
+        :param table: Table to insert to
+        """
+        shape: RowShape = (table, tuple(data.keys()))
+        buffer = self._buffers.get(shape)
+        if buffer is None:
+            buffer = self._new_buffer(shape)
+
+        buffer.append(tuple(data.values()))
+        self._buffer_grew(shape, buffer)
+
+    def insert_many(self, rows: List[Dict[str, Any]], table: str) -> None:
+        """
+        Queue several dictionaries for insertion into a table
+        :param rows: Dicts to insert
+        :param table: Table to insert to
+        """
+        for row in rows:
+            self.insert(row, table)
+
+    def insert_rows(
+        self, table: str, columns: Tuple[str, ...], rows: List[Tuple[Any, ...]]
+    ) -> None:
+        """
+        Queue value tuples that share one column shape
+        :param table: Table to insert to
+        :param columns: Column names, in value order
+        :param rows: Value tuples
+        """
+        shape: RowShape = (table, columns)
+        buffer = self._buffers.get(shape)
+        if buffer is None:
+            buffer = self._new_buffer(shape)
+
+        buffer.extend(rows)
+        self._buffer_grew(shape, buffer)
+
+    def insert_groups(self, groups: List[RowGroup]) -> None:
+        """
+        Queue row groups drained from another buffer. Groups of
+        lookup tables (cards) go first, so rows referring to them
+        can be coded.
+        :param groups: Row groups
+        """
+        for table, columns, rows in sorted(
+            groups, key=lambda group: group[0] not in ROW_LOOKUP_TABLES
+        ):
+            self.insert_rows(table, columns, rows)
+
+    def drain(self) -> List[RowGroup]:
+        """
+        Take every queued row out of the buffer
+        :return: Row groups, one per (table, column shape)
+        """
+        groups = [
+            (table, columns, rows)
+            for (table, columns), rows in self._buffers.items()
+            if rows
+        ]
+        self._buffers = {}
+        return groups
+
+    def flush(self) -> None:
+        """
+        Write every queued row; a plain buffer keeps them to be drained
+        """
+        if self.batch_size is None:
+            return
+        for shape, buffer in list(self._buffers.items()):
+            if buffer:
+                self._write_rows(shape, buffer)
+                buffer.clear()
+
+    def close(self) -> None:
+        """
+        Hook called once every row was queued; writers finish their
+        output here, a plain buffer keeps its rows to be drained
+        """
+
+    def _new_buffer(self, shape: RowShape) -> List[Tuple[Any, ...]]:
+        """
+        Register a column shape that has not been seen yet
+        :param shape: (table, columns) key
+        :return: Empty buffer for the shape
+        """
+        buffer: List[Tuple[Any, ...]] = []
+        self._buffers[shape] = buffer
+        return buffer
+
+    def _buffer_grew(self, shape: RowShape, buffer: List[Tuple[Any, ...]]) -> None:
+        """
+        Write a shape once it holds a full batch
+        :param shape: (table, columns) key
+        :param buffer: Rows queued for the shape
+        """
+        if self.batch_size is not None and len(buffer) >= self.batch_size:
+            self._write_rows(shape, buffer)
+            buffer.clear()
+
+    def _write_rows(self, shape: RowShape, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Write step of writers, given the rows of one shape; they are
+        dropped from the buffer afterwards
+        :param shape: (table, columns) key
+        :param rows: Rows queued for the shape
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't write rows")
+
+
+class SqlBatchWriter(RowBuffer):
+    """
+    Collect rows per (table, column shape) and flush each group
+    with a single executemany call once it reaches the batch size.
+    The INSERT statement is built once per shape and reused, so
+    SQLite's statement cache can hold on to the prepared query.
+    """
+
+    def __init__(
+        self,
+        sql_connection: sqlite3.Connection,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        metrics: Optional[PipelineMetrics] = None,
+        sinks: Sequence[RowBuffer] = (),
+    ) -> None:
+        """
+        :param sql_connection: Connection to write to
+        :param batch_size: Rows buffered per shape before flushing
+        :param metrics: Stage timers, also used for progress lines
+        :param sinks: Other writers getting every row as well, before
+        its coded values are swapped for ids (i.e. export sinks)
+        """
+        super().__init__(metrics, batch_size)
+        self.sql_connection = sql_connection
+        self.sinks = list(sinks)
+        self.rows_written = 0
+        self.table_counts: Dict[str, int] = {}
+
+        self._queries: Dict[RowShape, str] = {}
+        self._cursor = sql_connection.cursor()
+        self._start_time = time.perf_counter()
+        self._end_time = 0.0
+
+        # Coded columns of the schema, with the ids known so far
+        # for each lookup table they point into
+        self._coded_columns = get_coded_columns(sql_connection)
+        self._lookup_ids: Dict[str, Dict[Any, int]] = {}
+        self._next_ids: Dict[str, int] = {}
+        for coded_list in self._coded_columns.values():
+            for coded in coded_list:
+                self._load_lookup_ids(coded.lookup_table)
+
+    def insert(self, data: Dict[str, Any], table: str) -> None:
+        """
+        Queue a dictionary for insertion into a table, replacing
+        coded values with their ids
+        :param data: Dict to insert
+        :param table: Table to insert to
+        """
+        coded_list = self._coded_columns.get(table)
+        if coded_list or table in self._next_ids:
+            # Other rows reach the sinks a batch at a time, when flushed
+            for sink in self.sinks:
+                sink.insert(data, table)
+        if coded_list:
+            data = self._encode(data, coded_list)
+        if table in self._next_ids:
+            data = self._assign_id(data, table)
+
+        super().insert(data, table)
+
+    def insert_rows(
+        self, table: str, columns: Tuple[str, ...], rows: List[Tuple[Any, ...]]
+    ) -> None:
+        """
+        Queue value tuples that share one column shape
+        :param table: Table to insert to
+        :param columns: Column names, in value order
+        :param rows: Value tuples
+        """
+        if table in self._coded_columns or table in self._next_ids:
+            for row in rows:
+                self.insert(dict(zip(columns, row)), table)
+            return
+
+        super().insert_rows(table, columns, rows)
+
+    def close(self) -> None:
+        """
+        Flush remaining rows, commit, and log the throughput
+        """
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+        self.metrics.start_stage("commit")
+        self.sql_connection.commit()
+        self.metrics.end_stage()
+        self._end_time = time.perf_counter()
+        LOGGER.info(
+            f"Inserted {self.rows_written} rows in {self.elapsed:.2f}s "
+            f"({self.rows_per_second:.0f} rows/sec; {self.metrics.format_stages()})"
+        )
+
+    def count_rows(self, table: str, row_count: int) -> None:
+        """
+        Account for rows written to a table, including rows
+        that were copied in without going through the buffers
+        :param table: Table written to
+        :param row_count: Number of rows
+        """
+        self.rows_written += row_count
+        self.table_counts[table] = self.table_counts.get(table, 0) + row_count
+
+    @property
+    def elapsed(self) -> float:
+        """
+        :return: Seconds since the writer was created (or until it was closed)
+        """
+        end_time = self._end_time or time.perf_counter()
+        return end_time - self._start_time
+
+    @property
+    def rows_per_second(self) -> float:
+        """
+        :return: Insert throughput so far
+        """
+        elapsed = self.elapsed
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def _load_lookup_ids(self, lookup_table: str) -> None:
+        """
+        Read the ids a lookup table already holds
+        :param lookup_table: Lookup table name
+        """
+        if lookup_table in self._lookup_ids:
+            return
+
+        self._lookup_ids[lookup_table] = dict(
+            self.sql_connection.execute(
+                f"SELECT `{lookup_key(lookup_table)}`, id FROM `{lookup_table}`"
+            )
+        )
+        if lookup_table in ROW_LOOKUP_TABLES:
+            (max_id,) = self.sql_connection.execute(
+                f"SELECT COALESCE(MAX(id), 0) FROM `{lookup_table}`"
+            ).fetchone()
+            self._next_ids[lookup_table] = max_id + 1
+
+    def _assign_id(self, data: Dict[str, Any], table: str) -> Dict[str, Any]:
+        """
+        Give a lookup table row its id before it is written
+        :param data: Row to insert
+        :param table: Lookup table
+        :return: Row with its id
+        """
+        row_id = self._next_ids[table]
+        self._next_ids[table] = row_id + 1
+        self._lookup_ids[table][data.get(lookup_key(table))] = row_id
+        return {"id": row_id, **data}
+
+    def _encode(
+        self, data: Dict[str, Any], coded_list: List[CodedColumn]
+    ) -> Dict[str, Any]:
+        """
+        Swap coded values for their lookup ids
+        :param data: Row to insert
+        :param coded_list: Coded columns of the row's table
+        :return: Row to write
+        """
+        data = dict(data)
+        for coded in coded_list:
+            value = data.pop(coded.source, None)
+            data[coded.target] = (
+                None if value is None else self._lookup_id(coded.lookup_table, value)
+            )
+        return data
+
+    def _lookup_id(self, lookup_table: str, value: Any) -> int:
+        """
+        Get the id of a value, interning it if it's new
+        :param lookup_table: Lookup table
+        :param value: Value to look up
+        :return: Id of the value
+        """
+        lookup_ids = self._lookup_ids[lookup_table]
+        lookup_id = lookup_ids.get(value)
+        if lookup_id is not None:
+            return lookup_id
+
+        if lookup_table in ROW_LOOKUP_TABLES:
+            raise ValueError(
+                f"{value} referenced before it was added to {lookup_table}"
+            )
+
+        self._cursor.execute(
+            f"INSERT INTO `{lookup_table}` (`{lookup_key(lookup_table)}`) VALUES (?)",
+            (value,),
+        )
+        lookup_id = self._cursor.lastrowid
+        if lookup_id is None:
+            raise sqlite3.DatabaseError(f"No id for {value} in {lookup_table}")
+        lookup_ids[value] = lookup_id
+        self.count_rows(lookup_table, 1)
+        return lookup_id
+
+    def _new_buffer(self, shape: RowShape) -> List[Tuple[Any, ...]]:
+        """
+        Register a column shape and build its INSERT statement
+        :param shape: (table, columns) key
+        :return: Empty buffer for the shape
+        """
+        table, columns = shape
+        placeholders = ", ".join("?" * len(columns))
+        self._queries[shape] = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        )
+        return super()._new_buffer(shape)
+
+    def _write_rows(self, shape: RowShape, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Insert the queued rows of one shape with one executemany
+        :param shape: (table, columns) key
+        :param rows: Rows queued for the shape
+        """
+        table, columns = shape
+        if table not in self._coded_columns and table not in self._next_ids:
+            for sink in self.sinks:
+                sink.insert_rows(table, columns, rows)
+
+        self.metrics.start_stage("insert")
+        self._cursor.executemany(self._queries[shape], rows)
+        self.metrics.end_stage()
+        self.count_rows(table, len(rows))
+        self.metrics.check_progress(self.table_counts)
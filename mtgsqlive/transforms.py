@@ -0,0 +1,506 @@
+"""
+Row transforms: MTGJSON sets, cards and tokens into rows of the schema
+"""
+import datetime
+import functools
+import json
+import logging
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from mtgsqlive.card_lists import handle_card_list_rows
+from mtgsqlive.checkpoints import SetCheckpoints
+from mtgsqlive.coercion import RowConverter, compile_row_converter, get_column_coercions
+from mtgsqlive.price_summaries import handle_price_summary_rows
+from mtgsqlive.schema import (
+    LEGALITY_FORMATS,
+    BuildOptions,
+    build_sql_schema,
+    child_table,
+)
+from mtgsqlive.sql_writer import RowBuffer
+from mtgsqlive.update import hash_set_data
+
+LOGGER = logging.getLogger(__name__)
+
+# Input keys of each table's objects that become rows of other tables
+NESTED_KEYS: Dict[str, Tuple[str, ...]] = {
+    "sets": ("cards", "tokens", "translations"),
+    "cards": ("foreignData", "legalities", "rulings", "prices"),
+    "tokens": (),
+}
+
+# Day numbers in the compact price layouts count from here
+PRICE_EPOCH = datetime.date(1970, 1, 1)
+
+
+def sql_insert_set_items(
+    set_items: Iterator[Tuple[str, str, Any]],
+    writer: RowBuffer,
+    options: BuildOptions = BuildOptions(),
+    checkpoints: Optional[SetCheckpoints] = None,
+) -> None:
+    """
+    Queue streamed cards, tokens and set headers for insertion
+    as they are parsed
+    :param set_items: (set code, "cards"/"tokens"/"set", data) items
+    :param writer: Batched DB writer
+    :param options: Optional layouts to convert for
+    :param checkpoints: Build checkpoints, told about each finished set
+    """
+    # Checked once, so disabled debug logging costs nothing per card
+    debug = LOGGER.isEnabledFor(logging.DEBUG)
+    metrics = writer.metrics
+
+    for set_code, item_type, item_data in set_items:
+        if item_type == "cards":
+            if debug:
+                LOGGER.debug("Inserting card row for %s", item_data.get("name"))
+            metrics.start_stage("transform")
+            card_attr = handle_card_row_insertion(item_data, set_code, options)
+            sql_insert_all_card_fields(card_attr, writer)
+            metrics.end_stage()
+        elif item_type == "tokens":
+            if debug:
+                LOGGER.debug("Inserting token row for %s", item_data.get("name"))
+            metrics.start_stage("transform")
+            token_attr = handle_token_row_insertion(item_data, set_code)
+            writer.insert(token_attr, child_table("tokens", options))
+            metrics.end_stage()
+        else:
+            LOGGER.info("Inserting set row for {}".format(set_code))
+            # Cards and tokens were streamed, so there is no full set to hash
+            sql_insert_set(
+                set_code, item_data, writer, record_hash=False, options=options
+            )
+            if checkpoints:
+                checkpoints.set_finished(set_code)
+
+
+def sql_insert_set(
+    set_code: str,
+    set_data: Dict[str, Any],
+    writer: RowBuffer,
+    record_hash: bool = True,
+    options: BuildOptions = BuildOptions(),
+) -> None:
+    """
+    Given all of a set's data, queue the set, its cards, tokens
+    and translations for insertion
+    :param set_code: Set code, as it's a card element
+    :param set_data: Data to process
+    :param writer: Batched DB writer
+    :param record_hash: Store the set's content hash, if the build
+    records them (only valid if set_data holds the complete set)
+    :param options: Optional layouts to convert for
+    """
+    # Checked once, so disabled debug logging costs nothing per card
+    debug = LOGGER.isEnabledFor(logging.DEBUG)
+    writer.metrics.start_stage("transform")
+
+    set_insert_values = handle_set_row_insertion(set_data)
+    writer.insert(set_insert_values, "sets")
+
+    if record_hash and options.content_hashes:
+        writer.insert(
+            {"setCode": set_code, "contentHash": hash_set_data(set_data)},
+            "set_content_hashes",
+        )
+
+    for card in set_data.get("cards") or []:
+        if debug:
+            LOGGER.debug("Inserting card row for %s", card.get("name"))
+        card_attr: Dict[str, Any] = handle_card_row_insertion(card, set_code, options)
+        sql_insert_all_card_fields(card_attr, writer)
+
+    for token in set_data.get("tokens") or []:
+        if debug:
+            LOGGER.debug("Inserting token row for %s", token.get("name"))
+        token_attr = handle_token_row_insertion(token, set_code)
+        writer.insert(token_attr, child_table("tokens", options))
+
+    for language, translation in (set_data.get("translations") or {}).items():
+        if debug:
+            LOGGER.debug("Inserting set_translation row for %s", language)
+        set_translation_attr = handle_set_translation_row_insertion(
+            language, translation, set_code
+        )
+        writer.insert(set_translation_attr, "set_translations")
+
+    writer.metrics.end_stage()
+
+
+def sql_insert_all_card_fields(
+    card_attributes: Dict[str, Any], writer: RowBuffer
+) -> None:
+    """
+    Given all of the card's data, insert the data into the
+    appropriate SQLite tables.
+    :param card_attributes: Card row and child rows, keyed by table,
+    card row first
+    :param writer: Batched DB writer
+    """
+    (card_table, card_row), *child_rows = card_attributes.items()
+    writer.insert(card_row, card_table)
+    for table, rows in child_rows:
+        writer.insert_many(rows, table)
+
+
+@functools.lru_cache(maxsize=None)
+def get_row_converter(table: str) -> RowConverter:
+    """
+    Compile a table's row converter from its columns. Done once per
+    process, against a scratch copy of the schema, so worker processes
+    without a database get the same converters.
+    :param table: sets, cards or tokens
+    :return: Row converter
+    """
+    schema_connection = sqlite3.connect(":memory:")
+    build_sql_schema(schema_connection)
+    coercions = get_column_coercions(schema_connection, table)
+    schema_connection.close()
+    return compile_row_converter(table, coercions, NESTED_KEYS[table])
+
+
+def handle_set_row_insertion(set_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    This method will take the set data and convert it, preparing
+    for SQLite insertion
+    :param set_data: Data to process
+    :return: Dictionary ready for insertion
+    """
+    return get_row_converter("sets")(set_data, {})
+
+
+def handle_foreign_rows(
+    card_data: Dict[str, Any], card_uuid: str
+) -> List[Dict[str, Any]]:
+    """
+    This method will take the card data and convert it, preparing
+    for SQLite insertion
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :return: List of dicts ready for insertion
+    """
+
+    foreign_entries = []
+    for entry in card_data["foreignData"]:
+        foreign_entries.append(
+            {
+                "uuid": card_uuid,
+                "flavorText": entry.get("flavorText", ""),
+                "language": entry.get("language", ""),
+                "multiverseId": entry.get("multiverseId", ""),
+                "name": entry.get("name", ""),
+                "text": entry.get("text", ""),
+                "type": entry.get("type", ""),
+            }
+        )
+
+    return foreign_entries
+
+
+def handle_legal_rows(
+    card_data: Dict[str, Any], card_uuid: str
+) -> List[Dict[str, Any]]:
+    """
+    This method will take the card data and convert it, preparing
+    for SQLite insertion
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :return: List of dicts, ready for insertion
+    """
+    legalities = []
+    for card_format, format_status in card_data["legalities"].items():
+        legalities.append(
+            {"uuid": card_uuid, "format": card_format, "status": format_status}
+        )
+
+    return legalities
+
+
+def handle_wide_legal_rows(
+    legal_rows: List[Dict[str, Any]], card_uuid: str
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Fold a card's legality rows into a single legalities_wide row
+    :param legal_rows: Rows from handle_legal_rows
+    :param card_uuid: UUID to be used as a key
+    :return: The wide row (as a list), and the rows for formats
+    that have no column of their own
+    """
+    wide_row: Dict[str, Any] = dict.fromkeys(LEGALITY_FORMATS)
+    other_rows: List[Dict[str, Any]] = []
+    for legal_row in legal_rows:
+        if legal_row["format"] in wide_row:
+            wide_row[legal_row["format"]] = legal_row["status"]
+        else:
+            other_rows.append(legal_row)
+
+    wide_row["uuid"] = card_uuid
+    return [wide_row], other_rows
+
+
+def handle_ruling_rows(
+    card_data: Dict[str, Any], card_uuid: str
+) -> List[Dict[str, Any]]:
+    """
+    This method will take the card data and convert it, preparing
+    for SQLite insertion
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :return: List of dicts, ready for insertion
+    """
+    rulings = []
+    for rule in card_data["rulings"]:
+        rulings.append(
+            {
+                "uuid": card_uuid,
+                "date": rule.get("date", ""),
+                "text": rule.get("text", ""),
+            }
+        )
+    return rulings
+
+
+def handle_price_rows(
+    card_data: Dict[str, Any], card_uuid: str
+) -> List[Dict[str, Any]]:
+    """
+    This method will take the card data and convert it, preparing
+    for SQLite insertion
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :return: List of dicts, ready for insertion
+    """
+    prices = []
+    for type in card_data["prices"]:
+        for date, price in card_data["prices"][type].items():
+            prices.append(
+                {"uuid": card_uuid, "type": type, "price": price, "date": date}
+            )
+
+    return prices
+
+
+def handle_price_point_rows(
+    card_data: Dict[str, Any], card_uuid: str
+) -> List[Dict[str, Any]]:
+    """
+    This method will take the card data and convert it, preparing
+    for SQLite insertion in the compact price layout. The writer
+    swaps uuid and type for their integer ids.
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :return: List of dicts, ready for insertion
+    """
+    price_points = []
+    for price_type, series in card_data["prices"].items():
+        for date, price in series.items():
+            price_points.append(
+                {
+                    "uuid": card_uuid,
+                    "type": price_type,
+                    "day": date_to_day_number(date),
+                    "price": price,
+                }
+            )
+
+    return price_points
+
+
+def handle_price_series_rows(
+    card_data: Dict[str, Any], card_uuid: str
+) -> List[Dict[str, Any]]:
+    """
+    This method will take the card data and convert it, preparing
+    for SQLite insertion in the packed price layout: one row per
+    price type, holding the whole series
+    :param card_data: Data to process
+    :param card_uuid: UUID to be used as a key
+    :return: List of dicts, ready for insertion
+    """
+    price_series = []
+    for price_type, series in card_data["prices"].items():
+        if not series:
+            continue
+        packed_series = {
+            date_to_day_number(date): price for date, price in sorted(series.items())
+        }
+        price_series.append(
+            {
+                "uuid": card_uuid,
+                "type": price_type,
+                "series": json.dumps(packed_series, separators=(",", ":")),
+            }
+        )
+
+    return price_series
+
+
+@functools.lru_cache(maxsize=None)
+def date_to_day_number(date: str) -> int:
+    """
+    Dates repeat across every card, so conversions are cached
+    :param date: ISO date (YYYY-MM-DD)
+    :return: Days since PRICE_EPOCH
+    """
+    year, month, day = date.split("-")
+    return (datetime.date(int(year), int(month), int(day)) - PRICE_EPOCH).days
+
+
+def handle_set_translation_row_insertion(
+    language: str, translation: str, set_name: str
+) -> Dict[str, Any]:
+    """
+    This method will take the set translation data and convert it, preparing
+    for SQLite insertion
+    :param language: The language of the set translation
+    :param translation: The set name translated in to the given language
+    :param set_name: Set name, as it's a card element
+    :return: Dictionary ready for insertion
+    """
+    set_translation_insert_values: Dict[str, Any] = {
+        "language": language,
+        "translation": translation,
+        "setCode": set_name,
+    }
+
+    return set_translation_insert_values
+
+
+def handle_token_row_insertion(
+    token_data: Dict[str, Any], set_name: str
+) -> Dict[str, Any]:
+    """
+    This method will take the token data and convert it, preparing
+    for SQLite insertion
+    :param token_data: Data to process
+    :param set_name: Set name, as it's a card element
+    :return: Dictionary ready for insertion
+    """
+    return get_row_converter("tokens")(token_data, {"setCode": set_name})
+
+
+def handle_card_row_insertion(
+    card_data: Dict[str, Any],
+    set_name: str,
+    options: BuildOptions = BuildOptions(),
+) -> Dict[str, Any]:
+    """
+    This method will take the card data and convert it, preparing
+    for SQLite insertion
+    :param card_data: Data to process
+    :param set_name: Set name, as it's a card element
+    :param options: Optional layouts to convert for
+    :return: Card row and child rows, keyed by table
+    """
+    # ORDERING MATTERS HERE
+    card_skip_keys = ["foreignData", "legalities", "rulings", "prices"]
+
+    card_insert_values = get_row_converter("cards")(card_data, {"setCode": set_name})
+
+    foreign_insert_values: List[Dict[str, Any]] = []
+    if card_skip_keys[0] in card_data.keys():
+        foreign_insert_values = handle_foreign_rows(card_data, card_data["uuid"])
+
+    legal_insert_values: List[Dict[str, Any]] = []
+    wide_legal_insert_values: List[Dict[str, Any]] = []
+    if card_skip_keys[1] in card_data.keys():
+        legal_insert_values = handle_legal_rows(card_data, card_data["uuid"])
+        if options.legality_layout == "wide":
+            wide_legal_insert_values, legal_insert_values = handle_wide_legal_rows(
+                legal_insert_values, card_data["uuid"]
+            )
+
+    ruling_insert_values: List[Dict[str, Any]] = []
+    if card_skip_keys[2] in card_data.keys():
+        ruling_insert_values = handle_ruling_rows(card_data, card_data["uuid"])
+
+    price_table = PRICE_TABLES[options.price_layout]
+    price_insert_values: List[Dict[str, Any]] = []
+    price_summary_insert_values: List[Dict[str, Any]] = []
+    if card_skip_keys[3] in card_data.keys():
+        price_insert_values = PRICE_ROW_HANDLERS[options.price_layout](
+            card_data, card_data["uuid"]
+        )
+        if options.price_windows:
+            price_summary_insert_values = handle_price_summary_rows(
+                card_data, card_data["uuid"], options.price_windows
+            )
+
+    # The card row goes first, as its child rows refer to it
+    card_rows = {
+        child_table("cards", options): card_insert_values,
+        child_table("foreignData", options): foreign_insert_values,
+        child_table("legalities", options): legal_insert_values,
+        child_table("rulings", options): ruling_insert_values,
+        child_table(price_table, options): price_insert_values,
+    }
+    if options.legality_layout == "wide":
+        card_rows["legalities_wide"] = wide_legal_insert_values
+    if options.price_windows:
+        card_rows[
+            child_table("price_summaries", options)
+        ] = price_summary_insert_values
+    if options.card_lists:
+        card_rows.update(handle_card_list_rows(card_data, card_data["uuid"]))
+
+    return card_rows
+
+
+# Table and row handler for each --prices layout
+PRICE_TABLES: Dict[str, str] = {
+    "rows": "prices",
+    "compact": "price_points",
+    "packed": "price_series",
+}
+PRICE_ROW_HANDLERS = {
+    "rows": handle_price_rows,
+    "compact": handle_price_point_rows,
+    "packed": handle_price_series_rows,
+}
+
+
+def modify_for_sql_insert(data: Any) -> Optional[Union[str, int, float]]:
+    """
+    Arrays and booleans can't be inserted, so we need to stringify.
+    Generic fallback; the row handlers use converters compiled per
+    table (get_row_converter) instead.
+    :param data: Data to modify
+    :return: string value
+    """
+    # bool is a subclass of int, so it has to be checked first
+    if isinstance(data, bool):
+        return int(data)
+
+    if isinstance(data, (str, int, float)):
+        return data
+
+    # If the value is empty/null, mark it in SQL as such
+    if not data:
+        return None
+
+    if isinstance(data, list) and data and isinstance(data[0], str):
+        return ", ".join(data)
+
+    if isinstance(data, (dict, list)):
+        return json.dumps(data, ensure_ascii=False)
+
+    return ""
+
+
+def sql_dict_insert(
+    data: Dict[str, Any], table: str, sql_connection: sqlite3.Connection
+) -> None:
+    """
+    Insert a dictionary into a sqlite table
+    :param data: Dict to insert
+    :param table: Table to insert to
+    :param sql_connection: SQL connection
+    """
+    cursor = sql_connection.cursor()
+    columns = ", ".join(data.keys())
+    placeholders = ":" + ", :".join(data.keys())
+    query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+    cursor.execute(query, data)
@@ -0,0 +1,460 @@
+"""
+Incremental update of an existing MTGSQLive database
+"""
+import collections
+import hashlib
+import json
+import logging
+import pathlib
+import sqlite3
+from typing import Any, Callable, DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+from mtgsqlive.coded_columns import (
+    CodedColumn,
+    decode_expression,
+    encode_expression,
+    get_coded_columns,
+    interned_lookup_tables,
+    lookup_key,
+)
+from mtgsqlive.json_stream import (
+    find_set_files,
+    iter_sets,
+    load_json_file,
+    open_json_file,
+    strip_json_suffix,
+)
+from mtgsqlive.oracle import ORACLE_TABLE
+from mtgsqlive.shards import get_table_columns
+from mtgsqlive.sql_writer import RowBuffer, SqlBatchWriter
+
+LOGGER = logging.getLogger(__name__)
+
+# Converts one set's JSON into rows (transforms.sql_insert_set)
+SetConverter = Callable[[str, Dict[str, Any], RowBuffer], None]
+
+# WHERE clause selecting the rows of one set, per table
+SET_SCOPES: Dict[str, str] = {
+    "sets": "code = :set_code",
+    "cards": "setCode = :set_code",
+    "tokens": "setCode = :set_code",
+    "set_translations": "setCode = :set_code",
+    "cards_interned": "setCodeId = (SELECT id FROM set_codes WHERE name = :set_code)",
+    "tokens_interned": "setCodeId = (SELECT id FROM set_codes WHERE name = :set_code)",
+}
+
+# Other tables hold card child rows, scoped by the column referencing
+# the card, through the set's rows in the cards table ({card_table})
+CARD_CHILD_SCOPES: Dict[str, str] = {
+    "uuid": "uuid IN (SELECT uuid FROM `{card_table}` WHERE {card_scope})",
+    "cardId": "cardId IN (SELECT id FROM `{card_table}` WHERE {card_scope})",
+}
+
+# Tables whose rows are updated in place, matched on a natural key
+NATURAL_KEYS: Dict[str, str] = {
+    "sets": "code",
+    "cards": "uuid",
+    "tokens": "uuid",
+    "cards_interned": "uuid",
+    "tokens_interned": "uuid",
+}
+
+# Bookkeeping tables that are not diffed
+METADATA_TABLES = ("set_content_hashes",)
+
+# Tables derived from the others, rebuilt once the update is applied
+DERIVED_TABLES = (ORACLE_TABLE,)
+
+# (deletes, updates, inserts) planned for one table
+TableDelta = Tuple[List[Tuple[int]], List[Tuple[Any, ...]], List[Tuple[Any, ...]]]
+
+
+def get_set_scope(
+    table: str, columns: List[str], card_table: str = "cards"
+) -> Optional[str]:
+    """
+    :param table: Table name
+    :param columns: Its columns
+    :param card_table: Table holding the cards (cards or cards_interned)
+    :return: WHERE clause selecting one set's rows, if the table has one
+    """
+    if table in SET_SCOPES:
+        return SET_SCOPES[table]
+    for card_column, scope in CARD_CHILD_SCOPES.items():
+        if card_column in columns:
+            return scope.format(
+                card_table=card_table, card_scope=SET_SCOPES[card_table]
+            )
+    return None
+
+
+def hash_set_data(set_data: Dict[str, Any]) -> str:
+    """
+    Hash a set's JSON content, independent of key order
+    and formatting of the input file
+    :param set_data: Decoded set
+    :return: Hex digest
+    """
+    canonical = json.dumps(
+        set_data, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf8")).hexdigest()
+
+
+def build_metadata_schema(sql_connection: sqlite3.Connection) -> None:
+    """
+    Create the table holding each set's content hash
+    :param sql_connection: Connection to the database
+    """
+    sql_connection.execute(
+        "CREATE TABLE IF NOT EXISTS `set_content_hashes` ("
+        "setCode TEXT PRIMARY KEY,"
+        "contentHash TEXT NOT NULL"
+        ")"
+    )
+
+
+def update_database(
+    input_file: pathlib.Path,
+    sql_connection: sqlite3.Connection,
+    convert_set: SetConverter,
+) -> None:
+    """
+    Bring an existing database in line with the input. Sets whose
+    content hash is unchanged are skipped; for the others only the
+    rows that differ are deleted, updated or inserted. Sets missing
+    from the input are removed.
+    :param input_file: AllSets.json file or AllSetFiles directory
+    :param sql_connection: Existing database
+    :param convert_set: Set to rows converter
+    """
+    build_metadata_schema(sql_connection)
+    coded_columns = get_coded_columns(sql_connection)
+    interned_tables = interned_lookup_tables(coded_columns)
+    table_columns = {
+        table: columns
+        for table, columns in get_table_columns(sql_connection).items()
+        if table not in METADATA_TABLES
+        and table not in DERIVED_TABLES
+        and table not in interned_tables
+    }
+    card_table = "cards_interned" if "cards_interned" in table_columns else "cards"
+    set_scopes = {
+        table: get_set_scope(table, columns, card_table)
+        for table, columns in table_columns.items()
+    }
+    unscoped = [table for table, scope in set_scopes.items() if scope is None]
+    if unscoped:
+        raise ValueError(
+            "Tables {} cannot be updated incrementally".format(", ".join(unscoped))
+        )
+
+    stored_hashes: Dict[str, str] = dict(
+        sql_connection.execute("SELECT setCode, contentHash FROM set_content_hashes")
+    )
+    stored_sets = {code for (code,) in sql_connection.execute("SELECT code FROM sets")}
+
+    # Incoming sets are converted in a scratch database with the same schema,
+    # so their values get the same type affinity as the stored rows
+    delta_connection = sqlite3.connect(":memory:")
+    for table in get_table_columns(sql_connection):
+        (table_sql,) = sql_connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table,),
+        ).fetchone()
+        delta_connection.execute(table_sql)
+
+    # Every set is planned before any is applied: a card moving to a set
+    # that comes earlier must be deleted from its old set before it is
+    # inserted into the new one
+    set_deltas: Dict[str, Dict[str, TableDelta]] = {}
+    new_hashes: Dict[str, str] = {}
+    seen_sets = set()
+    skipped_count = 0
+    for set_code, set_data in iter_input_sets(input_file):
+        seen_sets.add(set_code)
+        content_hash = hash_set_data(set_data)
+        if stored_hashes.get(set_code) == content_hash:
+            skipped_count += 1
+            continue
+
+        delta_writer = SqlBatchWriter(delta_connection)
+        convert_set(set_code, set_data, delta_writer)
+        delta_writer.flush()
+
+        sync_interned_values(sql_connection, delta_connection, interned_tables)
+        set_deltas[set_code] = plan_set_delta(
+            sql_connection,
+            delta_connection,
+            set_code,
+            table_columns,
+            coded_columns,
+            set_scopes,
+        )
+        new_hashes[set_code] = content_hash
+
+        for table in table_columns.keys() | set(METADATA_TABLES):
+            delta_connection.execute(f"DELETE FROM `{table}`")
+
+    for set_code in sorted(stored_sets - seen_sets):
+        set_deltas[set_code] = plan_set_delta(
+            sql_connection,
+            delta_connection,
+            set_code,
+            table_columns,
+            coded_columns,
+            set_scopes,
+        )
+
+    apply_set_deltas(sql_connection, set_deltas, table_columns, coded_columns)
+    sql_connection.executemany(
+        "INSERT OR REPLACE INTO set_content_hashes (setCode, contentHash) "
+        "VALUES (?, ?)",
+        new_hashes.items(),
+    )
+    sql_connection.executemany(
+        "DELETE FROM set_content_hashes WHERE setCode = ?",
+        [(set_code,) for set_code in sorted(stored_sets - seen_sets)],
+    )
+
+    prune_interned_values(sql_connection, coded_columns, interned_tables)
+    sql_connection.commit()
+    delta_connection.close()
+    LOGGER.info(
+        f"Update finished: {skipped_count} sets unchanged, "
+        f"{len(seen_sets) - skipped_count} updated or added, "
+        f"{len(stored_sets - seen_sets)} removed"
+    )
+
+
+def iter_input_sets(input_file: pathlib.Path) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield the sets of an input, one at a time
+    :param input_file: AllSets.json file or AllSetFiles directory
+    :return: Iterator of (set code, set data)
+    """
+    if input_file.is_dir():
+        for set_file in find_set_files(input_file):
+            yield strip_json_suffix(set_file), load_json_file(set_file)
+        return
+
+    with open_json_file(input_file) as json_file:
+        yield from iter_sets(json_file)
+
+
+def sync_interned_values(
+    sql_connection: sqlite3.Connection,
+    delta_connection: sqlite3.Connection,
+    interned_tables: List[str],
+) -> None:
+    """
+    Add values interned while converting a set to the database's
+    lookup tables. Values no longer used are removed once every set
+    is updated (prune_interned_values).
+    :param sql_connection: Database being updated
+    :param delta_connection: Scratch database holding the set's new rows
+    :param interned_tables: Interned lookup tables
+    """
+    for lookup_table in interned_tables:
+        key = lookup_key(lookup_table)
+        sql_connection.executemany(
+            f"INSERT OR IGNORE INTO `{lookup_table}` (`{key}`) VALUES (?)",
+            delta_connection.execute(f"SELECT `{key}` FROM `{lookup_table}`"),
+        )
+
+
+def prune_interned_values(
+    sql_connection: sqlite3.Connection,
+    coded_columns: Dict[str, List[CodedColumn]],
+    interned_tables: List[str],
+) -> None:
+    """
+    Delete the lookup values no row refers to any more, which a fresh
+    build of the same input wouldn't have
+    :param sql_connection: Updated database
+    :param coded_columns: Coded columns per table
+    :param interned_tables: Interned lookup tables
+    """
+    references: DefaultDict[str, List[str]] = collections.defaultdict(list)
+    for table, coded_list in coded_columns.items():
+        for coded in coded_list:
+            references[coded.lookup_table].append(
+                f"SELECT `{coded.target}` FROM `{table}` "
+                f"WHERE `{coded.target}` IS NOT NULL"
+            )
+
+    for lookup_table in interned_tables:
+        cursor = sql_connection.execute(
+            f"DELETE FROM `{lookup_table}` WHERE id NOT IN "
+            f"({' UNION ALL '.join(references[lookup_table])})"
+        )
+        if cursor.rowcount:
+            LOGGER.info(f"Removed {cursor.rowcount} unused values of {lookup_table}")
+
+
+def get_value_list(
+    table: str, columns: List[str], coded_columns: Dict[str, List[CodedColumn]]
+) -> List[str]:
+    """
+    :param table: Table name
+    :param columns: Its compared columns
+    :param coded_columns: Coded columns per table
+    :return: SQL expression of each column's value, coded columns
+    encoding theirs into ids
+    """
+    value_list = ["?"] * len(columns)
+    for coded in coded_columns.get(table, []):
+        value_list[columns.index(coded.target)] = encode_expression(coded, "?")
+    return value_list
+
+
+def plan_set_delta(
+    sql_connection: sqlite3.Connection,
+    delta_connection: sqlite3.Connection,
+    set_code: str,
+    table_columns: Dict[str, List[str]],
+    coded_columns: Dict[str, List[CodedColumn]],
+    set_scopes: Dict[str, Optional[str]],
+) -> Dict[str, TableDelta]:
+    """
+    Plan the changes making one set's rows in the database match the
+    converted rows. Coded columns are compared on their values, not
+    their ids, which differ between the two databases.
+    :param sql_connection: Database being updated
+    :param delta_connection: Scratch database holding the set's new rows
+    :param set_code: Set to update
+    :param table_columns: Compared columns per table
+    :param coded_columns: Coded columns per table
+    :param set_scopes: WHERE clause selecting the set's rows, per table
+    :return: Changes per table
+    """
+    parameters = {"set_code": set_code}
+
+    # Every table is planned before any is changed, as the child
+    # table scopes go through the set's current cards
+    deltas: Dict[str, TableDelta] = {}
+    for table, columns in table_columns.items():
+        select_list = [f"t.`{column}`" for column in columns]
+        for coded in coded_columns.get(table, []):
+            position = columns.index(coded.target)
+            select_list[position] = decode_expression(coded, select_list[position])
+
+        query = f"SELECT {{}} FROM `{table}` AS t WHERE {set_scopes[table]}"
+        new_rows = delta_connection.execute(
+            query.format(", ".join(select_list)), parameters
+        ).fetchall()
+        old_rows = sql_connection.execute(
+            query.format(", ".join(["t.rowid"] + select_list)), parameters
+        ).fetchall()
+
+        if table in NATURAL_KEYS:
+            deltas[table] = diff_keyed_rows(
+                old_rows, new_rows, columns.index(NATURAL_KEYS[table])
+            )
+        else:
+            deltas[table] = diff_unkeyed_rows(old_rows, new_rows)
+
+    change_counts = [0, 0, 0]
+    for delta in deltas.values():
+        for change, rows in enumerate(delta):
+            change_counts[change] += len(rows)
+    LOGGER.info(
+        "Planned set {}: {} rows deleted, {} updated, {} inserted".format(
+            set_code, *change_counts
+        )
+    )
+    return deltas
+
+
+def apply_set_deltas(
+    sql_connection: sqlite3.Connection,
+    set_deltas: Dict[str, Dict[str, TableDelta]],
+    table_columns: Dict[str, List[str]],
+    coded_columns: Dict[str, List[CodedColumn]],
+) -> None:
+    """
+    Apply the planned changes of every set: all deletes first, so
+    natural keys moving between sets are free again, then the updates
+    and inserts table by table, so cards exist before the rows
+    referencing them are encoded
+    :param sql_connection: Database being updated
+    :param set_deltas: Changes per table, per set
+    :param table_columns: Compared columns per table
+    :param coded_columns: Coded columns per table
+    """
+    for table in table_columns:
+        for deltas in set_deltas.values():
+            sql_connection.executemany(
+                f"DELETE FROM `{table}` WHERE rowid = ?", deltas[table][0]
+            )
+
+    for table, columns in table_columns.items():
+        value_list = get_value_list(table, columns, coded_columns)
+        assignments = ", ".join(
+            f"`{column}` = {value}" for column, value in zip(columns, value_list)
+        )
+        column_list = ", ".join(f"`{column}`" for column in columns)
+        for deltas in set_deltas.values():
+            _, updates, inserts = deltas[table]
+            sql_connection.executemany(
+                f"UPDATE `{table}` SET {assignments} WHERE rowid = ?", updates
+            )
+            sql_connection.executemany(
+                f"INSERT INTO `{table}` ({column_list}) "
+                f"VALUES ({', '.join(value_list)})",
+                inserts,
+            )
+
+
+def diff_keyed_rows(
+    old_rows: List[Tuple[Any, ...]], new_rows: List[Tuple[Any, ...]], key_index: int
+) -> TableDelta:
+    """
+    Pair old and new rows on their natural key. Changed rows are
+    updated in place so their ids stay stable.
+    :param old_rows: (rowid, values...) rows in the database
+    :param new_rows: (values...) converted rows
+    :param key_index: Position of the natural key in the values
+    :return: Rowids to delete, (values..., rowid) to update, values to insert
+    """
+    old_by_key = {row[key_index + 1]: row for row in old_rows}
+    updates: List[Tuple[Any, ...]] = []
+    inserts: List[Tuple[Any, ...]] = []
+
+    for new_row in new_rows:
+        old_row = old_by_key.pop(new_row[key_index], None)
+        if old_row is None:
+            inserts.append(new_row)
+        elif old_row[1:] != new_row:
+            updates.append(new_row + (old_row[0],))
+
+    deletes = [(old_row[0],) for old_row in old_by_key.values()]
+    return deletes, updates, inserts
+
+
+def diff_unkeyed_rows(
+    old_rows: List[Tuple[Any, ...]], new_rows: List[Tuple[Any, ...]]
+) -> TableDelta:
+    """
+    Compare rows without a natural key as multisets; identical
+    rows are kept, the rest is deleted or inserted
+    :param old_rows: (rowid, values...) rows in the database
+    :param new_rows: (values...) converted rows
+    :return: Rowids to delete, no updates, values to insert
+    """
+    old_rowids: DefaultDict[Tuple[Any, ...], List[int]] = collections.defaultdict(
+        list
+    )
+    for old_row in old_rows:
+        old_rowids[old_row[1:]].append(old_row[0])
+
+    inserts: List[Tuple[Any, ...]] = []
+    for new_row in new_rows:
+        rowids = old_rowids.get(new_row)
+        if rowids:
+            rowids.pop()
+        else:
+            inserts.append(new_row)
+
+    deletes = [(rowid,) for rowids in old_rowids.values() for rowid in rowids]
+    return deletes, [], inserts
@@ -0,0 +1,135 @@
+"""
+Shared fixtures: a small generated corpus, in-process builds, and
+the logical contents of a database to compare builds with
+"""
+import collections
+import json
+import pathlib
+import sqlite3
+import sys
+from typing import Any, Callable, Counter, Dict, NamedTuple, Tuple
+
+import pytest
+
+from mtgsqlive import json2sql
+from mtgsqlive.checkpoints import BUILD_PROGRESS_TABLE
+from mtgsqlive.coded_columns import decode_expression, get_coded_columns
+from mtgsqlive.corpus import CorpusScale, write_corpus
+
+# A few sets, small enough to build in well under a second
+FIXTURE_SCALE = CorpusScale(sets=5, cards_per_set=12, price_dates=4, languages=2)
+
+# Bookkeeping of a build, not part of its contents
+BOOKKEEPING_TABLES: Tuple[str, ...] = ("set_content_hashes", BUILD_PROGRESS_TABLE)
+
+Builder = Callable[..., pathlib.Path]
+ContentReader = Callable[[pathlib.Path], Dict[str, Counter[Tuple[Any, ...]]]]
+
+
+class Corpus(NamedTuple):
+    """
+    Fixture input, as AllSets.json and as an AllSetFiles directory
+    """
+
+    all_sets_file: pathlib.Path
+    set_files_dir: pathlib.Path
+    all_sets: Dict[str, Dict[str, Any]]
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory: pytest.TempPathFactory) -> Corpus:
+    """
+    :param tmp_path_factory: pytest temporary directories
+    :return: The fixture corpus, written once per session
+    """
+    all_sets_file, set_files_dir = write_corpus(
+        tmp_path_factory.mktemp("corpus"), FIXTURE_SCALE
+    )
+    with all_sets_file.open(encoding="utf8") as json_file:
+        all_sets = json.load(json_file)
+    return Corpus(all_sets_file, set_files_dir, all_sets)
+
+
+def write_input(
+    all_sets: Dict[str, Dict[str, Any]], output_file: pathlib.Path
+) -> pathlib.Path:
+    """
+    :param all_sets: Sets, i.e. a changed copy of the fixture corpus
+    :param output_file: AllSets.json file to write
+    :return: The file
+    """
+    with output_file.open("w", encoding="utf8") as json_file:
+        json.dump(all_sets, json_file, ensure_ascii=False)
+    return output_file
+
+
+@pytest.fixture
+def build(monkeypatch: pytest.MonkeyPatch) -> Builder:
+    """
+    :param monkeypatch: pytest monkeypatch
+    :return: Function running the command line build in this process
+    """
+
+    def run_build(
+        input_file: pathlib.Path, output_file: pathlib.Path, *flags: str
+    ) -> pathlib.Path:
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            ["mtgsqlive", "-i", str(input_file), "-o", str(output_file), *flags],
+        )
+        json2sql.main()
+        return output_file
+
+    return run_build
+
+
+@pytest.fixture
+def contents() -> ContentReader:
+    """
+    :return: Function reading the logical contents of a database
+    """
+    return read_contents
+
+
+def read_contents(db_file: pathlib.Path) -> Dict[str, Counter[Tuple[Any, ...]]]:
+    """
+    Read every table and view as a multiset of rows. Surrogate ids are
+    left out and coded columns are decoded to their values, so builds
+    that numbered their rows differently compare equal. Views carry
+    the coded columns of their tables under the same names.
+    :param db_file: Database file
+    :return: Rows per table and view
+    """
+    sql_connection = sqlite3.connect(str(db_file))
+    coded_columns = get_coded_columns(sql_connection)
+    objects = sql_connection.execute(
+        "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') "
+        "AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    view_coded = {
+        column.target: column
+        for table_columns in coded_columns.values()
+        for column in table_columns
+    }
+
+    tables: Dict[str, Counter[Tuple[Any, ...]]] = {}
+    for name, object_type in objects:
+        if name in BOOKKEEPING_TABLES:
+            continue
+        if object_type == "view":
+            coded = view_coded
+        else:
+            coded = {column.target: column for column in coded_columns.get(name, [])}
+        select_list = [
+            decode_expression(coded[column], f"`{column}`")
+            if column in coded
+            else f"`{column}`"
+            for _, column, *_ in sql_connection.execute(f"PRAGMA table_info(`{name}`)")
+            if column != "id"
+        ]
+        tables[name] = collections.Counter(
+            sql_connection.execute(f"SELECT {', '.join(select_list)} FROM `{name}`")
+        )
+    sql_connection.close()
+    return tables
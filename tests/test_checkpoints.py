@@ -0,0 +1,154 @@
+"""
+--resume finishes an interrupted build into the same contents as an
+uninterrupted one
+"""
+import gc
+import pathlib
+import sqlite3
+from typing import Any, List
+
+import pytest
+
+from conftest import Builder, ContentReader, Corpus
+from mtgsqlive import json2sql
+from mtgsqlive.checkpoints import SetCheckpoints, get_finished_sets
+
+MODES = [[], ["--stream", "set"], ["--stream", "card"]]
+
+
+class BuildInterrupted(Exception):
+    """
+    Stands in for a crash or a killed build
+    """
+
+
+def interrupt_after(monkeypatch: pytest.MonkeyPatch, set_count: int) -> None:
+    """
+    Have builds fail as they finish the set after the first ones
+    :param monkeypatch: pytest monkeypatch
+    :param set_count: Sets to finish before failing
+    """
+    set_finished = SetCheckpoints.set_finished
+    finished: List[str] = []
+
+    def failing_set_finished(checkpoints: SetCheckpoints, set_code: str) -> None:
+        if len(finished) == set_count:
+            raise BuildInterrupted(set_code)
+        finished.append(set_code)
+        set_finished(checkpoints, set_code)
+
+    monkeypatch.setattr(SetCheckpoints, "set_finished", failing_set_finished)
+
+
+def fail_build(*_: Any) -> None:
+    """
+    Stands in for a step of the build that fails
+    """
+    raise BuildInterrupted()
+
+
+def build_interrupted(
+    build: Builder, input_file: pathlib.Path, output_file: pathlib.Path, *flags: str
+) -> None:
+    """
+    Run a build that fails after two sets, committing after every set
+    :param build: In-process build
+    :param input_file: Input of the build
+    :param output_file: Output of the build
+    :param flags: Further command line flags
+    """
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        interrupt_after(monkeypatch, 2)
+        try:
+            build(input_file, output_file, "--checkpoint-rows", "0", *flags)
+        except BuildInterrupted:
+            pass
+        else:
+            pytest.fail("Build wasn't interrupted")
+    # Close the failed build's connection, rolling back its open transaction
+    gc.collect()
+
+
+@pytest.mark.parametrize("mode", MODES, ids=lambda mode: " ".join(mode) or "load")
+def test_resume_matches_fresh_build(
+    corpus: Corpus,
+    build: Builder,
+    contents: ContentReader,
+    tmp_path: pathlib.Path,
+    mode: List[str],
+) -> None:
+    resumed = tmp_path.joinpath("resumed.sqlite")
+    build_interrupted(build, corpus.all_sets_file, resumed, *mode)
+
+    sql_connection = sqlite3.connect(str(resumed))
+    finished_sets = get_finished_sets(sql_connection)
+    sql_connection.close()
+    assert finished_sets == set(list(corpus.all_sets)[:2])
+
+    build(corpus.all_sets_file, resumed, "--resume", *mode)
+    fresh = build(corpus.all_sets_file, tmp_path.joinpath("fresh.sqlite"))
+
+    resumed_contents = contents(resumed)
+    fresh_contents = contents(fresh)
+    assert resumed_contents.keys() == fresh_contents.keys()
+    for table, rows in fresh_contents.items():
+        assert resumed_contents[table] == rows, table
+
+
+def test_resume_set_files(
+    corpus: Corpus, build: Builder, contents: ContentReader, tmp_path: pathlib.Path
+) -> None:
+    resumed = tmp_path.joinpath("resumed.sqlite")
+    build_interrupted(build, corpus.set_files_dir, resumed, "--interned")
+
+    build(corpus.set_files_dir, resumed, "--resume")
+    fresh = build(corpus.all_sets_file, tmp_path.joinpath("fresh.sqlite"), "--interned")
+
+    assert contents(resumed) == contents(fresh)
+
+
+def test_resume_needs_unfinished_build(
+    corpus: Corpus, build: Builder, tmp_path: pathlib.Path
+) -> None:
+    finished = build(corpus.all_sets_file, tmp_path.joinpath("out.sqlite"))
+
+    with pytest.raises(SystemExit):
+        build(corpus.all_sets_file, finished, "--resume")
+
+
+def test_resume_after_the_final_set(
+    corpus: Corpus, build: Builder, contents: ContentReader, tmp_path: pathlib.Path
+) -> None:
+    resumed = tmp_path.joinpath("resumed.sqlite")
+    with pytest.MonkeyPatch.context() as interrupt:
+        # Every set is committed, the build fails while indexing
+        interrupt.setattr(json2sql, "create_indexes", fail_build)
+        with pytest.raises(BuildInterrupted):
+            build(corpus.all_sets_file, resumed, "--checkpoint-rows", "0")
+    gc.collect()
+
+    sql_connection = sqlite3.connect(str(resumed))
+    assert get_finished_sets(sql_connection) == set(corpus.all_sets)
+    sql_connection.close()
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # Nothing is left to convert
+        interrupt_after(monkeypatch, 0)
+        build(corpus.all_sets_file, resumed, "--resume")
+    fresh = build(corpus.all_sets_file, tmp_path.joinpath("fresh.sqlite"))
+    assert contents(resumed) == contents(fresh)
+
+    sql_connection = sqlite3.connect(str(resumed))
+    assert get_finished_sets(sql_connection) is None
+    sql_connection.close()
+
+
+def test_resume_with_workers(
+    corpus: Corpus, build: Builder, contents: ContentReader, tmp_path: pathlib.Path
+) -> None:
+    resumed = tmp_path.joinpath("resumed.sqlite")
+    build_interrupted(build, corpus.set_files_dir, resumed, "--jobs", "2")
+
+    build(corpus.set_files_dir, resumed, "--resume", "--jobs", "2")
+    fresh = build(corpus.all_sets_file, tmp_path.joinpath("fresh.sqlite"))
+    assert contents(resumed) == contents(fresh)
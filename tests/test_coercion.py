@@ -0,0 +1,124 @@
+"""
+Row converters compiled from a table's columns
+"""
+import logging
+import sqlite3
+from typing import Any, Dict
+
+import pytest
+
+from conftest import Corpus
+from mtgsqlive.coercion import (
+    compile_row_converter,
+    get_column_coercions,
+    int_flag,
+    join_list,
+    json_value,
+)
+from mtgsqlive.transforms import NESTED_KEYS, get_row_converter, modify_for_sql_insert
+
+
+@pytest.fixture
+def sql_connection() -> sqlite3.Connection:
+    """
+    :return: Database with a table of every kind of column
+    """
+    sql_connection = sqlite3.connect(":memory:")
+    sql_connection.execute(
+        "CREATE TABLE cards ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "name TEXT,"
+        "number INTEGER,"
+        "isReserved INTEGER NOT NULL DEFAULT 0,"
+        "colors TEXT,"
+        "leadershipSkills TEXT"
+        ")"
+    )
+    return sql_connection
+
+
+def test_column_coercions(sql_connection: sqlite3.Connection) -> None:
+    assert get_column_coercions(sql_connection, "cards") == {
+        "id": None,
+        "name": None,
+        "number": None,
+        "isReserved": int_flag,
+        "colors": join_list,
+        "leadershipSkills": json_value,
+    }
+
+
+def test_converter_coerces_values(sql_connection: sqlite3.Connection) -> None:
+    convert = compile_row_converter(
+        "cards", get_column_coercions(sql_connection, "cards"), ("rulings",)
+    )
+    card = {
+        "name": "Card",
+        "number": 7,
+        "isReserved": True,
+        "colors": ["W", "U"],
+        "leadershipSkills": {"brawl": False},
+        "rulings": [{"text": "Handled elsewhere."}],
+    }
+
+    assert convert(card, {"setCode": "S000"}) == {
+        "setCode": "S000",
+        "name": "Card",
+        "number": 7,
+        "isReserved": 1,
+        "colors": "W, U",
+        "leadershipSkills": '{"brawl": false}',
+    }
+    assert convert({"colors": [], "leadershipSkills": {}}, {}) == {
+        "colors": None,
+        "leadershipSkills": None,
+    }
+
+
+def test_converter_drops_unknown_keys_once(
+    sql_connection: sqlite3.Connection, caplog: pytest.LogCaptureFixture
+) -> None:
+    convert = compile_row_converter(
+        "cards", get_column_coercions(sql_connection, "cards")
+    )
+
+    with caplog.at_level(logging.WARNING):
+        rows = [convert({"name": "Card", "newKey": 1}, {}) for _ in range(3)]
+
+    assert rows == [{"name": "Card"}] * 3
+    assert [record.getMessage() for record in caplog.records] == [
+        "Dropping key newKey, cards has no column for it"
+    ]
+
+
+def test_converter_raises_on_unknown_keys(sql_connection: sqlite3.Connection) -> None:
+    convert = compile_row_converter(
+        "cards",
+        get_column_coercions(sql_connection, "cards"),
+        unknown_key_policy="error",
+    )
+
+    with pytest.raises(ValueError, match="newKey"):
+        convert({"name": "Card", "newKey": 1}, {})
+
+
+def test_converter_rejects_unknown_policy(sql_connection: sqlite3.Connection) -> None:
+    with pytest.raises(ValueError, match="ignore"):
+        compile_row_converter(
+            "cards",
+            get_column_coercions(sql_connection, "cards"),
+            unknown_key_policy="ignore",
+        )
+
+
+@pytest.mark.parametrize("table", ["cards", "tokens"])
+def test_converter_matches_generic_coercion(corpus: Corpus, table: str) -> None:
+    convert = get_row_converter(table)
+    for set_data in corpus.all_sets.values():
+        for data in set_data[table]:
+            expected: Dict[str, Any] = {
+                key: modify_for_sql_insert(value)
+                for key, value in data.items()
+                if key not in NESTED_KEYS[table]
+            }
+            assert convert(data, {}) == expected
@@ -0,0 +1,47 @@
+"""
+Whole file decoders and the incremental reader
+"""
+import gzip
+import io
+import pathlib
+
+import pytest
+
+from conftest import Corpus
+from mtgsqlive import json_stream
+from mtgsqlive.json_stream import (
+    JSON_DECODERS,
+    JsonStreamReader,
+    get_json_decoder,
+    iter_sets,
+    load_json_file,
+    load_orjson,
+)
+
+
+@pytest.mark.parametrize("decoder", list(JSON_DECODERS))
+def test_decoders_agree(corpus: Corpus, tmp_path: pathlib.Path, decoder: str) -> None:
+    compressed = tmp_path.joinpath("AllSets.json.gz")
+    compressed.write_bytes(gzip.compress(corpus.all_sets_file.read_bytes()))
+
+    assert load_json_file(corpus.all_sets_file, decoder) == corpus.all_sets
+    assert load_json_file(compressed, decoder) == corpus.all_sets
+
+
+def test_streamed_sets_match_the_whole_file(corpus: Corpus) -> None:
+    with corpus.all_sets_file.open(encoding="utf8") as json_file:
+        assert dict(iter_sets(json_file)) == corpus.all_sets
+    # Tiny chunks cut values off everywhere
+    stream = io.StringIO(corpus.all_sets_file.read_text(encoding="utf8"))
+    assert JsonStreamReader(stream, chunk_size=7).read_value() == corpus.all_sets
+
+
+def test_unknown_decoder() -> None:
+    with pytest.raises(ValueError, match="simdjson"):
+        get_json_decoder("simdjson")
+
+
+def test_orjson_missing(monkeypatch: pytest.MonkeyPatch, corpus: Corpus) -> None:
+    monkeypatch.setattr(json_stream, "orjson", None)
+    with pytest.raises(ImportError, match="pip3 install orjson"):
+        load_orjson(corpus.all_sets_file)
@@ -0,0 +1,289 @@
+"""
+Read-side lookups: connection pool, result cache and reopening a
+replaced database file
+"""
+import collections
+import copy
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from conftest import Builder, Corpus, write_input
+from mtgsqlive.query import (
+    BATCH_SIZE,
+    CardDatabase,
+    ConnectionPool,
+    PricePoint,
+    ResultCache,
+)
+
+
+@pytest.fixture
+def db_file(corpus: Corpus, build: Builder, tmp_path: pathlib.Path) -> pathlib.Path:
+    """
+    :return: Default build of the fixture corpus
+    """
+    return build(corpus.all_sets_file, tmp_path.joinpath("out.sqlite"))
+
+
+def set_name(database: CardDatabase, set_code: str) -> Optional[str]:
+    """
+    :param database: Database to read
+    :param set_code: Set code
+    :return: Name of the set, None if unknown
+    """
+    card_set = database.card_set(set_code)
+    return card_set["name"] if card_set else None
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    cache = ResultCache(2)
+    cache.put("a", 1, cache.generation)
+    cache.put("b", 2, cache.generation)
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3, cache.generation)
+
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_cache_drops_results_loaded_before_a_clear() -> None:
+    cache = ResultCache()
+    generation = cache.generation
+    cache.put("kept", 1, generation)
+    cache.clear()
+    # Loaded from the old file, stored after the clear
+    cache.put("stale", 2, generation)
+    cache.put("fresh", 3, cache.generation)
+
+    assert len(cache) == 1
+    assert cache.get("kept") == (False, None)
+    assert cache.get("stale") == (False, None)
+    assert cache.get("fresh") == (True, 3)
+
+
+def test_cache_of_size_zero_keeps_nothing() -> None:
+    cache = ResultCache(0)
+    cache.put("a", 1, cache.generation)
+    assert cache.get("a") == (False, None)
+
+
+def test_pool_reuses_connections(db_file: pathlib.Path) -> None:
+    pool = ConnectionPool(db_file, size=2)
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+    # The last one returned, whose pages are most likely cached
+    with pool.connection() as reused:
+        assert reused is first
+    pool.close()
+
+
+def test_pool_blocks_while_every_connection_is_used(db_file: pathlib.Path) -> None:
+    pool = ConnectionPool(db_file, size=1)
+    borrowed = threading.Event()
+
+    def borrow() -> None:
+        with pool.connection():
+            borrowed.set()
+
+    with pool.connection():
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        assert not borrowed.wait(0.2)
+    assert borrowed.wait(5)
+    thread.join()
+    pool.close()
+
+
+def test_pool_reset_closes_connections_in_use(db_file: pathlib.Path) -> None:
+    pool = ConnectionPool(db_file, size=2)
+    with pool.connection() as in_use:
+        with pool.connection() as idle:
+            pass
+    with pool.connection() as borrowed:
+        assert borrowed is in_use
+        pool.reset()
+        with pytest.raises(sqlite3.ProgrammingError):
+            idle.execute("SELECT 1")
+        # Still usable until it is returned
+        in_use.execute("SELECT 1")
+    with pytest.raises(sqlite3.ProgrammingError):
+        in_use.execute("SELECT 1")
+
+    with pool.connection() as reopened:
+        assert reopened.execute("SELECT COUNT(*) FROM sets").fetchone() == (5,)
+    pool.close()
+
+
+def test_pool_needs_a_connection(db_file: pathlib.Path) -> None:
+    with pytest.raises(ValueError):
+        ConnectionPool(db_file, size=0)
+
+
+def test_lookups(corpus: Corpus, db_file: pathlib.Path) -> None:
+    set_code, set_data = next(iter(corpus.all_sets.items()))
+    card = set_data["cards"][0]
+
+    with CardDatabase(db_file) as database:
+        assert set_name(database, set_code) == set_data["name"]
+        assert database.card_set("NOPE") is None
+        card_row = database.card(card["uuid"])
+        assert card_row and card_row["name"] == card["name"]
+        assert database.card("unknown") is None
+        named = database.cards_named(card["name"], set_code)
+        assert [row["uuid"] for row in named] == [card["uuid"]]
+        assert len(database.cards_in_set(set_code)) == len(set_data["cards"])
+        assert [tuple(ruling) for ruling in database.rulings(card["uuid"])] == sorted(
+            (ruling["date"], ruling["text"]) for ruling in card["rulings"]
+        )
+        assert database.price_history(card["uuid"]) == sorted(
+            PricePoint(price_type, date, price)
+            for price_type, series in card["prices"].items()
+            for date, price in series.items()
+        )
+        assert database.has_table("cards")
+        assert not database.has_table("cards_search")
+
+
+def test_lookups_are_cached(corpus: Corpus, db_file: pathlib.Path) -> None:
+    card = next(iter(corpus.all_sets.values()))["cards"][0]
+
+    with CardDatabase(db_file) as database:
+        first = database.card(card["uuid"])
+        assert database.card(card["uuid"]) is first
+        assert (database.cache.hits, database.cache.misses) == (1, 1)
+
+
+def test_replaced_file_is_reopened(
+    corpus: Corpus, build: Builder, db_file: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    set_code = next(iter(corpus.all_sets))
+    all_sets = copy.deepcopy(corpus.all_sets)
+    all_sets[set_code]["name"] = "Renamed Set"
+    new_build = build(
+        write_input(all_sets, tmp_path.joinpath("AllSets.new.json")),
+        tmp_path.joinpath("new.sqlite"),
+    )
+
+    with CardDatabase(db_file, check_interval=0) as database:
+        assert set_name(database, set_code) == corpus.all_sets[set_code]["name"]
+        os.replace(str(new_build), str(db_file))
+
+        assert set_name(database, set_code) == "Renamed Set"
+        assert database.pool.generation == 1
+
+
+def test_replaced_file_is_checked_once_per_interval(
+    corpus: Corpus, build: Builder, db_file: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    set_code = next(iter(corpus.all_sets))
+    new_build = build(corpus.all_sets_file, tmp_path.joinpath("new.sqlite"))
+
+    with CardDatabase(db_file, check_interval=3600) as database:
+        database.card_set(set_code)
+        os.replace(str(new_build), str(db_file))
+        database.card_set(set_code)
+        assert database.pool.generation == 0
+        assert database.cache.hits == 1
+
+
+def all_cards(corpus: Corpus) -> List[Dict[str, Any]]:
+    """
+    :param corpus: Fixture corpus
+    :return: Cards of every set
+    """
+    return [card for set_data in corpus.all_sets.values() for card in set_data["cards"]]
+
+
+def test_batches_span_padded_statements(
+    corpus: Corpus, db_file: pathlib.Path
+) -> None:
+    uuids = [card["uuid"] for card in all_cards(corpus)]
+    # Unknown keys first, so the known ones straddle two padded statements
+    unknown = [f"unknown-{index}" for index in range(BATCH_SIZE - len(uuids) // 2)]
+    keys = unknown + uuids + uuids[:5]
+    assert len(set(keys)) > BATCH_SIZE
+
+    uncached = CardDatabase(db_file, cache_size=0)
+    with CardDatabase(db_file) as database, uncached:
+        cards = database.cards(keys)
+        assert cards == {uuid: uncached.card(uuid) for uuid in uuids}
+
+        # Batches fill the entries of single lookups, unknown keys included
+        misses = database.cache.misses
+        assert database.card(uuids[-1]) is cards[uuids[-1]]
+        assert database.card(unknown[0]) is None
+        assert database.cache.misses == misses
+
+
+def test_card_bundles(corpus: Corpus, db_file: pathlib.Path) -> None:
+    cards = all_cards(corpus)
+
+    uncached = CardDatabase(db_file, cache_size=0)
+    with CardDatabase(db_file) as database, uncached:
+        bundles = database.card_bundles(card["uuid"] for card in cards)
+        assert len(bundles) == len(cards)
+        for card in cards:
+            bundle = bundles[card["uuid"]]
+            assert bundle.card == uncached.card(card["uuid"])
+            assert bundle.legalities == card["legalities"]
+            assert bundle.rulings == uncached.rulings(card["uuid"])
+            assert bundle.prices == uncached.price_history(card["uuid"])
+            assert sorted(row["name"] for row in bundle.foreign_data) == sorted(
+                foreign["name"] for foreign in card["foreignData"]
+            )
+
+
+def test_card_bundles_fetch_only_the_given_parts(
+    corpus: Corpus, db_file: pathlib.Path
+) -> None:
+    card = next(iter(corpus.all_sets.values()))["cards"][0]
+
+    with CardDatabase(db_file) as database:
+        bundles = database.card_bundles([card["uuid"]], parts=["legalities"])
+        bundle = bundles[card["uuid"]]
+        assert bundle.legalities == card["legalities"]
+        assert (bundle.rulings, bundle.prices, bundle.foreign_data) == ([], [], [])
+        with pytest.raises(ValueError, match="deckList"):
+            database.card_bundles([card["uuid"]], parts=["deckList"])
+
+
+def test_card_bundles_named(corpus: Corpus, db_file: pathlib.Path) -> None:
+    printings: Dict[str, List[str]] = collections.defaultdict(list)
+    for card in all_cards(corpus):
+        printings[card["name"]].append(card["uuid"])
+    reprinted = next(name for name, uuids in printings.items() if len(uuids) > 1)
+
+    with CardDatabase(db_file) as database:
+        bundles = database.card_bundles_named([reprinted, "Unknown Card"])
+        assert list(bundles) == [reprinted]
+        assert sorted(bundle.card["uuid"] for bundle in bundles[reprinted]) == sorted(
+            printings[reprinted]
+        )
+
+
+def test_current_prices(corpus: Corpus, build: Builder, tmp_path: pathlib.Path) -> None:
+    db_file = build(
+        corpus.all_sets_file, tmp_path.joinpath("out.sqlite"), "--price-summaries"
+    )
+    cards = all_cards(corpus)
+
+    with CardDatabase(db_file) as database:
+        summaries = database.current_prices(card["uuid"] for card in cards)
+        for card in cards:
+            latest = {
+                price_type: series[max(series)]
+                for price_type, series in card["prices"].items()
+                if series
+            }
+            summary = summaries.get(card["uuid"], {})
+            assert {
+                price_type: row["latestPrice"] for price_type, row in summary.items()
+            } == latest
@@ -0,0 +1,311 @@
+"""
+HTTP query server: routing, ETags, coalesced lookups and switching to
+a new build of the database file
+"""
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import pathlib
+import time
+import urllib.parse
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import pytest
+
+from conftest import Builder, Corpus, write_input
+from mtgsqlive import server as server_module
+from mtgsqlive.query import CardDatabase
+from mtgsqlive.server import ROUTES, QueryServer, Response, RouteRequest
+
+# (status, headers with lower case names, body)
+HttpResponse = Tuple[int, Dict[str, str], bytes]
+
+
+@pytest.fixture
+def db_file(corpus: Corpus, build: Builder, tmp_path: pathlib.Path) -> pathlib.Path:
+    """
+    :return: Build of the fixture corpus with every optional lookup
+    """
+    return build(
+        corpus.all_sets_file,
+        tmp_path.joinpath("out.sqlite"),
+        "--search",
+        "--price-summaries",
+    )
+
+
+@contextlib.asynccontextmanager
+async def running(server: QueryServer) -> AsyncIterator[int]:
+    """
+    Serve on a free port until the block is left
+    :param server: Server to run
+    :return: Its port
+    """
+    task = asyncio.ensure_future(server.serve("127.0.0.1", 0))
+    try:
+        while server.port is None:
+            assert not task.done(), task.exception()
+            await asyncio.sleep(0.01)
+        yield server.port
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def fetch(
+    port: int, target: str, method: str = "GET", headers: Tuple[str, ...] = ()
+) -> HttpResponse:
+    """
+    :param port: Server port
+    :param target: Path and query
+    :param method: HTTP method
+    :param headers: Further header lines
+    :return: Response
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head_lines = [f"{method} {target} HTTP/1.1", "Host: localhost", "Connection: close"]
+    writer.write(("\r\n".join(head_lines + list(headers)) + "\r\n\r\n").encode())
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    response_headers = {
+        name.strip().lower(): value.strip()
+        for name, _, value in (line.partition(":") for line in header_lines)
+    }
+    assert int(response_headers["content-length"]) == len(body) or method == "HEAD"
+    return int(status_line.split()[1]), response_headers, body
+
+
+async def fetch_json(port: int, target: str) -> Tuple[int, Any]:
+    """
+    :param port: Server port
+    :param target: Path and query
+    :return: Status and decoded body
+    """
+    status, _, body = await fetch(port, target)
+    return status, json.loads(body)
+
+
+def test_routes(corpus: Corpus, db_file: pathlib.Path) -> None:
+    set_code, set_data = next(iter(corpus.all_sets.items()))
+    card = set_data["cards"][0]
+    uuids = ",".join(card["uuid"] for card in set_data["cards"][:3])
+    goblins = {
+        card["uuid"]
+        for set_data in corpus.all_sets.values()
+        for card in set_data["cards"]
+        if "Goblin" in card["name"]
+    }
+
+    async def scenario() -> None:
+        async with running(QueryServer(db_file, watch_interval=0)) as port:
+            status, body = await fetch_json(port, f"/cards/{card['uuid']}")
+            assert (status, body["name"]) == (200, card["name"])
+            status, body = await fetch_json(port, f"/cards?uuids={uuids}")
+            assert (status, len(body)) == (200, 3)
+            query = urllib.parse.urlencode({"name": card["name"], "set": set_code})
+            status, body = await fetch_json(port, f"/cards?{query}")
+            assert (status, [row["uuid"] for row in body]) == (200, [card["uuid"]])
+            status, body = await fetch_json(port, f"/sets/{set_code}")
+            assert (status, body["name"]) == (200, set_data["name"])
+            assert len(body["cards"]) == len(set_data["cards"])
+            status, body = await fetch_json(port, f"/legalities?uuids={uuids}")
+            assert (status, body[card["uuid"]]) == (200, card["legalities"])
+            status, body = await fetch_json(port, f"/prices/{card['uuid']}")
+            assert (status, len(body)) == (200, len(card["prices"]["paperFoil"]))
+            status, body = await fetch_json(port, f"/prices?uuids={uuids}")
+            assert (status, sorted(body[card["uuid"]])) == (200, sorted(card["prices"]))
+            status, body = await fetch_json(port, "/search?q=Goblin&limit=100")
+            assert status == 200
+            assert goblins and {row["uuid"] for row in body} >= goblins
+
+            for target, expected_status in [
+                ("/cards/unknown", 404),
+                ("/sets/NOPE", 404),
+                ("/nope", 404),
+                ("/cards/a/b", 404),
+                ("/cards", 400),
+                ("/search", 400),
+                ("/search?q=Goblin&limit=many", 400),
+                ("/legalities?uuids=" + ",".join(["x"] * 501), 400),
+            ]:
+                status, body = await fetch_json(port, target)
+                assert (status, sorted(body)) == (expected_status, ["error"]), target
+
+            status, _, _ = await fetch(port, "/cards", method="POST")
+            assert status == 405
+
+    asyncio.run(scenario())
+
+
+def test_optional_tables_missing(
+    corpus: Corpus, build: Builder, tmp_path: pathlib.Path
+) -> None:
+    db_file = build(corpus.all_sets_file, tmp_path.joinpath("out.sqlite"))
+
+    async def scenario() -> None:
+        async with running(QueryServer(db_file, watch_interval=0)) as port:
+            status, body = await fetch_json(port, "/search?q=Goblin")
+            assert status == 404
+            assert "--search" in body["error"]
+            status, body = await fetch_json(port, "/prices?uuids=x")
+            assert status == 404
+            assert "--price-summaries" in body["error"]
+
+    asyncio.run(scenario())
+
+
+def test_etags(corpus: Corpus, db_file: pathlib.Path) -> None:
+    set_code = next(iter(corpus.all_sets))
+
+    async def scenario() -> None:
+        async with running(QueryServer(db_file, watch_interval=0)) as port:
+            status, headers, body = await fetch(port, f"/sets/{set_code}")
+            etag = headers["etag"]
+            assert status == 200 and body
+
+            for if_none_match in (etag, f"W/{etag}", f'"other", {etag}'):
+                status, _, body = await fetch(
+                    port,
+                    f"/sets/{set_code}",
+                    headers=(f"If-None-Match: {if_none_match}",),
+                )
+                assert (status, body) == (304, b"")
+
+            status, headers, _ = await fetch(
+                port, "/sets/NOPE", headers=(f"If-None-Match: {etag}",)
+            )
+            assert status == 404
+            assert "etag" not in headers
+
+            status, headers, body = await fetch(port, f"/sets/{set_code}", "HEAD")
+            assert (status, headers["etag"], body) == (200, etag, b"")
+
+    asyncio.run(scenario())
+
+
+def test_identical_requests_share_one_lookup(
+    monkeypatch: pytest.MonkeyPatch, corpus: Corpus, db_file: pathlib.Path
+) -> None:
+    set_code = next(iter(corpus.all_sets))
+    answer = server_module.answer
+    lookups: List[str] = []
+
+    def slow_answer(
+        database: CardDatabase, path: str, parameters: Dict[str, str]
+    ) -> Response:
+        lookups.append(path)
+        time.sleep(0.2)
+        return answer(database, path, parameters)
+
+    monkeypatch.setattr(server_module, "answer", slow_answer)
+
+    async def scenario() -> None:
+        server = QueryServer(db_file, cache_size=0, watch_interval=0)
+        async with running(server) as port:
+            responses = await asyncio.gather(
+                *(fetch(port, f"/sets/{set_code}") for _ in range(5))
+            )
+            assert lookups == [f"/sets/{set_code}"]
+            assert len({body for _, _, body in responses}) == 1
+
+            # Nothing cached, so the next request reads again
+            await fetch(port, f"/sets/{set_code}")
+            assert len(lookups) == 2
+
+    asyncio.run(scenario())
+
+
+def test_responses_are_cached(
+    monkeypatch: pytest.MonkeyPatch, corpus: Corpus, db_file: pathlib.Path
+) -> None:
+    set_code = next(iter(corpus.all_sets))
+    answer = server_module.answer
+    lookups: List[str] = []
+
+    def counting_answer(
+        database: CardDatabase, path: str, parameters: Dict[str, str]
+    ) -> Response:
+        lookups.append(path)
+        return answer(database, path, parameters)
+
+    monkeypatch.setattr(server_module, "answer", counting_answer)
+
+    async def scenario() -> None:
+        async with running(QueryServer(db_file, watch_interval=0)) as port:
+            first = await fetch(port, f"/sets/{set_code}?b=2&a=1")
+            # The same query, in another order
+            second = await fetch(port, f"/sets/{set_code}?a=1&b=2")
+            assert first[2] == second[2]
+            assert len(lookups) == 1
+
+    asyncio.run(scenario())
+
+
+def test_unexpected_errors_are_answered(
+    monkeypatch: pytest.MonkeyPatch, corpus: Corpus, db_file: pathlib.Path
+) -> None:
+    card = next(iter(corpus.all_sets.values()))["cards"][0]
+    failures: List[str] = []
+
+    def failing_route(database: CardDatabase, request: RouteRequest) -> Response:
+        failures.append(request.key)
+        time.sleep(0.2)
+        raise ValueError("Bad row")
+
+    monkeypatch.setitem(ROUTES, ("cards", True), failing_route)
+
+    async def scenario() -> None:
+        async with running(QueryServer(db_file, watch_interval=0)) as port:
+            responses = await asyncio.gather(
+                *(fetch(port, f"/cards/{card['uuid']}") for _ in range(3))
+            )
+            for status, _, body in responses:
+                assert (status, json.loads(body)) == (500, {"error": "Internal error"})
+            assert failures == [card["uuid"]]
+
+            # Not cached
+            status, _, _ = await fetch(port, f"/cards/{card['uuid']}")
+            assert status == 500
+            assert len(failures) == 2
+
+    asyncio.run(scenario())
+
+
+def test_new_builds_are_swapped_in(
+    corpus: Corpus, build: Builder, db_file: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    set_code = next(iter(corpus.all_sets))
+    all_sets = copy.deepcopy(corpus.all_sets)
+    all_sets[set_code]["name"] = "Renamed Set"
+    new_build = build(
+        write_input(all_sets, tmp_path.joinpath("AllSets.new.json")),
+        tmp_path.joinpath("new.sqlite"),
+    )
+
+    async def scenario() -> None:
+        server = QueryServer(db_file, watch_interval=0.05)
+        async with running(server) as port:
+            _, headers, body = await fetch(port, f"/sets/{set_code}")
+            assert json.loads(body)["name"] == corpus.all_sets[set_code]["name"]
+
+            os.replace(str(new_build), str(db_file))
+            deadline = time.monotonic() + 10
+            while not server.swap_count:
+                assert time.monotonic() < deadline, "New build not swapped in"
+                await asyncio.sleep(0.05)
+
+            status, new_headers, body = await fetch(
+                port,
+                f"/sets/{set_code}",
+                headers=(f"If-None-Match: {headers['etag']}",),
+            )
+            assert status == 200
+            assert json.loads(body)["name"] == "Renamed Set"
+            assert new_headers["etag"] != headers["etag"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,121 @@
+"""
+Shard databases merge into the same contents as a single process build
+"""
+import json
+import pathlib
+import sqlite3
+from typing import List
+
+import pytest
+
+from conftest import Builder, ContentReader, Corpus
+from mtgsqlive.shards import partition_by_size
+
+LAYOUTS = [
+    [],
+    ["--card-ids", "--prices", "packed"],
+    ["--interned", "--card-lists", "--price-summaries"],
+]
+
+
+@pytest.mark.parametrize("layout", LAYOUTS, ids=lambda layout: " ".join(layout))
+def test_shard_merge_matches_fresh_build(
+    corpus: Corpus,
+    build: Builder,
+    contents: ContentReader,
+    tmp_path: pathlib.Path,
+    layout: List[str],
+) -> None:
+    sharded = build(
+        corpus.set_files_dir,
+        tmp_path.joinpath("sharded.sqlite"),
+        "--jobs",
+        "2",
+        "--shard",
+        *layout,
+    )
+    fresh = build(corpus.all_sets_file, tmp_path.joinpath("fresh.sqlite"), *layout)
+
+    sharded_contents = contents(sharded)
+    fresh_contents = contents(fresh)
+    assert sharded_contents.keys() == fresh_contents.keys()
+    for table, rows in fresh_contents.items():
+        assert sharded_contents[table] == rows, table
+
+
+def test_shard_merge_remaps_lookup_ids(
+    corpus: Corpus, build: Builder, tmp_path: pathlib.Path
+) -> None:
+    sharded = build(
+        corpus.set_files_dir,
+        tmp_path.joinpath("sharded.sqlite"),
+        "--jobs",
+        "2",
+        "--shard",
+        "--interned",
+    )
+
+    sql_connection = sqlite3.connect(str(sharded))
+    set_codes = sql_connection.execute(
+        "SELECT DISTINCT setCode FROM cards ORDER BY setCode"
+    ).fetchall()
+    dangling = sql_connection.execute(
+        "SELECT COUNT(*) FROM cards_interned "
+        "WHERE setCodeId NOT IN (SELECT id FROM set_codes)"
+    ).fetchone()
+    sql_connection.close()
+    assert [code for (code,) in set_codes] == sorted(corpus.all_sets)
+    assert dangling == (0,)
+
+
+def test_partition_balances_bytes(tmp_path: pathlib.Path) -> None:
+    paths = []
+    for name, size in [("A", 50), ("B", 40), ("C", 30), ("D", 20), ("E", 10)]:
+        path = tmp_path.joinpath(f"{name}.json")
+        path.write_bytes(b" " * size)
+        paths.append(path)
+    a_file, b_file, c_file, d_file, e_file = paths
+
+    assert partition_by_size(paths, 2) == [[a_file, d_file, e_file], [b_file, c_file]]
+    assert partition_by_size(paths, 3) == [[a_file], [b_file, e_file], [c_file, d_file]]
+    # More shards than files: the empty ones are dropped
+    assert partition_by_size(paths, 8) == [[path] for path in paths]
+    assert partition_by_size([], 2) == []
+
+
+@pytest.mark.parametrize("jobs", ["3", "8"])
+def test_uneven_shards(
+    corpus: Corpus,
+    build: Builder,
+    contents: ContentReader,
+    tmp_path: pathlib.Path,
+    jobs: str,
+) -> None:
+    # 5 sets: the last of 3 shards gets one set, 8 jobs make 5 shards
+    metrics_file = tmp_path.joinpath("metrics.json")
+    sharded = build(
+        corpus.set_files_dir,
+        tmp_path.joinpath("sharded.sqlite"),
+        "--jobs",
+        jobs,
+        "--shard",
+        "--interned",
+        "--metrics",
+        str(metrics_file),
+    )
+    fresh = build(corpus.all_sets_file, tmp_path.joinpath("fresh.sqlite"), "--interned")
+    assert contents(sharded) == contents(fresh)
+
+    with metrics_file.open(encoding="utf8") as json_file:
+        merged_counts = json.load(json_file)["tables"]
+    sql_connection = sqlite3.connect(str(sharded))
+    for table in ("sets", "cards_interned", "card_foreignData", "set_codes"):
+        query = f"SELECT COUNT(*) FROM `{table}`"
+        (row_count,) = sql_connection.execute(query).fetchone()
+        assert merged_counts[table] == row_count, table
+    sql_connection.close()
+    assert merged_counts["cards_interned"] == sum(
+        len(set_data["cards"]) for set_data in corpus.all_sets.values()
+    )
+    # The shards are removed once merged
+    assert [path.name for path in tmp_path.iterdir() if path.is_dir()] == []
@@ -0,0 +1,170 @@
+"""
+--update brings an existing build in line with a new input
+"""
+import copy
+import functools
+import pathlib
+import sqlite3
+from typing import Any, Dict, List
+
+import pytest
+
+from conftest import Builder, ContentReader, Corpus, write_input
+from mtgsqlive.schema import detect_build_options
+from mtgsqlive.sql_writer import RowBuffer
+from mtgsqlive.transforms import sql_insert_set
+from mtgsqlive.update import update_database
+
+ADDED_CARD_UUID = "00000000-0000-0000-0000-00000000adde"
+
+LAYOUTS = [
+    [],
+    ["--card-ids", "--prices", "compact", "--legalities", "wide"],
+    ["--prices", "packed"],
+    ["--interned", "--card-lists", "--price-summaries"],
+]
+
+
+def write_changed_input(corpus: Corpus, output_dir: pathlib.Path) -> pathlib.Path:
+    """
+    Change the fixture corpus the ways an MTGJSON release does: edited,
+    added and removed cards, a card moved to another set, a renamed
+    set, a removed set and a new one
+    :param corpus: Fixture corpus
+    :param output_dir: Directory to write into
+    :return: Changed AllSets.json
+    """
+    all_sets = copy.deepcopy(corpus.all_sets)
+    first, second, third, fourth = list(all_sets)[:4]
+
+    cards = all_sets[first]["cards"]
+    cards[0]["text"] = "Changed rules text."
+    cards[0]["artist"] = "Brand New Artist"
+    series = next(iter(cards[1]["prices"].values()))
+    series[next(iter(series))] = 123.45
+    del cards[2]
+    added_card = copy.deepcopy(cards[3])
+    added_card.update(uuid=ADDED_CARD_UUID, name="Added Card", number="999")
+    cards.append(added_card)
+    # The card moves to a set that is updated before its old one
+    cards.append(all_sets[fourth]["cards"].pop(0))
+
+    all_sets[second]["name"] = "Renamed Set"
+    del all_sets[third]
+
+    new_set = copy.deepcopy(all_sets[fourth])
+    new_set.update(code="NEW", name="New Set", cards=[], tokens=[])
+    all_sets["NEW"] = new_set
+
+    return write_input(all_sets, output_dir.joinpath("AllSets.changed.json"))
+
+
+@pytest.mark.parametrize("layout", LAYOUTS, ids=lambda layout: " ".join(layout))
+def test_update_matches_fresh_build(
+    corpus: Corpus,
+    build: Builder,
+    contents: ContentReader,
+    tmp_path: pathlib.Path,
+    layout: List[str],
+) -> None:
+    changed_file = write_changed_input(corpus, tmp_path)
+    updated = build(corpus.all_sets_file, tmp_path.joinpath("updated.sqlite"), *layout)
+    build(changed_file, updated, "--update")
+    fresh = build(changed_file, tmp_path.joinpath("fresh.sqlite"), *layout)
+
+    updated_contents = contents(updated)
+    fresh_contents = contents(fresh)
+    assert updated_contents.keys() == fresh_contents.keys()
+    for table, rows in fresh_contents.items():
+        assert updated_contents[table] == rows, table
+
+
+@pytest.mark.parametrize("layout", [[], ["--card-ids"], ["--interned"]])
+def test_update_moves_cards_between_sets(
+    corpus: Corpus, build: Builder, tmp_path: pathlib.Path, layout: List[str]
+) -> None:
+    changed_file = write_changed_input(corpus, tmp_path)
+    first, _, _, fourth = list(corpus.all_sets)[:4]
+    moved_card = corpus.all_sets[fourth]["cards"][0]
+    updated = build(corpus.all_sets_file, tmp_path.joinpath("out.sqlite"), *layout)
+    build(changed_file, updated, "--update")
+
+    sql_connection = sqlite3.connect(str(updated))
+    card_sets = dict(
+        sql_connection.execute(
+            "SELECT uuid, setCode FROM cards WHERE uuid IN (?, ?)",
+            (moved_card["uuid"], ADDED_CARD_UUID),
+        )
+    )
+    (foreign_count,) = sql_connection.execute(
+        "SELECT COUNT(*) FROM foreignData WHERE uuid = ?", (moved_card["uuid"],)
+    ).fetchone()
+    sql_connection.close()
+    assert card_sets == {moved_card["uuid"]: first, ADDED_CARD_UUID: first}
+    assert foreign_count == len(moved_card["foreignData"])
+
+
+def test_update_removes_unused_lookup_values(
+    corpus: Corpus, build: Builder, tmp_path: pathlib.Path
+) -> None:
+    changed_file = write_changed_input(corpus, tmp_path)
+    removed_set = list(corpus.all_sets)[2]
+    updated = build(corpus.all_sets_file, tmp_path.joinpath("out.sqlite"), "--interned")
+    build(changed_file, updated, "--update")
+
+    sql_connection = sqlite3.connect(str(updated))
+    set_codes = {
+        name for (name,) in sql_connection.execute("SELECT name FROM set_codes")
+    }
+    artists = {name for (name,) in sql_connection.execute("SELECT name FROM artists")}
+    sql_connection.close()
+    assert removed_set not in set_codes
+    assert "Brand New Artist" in artists
+
+
+def run_update(db_file: pathlib.Path, input_file: pathlib.Path) -> List[str]:
+    """
+    Update a database, recording which sets get converted
+    :param db_file: Database to update
+    :param input_file: New input
+    :return: Codes of the converted sets
+    """
+    sql_connection = sqlite3.connect(str(db_file))
+    convert_set = functools.partial(
+        sql_insert_set,
+        record_hash=False,
+        options=detect_build_options(sql_connection),
+    )
+    converted: List[str] = []
+
+    def recording_converter(
+        set_code: str, set_data: Dict[str, Any], writer: RowBuffer
+    ) -> None:
+        converted.append(set_code)
+        convert_set(set_code, set_data, writer)
+
+    update_database(input_file, sql_connection, recording_converter)
+    sql_connection.close()
+    return converted
+
+
+def test_update_skips_unchanged_sets(
+    corpus: Corpus, build: Builder, tmp_path: pathlib.Path
+) -> None:
+    changed_file = write_changed_input(corpus, tmp_path)
+    first, second, _, fourth = list(corpus.all_sets)[:4]
+    db_file = build(
+        corpus.all_sets_file, tmp_path.joinpath("out.sqlite"), "--content-hashes"
+    )
+
+    assert run_update(db_file, corpus.all_sets_file) == []
+    assert run_update(db_file, changed_file) == [first, second, fourth, "NEW"]
+
+
+def test_update_records_hashes_of_builds_without_them(
+    corpus: Corpus, build: Builder, tmp_path: pathlib.Path
+) -> None:
+    db_file = build(corpus.all_sets_file, tmp_path.joinpath("out.sqlite"))
+
+    assert run_update(db_file, corpus.all_sets_file) == list(corpus.all_sets)
+    assert run_update(db_file, corpus.all_sets_file) == []